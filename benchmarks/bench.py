@@ -0,0 +1,272 @@
+"""Synthetic-scale benchmarks of the controller and recipe parsing.
+
+This generates a corpus of synthetic recipes whose actions are all no-op
+commands and times each phase of a run: parsing the recipes, initializing the
+controller, running it, and an end-to-end run via the command line interface.
+The timings and peak memory of each phase are written as JSON so that they can
+be compared between commits. Run it from the root of the repository, e.g.
+
+  python -m benchmarks.bench --recipes 500 --actions 40 -o before.json
+"""
+
+import dataclasses
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import click
+import dataclass_binder
+
+from setuppy import cli
+from setuppy.commands import register
+from setuppy.commands.base import BaseCommand
+from setuppy.commands.base import CommandResult
+from setuppy.controller import Controller
+from setuppy.types import Config
+from setuppy.types import Recipe
+
+
+# Tags are drawn from this many distinct names.
+NUM_TAGS = 20
+
+
+@dataclasses.dataclass
+class Noop(BaseCommand):
+  """A command which does nothing, so only setuppy's overhead is measured."""
+  changed: bool = True
+
+  def __call__(
+    self,
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> CommandResult:
+    """Do nothing."""
+    return CommandResult(changed=self.changed)
+
+
+def generate_corpus(
+  basedir: pathlib.Path,
+  *,
+  num_recipes: int,
+  num_actions: int,
+  depth: int,
+) -> list[str]:
+  """Write a synthetic corpus of recipes to basedir/recipes.
+
+  Each recipe has num_actions no-op actions, which are split into chains of
+  length depth where each action has the previous one as its parent. Some of
+  the recipes and actions are given a tag.
+
+  Returns:
+    The sorted list of tags used by the corpus.
+  """
+  recipedir = basedir / "recipes"
+  recipedir.mkdir(parents=True)
+  tags = set()
+
+  for r in range(num_recipes):
+    lines = [f'name = "recipe{r}"', f"priority = {r % 7}"]
+    if r % 3 == 0:
+      lines.append(f'tags = ["tag{r % NUM_TAGS}"]')
+      tags.add(f"tag{r % NUM_TAGS}")
+
+    for a in range(num_actions):
+      lines += [
+        "[[actions]]",
+        f'name = "action{r}.{a}"',
+        'kind = "noop"',
+        f"kwargs = {{changed = {'true' if a % 5 else 'false'}}}",
+      ]
+      if a % 4 == 0:
+        lines.append(f'tags = ["tag{(r + a) % NUM_TAGS}"]')
+        tags.add(f"tag{(r + a) % NUM_TAGS}")
+      if depth > 1:
+        lines.append(f'register = "r{r}.{a}"')
+        if a % depth:
+          lines.append(f'parents = ["r{r}.{a - 1}"]')
+
+    (recipedir / f"recipe{r}.toml").write_text("\n".join(lines) + "\n")
+
+  return sorted(tags)
+
+
+def measure(
+  func: Callable[[], Any],
+  *,
+  repeat: int,
+  memory: bool,
+) -> tuple[dict[str, float], Any]:
+  """Time func, taking the best of repeat runs, and measure its peak memory.
+
+  Returns:
+    A tuple (timings, rv) where timings holds the best and mean times in
+    seconds and the peak memory in bytes, and rv is the last return value.
+  """
+  times = []
+  rv = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    rv = func()
+    times.append(time.perf_counter() - start)
+
+  timings = {"best": min(times), "mean": sum(times) / len(times)}
+
+  # Measure memory in a separate run since tracing allocations is slow.
+  if memory:
+    tracemalloc.start()
+    try:
+      func()
+      _, timings["peak_memory"] = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+
+  return timings, rv
+
+
+def git_revision() -> str | None:
+  """Return the current git revision of setuppy, if known."""
+  try:
+    proc = subprocess.run(
+      ["git", "rev-parse", "HEAD"],
+      capture_output=True,
+      encoding="utf-8",
+      check=True,
+      cwd=pathlib.Path(__file__).parent,
+    )
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return proc.stdout.strip()
+
+
+@click.command
+@click.option(
+  "--recipes",
+  "num_recipes",
+  default=200,
+  show_default=True,
+  help="Number of recipes to generate.",
+)
+@click.option(
+  "--actions",
+  "num_actions",
+  default=50,
+  show_default=True,
+  help="Number of actions per recipe.",
+)
+@click.option(
+  "--depth",
+  default=10,
+  show_default=True,
+  help="Length of each chain of parents.",
+)
+@click.option(
+  "--repeat",
+  default=3,
+  show_default=True,
+  help="Number of times to run each phase.",
+)
+@click.option(
+  "--memory/--no-memory",
+  default=True,
+  show_default=True,
+  help="Measure the peak memory of each phase.",
+)
+@click.option(
+  "-o",
+  "output",
+  metavar="FILE",
+  help="Write the results to FILE rather than stdout.",
+)
+def main(
+  *,
+  num_recipes: int,
+  num_actions: int,
+  depth: int,
+  repeat: int,
+  memory: bool,
+  output: str | None,
+):
+  """Run the synthetic-scale benchmarks."""
+  register(Noop)
+  cwd = os.getcwd()
+
+  with tempfile.TemporaryDirectory(prefix="setuppy-bench-") as tmpdir:
+    basedir = pathlib.Path(tmpdir)
+    # Enable half of the tags used by the corpus.
+    tags = generate_corpus(
+      basedir,
+      num_recipes=num_recipes,
+      num_actions=num_actions,
+      depth=depth,
+    )
+    files = sorted((basedir / "recipes").glob("*.toml"))
+    tags = tags[::2]
+
+    def parse() -> list[Recipe]:
+      binder = dataclass_binder.Binder(Recipe)
+      return [binder.parse_toml(f) for f in files]
+
+    def init(recipes: list[Recipe]) -> Controller:
+      return Controller(
+        recipes=recipes,
+        tags=tags,
+        variables={},
+        config=Config(),
+        force_all_tags=False,
+        simulate=False,
+        verbosity=0,
+      )
+
+    def end_to_end():
+      args = ["-d", tmpdir, "--no-cache"] + [f"-t{tag}" for tag in tags]
+      try:
+        rv = cli.main.main(args, standalone_mode=False)
+      finally:
+        os.chdir(cwd)
+      if rv != 0:
+        raise click.ClickException("end-to-end run failed.")
+
+    phases = dict()
+    phases["parse"], recipes = measure(parse, repeat=repeat, memory=memory)
+    phases["init"], _ = measure(
+      lambda: init(recipes), repeat=repeat, memory=memory
+    )
+    # Each run needs a fresh controller since it records which actions ran,
+    # so create them up front to only time running them.
+    controllers = iter([init(recipes) for _ in range(repeat + memory)])
+    phases["run"], _ = measure(
+      lambda: next(controllers).run(), repeat=repeat, memory=memory
+    )
+    phases["cli"], _ = measure(end_to_end, repeat=repeat, memory=memory)
+
+  results = {
+    "revision": git_revision(),
+    "python": platform.python_version(),
+    "platform": sys.platform,
+    "parameters": {
+      "recipes": num_recipes,
+      "actions": num_actions,
+      "depth": depth,
+      "repeat": repeat,
+    },
+    "phases": phases,
+  }
+
+  text = json.dumps(results, indent=2) + "\n"
+  if output:
+    pathlib.Path(output).write_text(text)
+  else:
+    click.echo(text, nl=False)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,229 @@
+"""End-to-end benchmarks of full recipe runs against a fake system.
+
+This creates a `FakeSystem` and a set of recipes which use every kind of
+command, then times a cold run (where everything must be installed) followed by
+a warm run (where everything is already installed and the cache has been
+written and reloaded from disk). The timings of each run are written as JSON.
+Run it from the root of the repository, e.g.
+
+  python -m benchmarks.e2e --latency 0.2 --packages 20 -o before.json
+"""
+
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+
+import click
+import dataclass_binder
+
+from benchmarks.bench import git_revision
+from benchmarks.fakesys import TOOLS
+from benchmarks.fakesys import FakeSystem
+from benchmarks.fakesys import ToolConfig
+from setuppy.cache import Cache
+from setuppy.cache import get_cache
+from setuppy.cache import set_cache
+from setuppy.commands.utils import get_executor
+from setuppy.commands.utils import set_executor
+from setuppy.controller import Controller
+from setuppy.types import Config
+from setuppy.types import Recipe
+
+
+def write_recipes(basedir: pathlib.Path, fake: FakeSystem, packages: int):
+  """Write recipes using every kind of command to basedir."""
+  home = basedir / "home"
+  names = [f"pkg{i}" for i in range(packages)]
+
+  # Create a stow package and a template directory to install.
+  for name in names:
+    dotfile = basedir / "dotfiles" / name / f".{name}rc"
+    dotfile.parent.mkdir(parents=True)
+    dotfile.write_text(name)
+    template = basedir / "templates" / name / f".{name}"
+    template.parent.mkdir(parents=True)
+    template.write_text("{user}\n")
+
+  # Create the downloads and repositories.
+  urls = [
+    fake.add_tarball(f"{name}.tar.xz", {"README": name}) for name in names
+  ]
+  for name in names:
+    fake.add_remote(f"fake/{name}", {"README": name})
+
+  actions = [
+    {"name": "apt", "kind": "apt", "kwargs": {"packages": names}},
+    {"name": "brew", "kind": "brew", "kwargs": {"packages": names}},
+    {
+      "name": "curl",
+      "kind": "curl",
+      "kwargs": {"sources": urls, "dest": str(home / "opt")},
+    },
+    {
+      "name": "github",
+      "kind": "github",
+      "kwargs": {
+        "sources": [f"fake/{name}" for name in names],
+        "dest": str(home / "src"),
+      },
+    },
+    *[
+      {
+        "name": f"stow {name}",
+        "kind": "stow",
+        "kwargs": {"package": name, "targetdir": str(home), "native": True},
+      }
+      for name in names
+    ],
+    {
+      "name": "stow gnu",
+      "kind": "stow",
+      "kwargs": {
+        "packages": names,
+        "targetdir": str(home / "gnu"),
+        "native": False,
+      },
+    },
+    *[
+      {
+        "name": f"template {name}",
+        "kind": "template",
+        "kwargs": {"source": f"templates/{name}", "dest": str(home)},
+      }
+      for name in names
+    ],
+    {
+      "name": "command",
+      "kind": "command",
+      "kwargs": {"command": ["true"], "creates": str(home / ".done")},
+    },
+  ]
+
+  recipedir = basedir / "recipes"
+  recipedir.mkdir()
+  (recipedir / "e2e.json").write_text(
+    json.dumps({"name": "e2e", "actions": actions})
+  )
+
+
+def run(basedir: pathlib.Path) -> float:
+  """Parse and run the recipes under basedir, returning the elapsed time."""
+  start = time.perf_counter()
+  binder = dataclass_binder.Binder(Recipe)
+  recipe = binder.bind(
+    json.loads((basedir / "recipes" / "e2e.json").read_text())
+  )
+  Controller(
+    recipes=[recipe],
+    tags=[],
+    variables={},
+    config=Config(),
+    force_all_tags=False,
+    simulate=False,
+    verbosity=0,
+  ).run()
+  return time.perf_counter() - start
+
+
+@click.command
+@click.option(
+  "--latency",
+  default=0.1,
+  show_default=True,
+  help="Latency in seconds of every fake tool.",
+)
+@click.option(
+  "--output-lines",
+  default=100,
+  show_default=True,
+  help="Lines of output written by every fake tool.",
+)
+@click.option(
+  "--packages",
+  default=10,
+  show_default=True,
+  help="Number of packages, downloads, repositories, etc. to install.",
+)
+@click.option(
+  "--repeat",
+  default=3,
+  show_default=True,
+  help="Number of times to run each phase.",
+)
+@click.option(
+  "-o",
+  "output",
+  metavar="FILE",
+  help="Write the results to FILE rather than stdout.",
+)
+def main(
+  *,
+  latency: float,
+  output_lines: int,
+  packages: int,
+  repeat: int,
+  output: str | None,
+):
+  """Run the end-to-end benchmarks."""
+  config = ToolConfig(latency=latency, output_lines=output_lines)
+  cwd = os.getcwd()
+  old_cache = get_cache()
+  old_executor = get_executor()
+
+  times = {"cold": [], "warm": []}
+  for _ in range(repeat):
+    with (
+      tempfile.TemporaryDirectory(prefix="setuppy-e2e-") as tmpdir,
+      FakeSystem(
+        pathlib.Path(tmpdir) / "system",
+        tools={tool: config for tool in TOOLS},
+      ) as fake,
+    ):
+      basedir = pathlib.Path(tmpdir) / "base"
+      cachedir = pathlib.Path(tmpdir) / "cache"
+      write_recipes(basedir, fake, packages)
+      set_executor(fake.executor())
+      os.chdir(basedir)
+      try:
+        # Run with an empty cache and nothing installed.
+        set_cache(Cache(cachedir))
+        times["cold"].append(run(basedir))
+        get_cache().save()
+
+        # Run again in a "new process", reloading the cache from disk.
+        set_cache(Cache(cachedir))
+        times["warm"].append(run(basedir))
+      finally:
+        os.chdir(cwd)
+        set_cache(old_cache)
+        set_executor(old_executor)
+
+  results = {
+    "revision": git_revision(),
+    "python": platform.python_version(),
+    "platform": sys.platform,
+    "parameters": {
+      "latency": latency,
+      "output_lines": output_lines,
+      "packages": packages,
+      "repeat": repeat,
+    },
+    "phases": {
+      phase: {"best": min(ts), "mean": sum(ts) / len(ts)}
+      for phase, ts in times.items()
+    },
+  }
+
+  text = json.dumps(results, indent=2) + "\n"
+  if output:
+    pathlib.Path(output).write_text(text)
+  else:
+    click.echo(text, nl=False)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,77 @@
+"""Stand-in for the tools replaced by a `FakeSystem`.
+
+This is run by the stand-in executables written by `FakeSystem`, so it only
+imports the standard library in order to start quickly.
+"""
+
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+def run_tool(root: str, tool: str, args: list[str]) -> int:
+  """Run the stand-in for tool with the given arguments.
+
+  Returns:
+    The stand-in's exit code.
+  """
+  config = json.loads(pathlib.Path(root, "config.json").read_text())
+  tool_config = config["tools"][tool]
+
+  time.sleep(tool_config["latency"])
+  for i in range(tool_config["output_lines"]):
+    print(f"{tool}: output line {i}", file=sys.stderr)
+  if set(args) & set(tool_config["fail_on"]):
+    print(f"{tool}: injected failure", file=sys.stderr)
+    return 1
+
+  match tool:
+    case "sudo":
+      return subprocess.run(args, check=False).returncode
+
+    case "apt-get" | "dpkg-query":
+      status = pathlib.Path(root, "dpkg", "status")
+      installed = status.read_text().split()
+      if tool == "dpkg-query":
+        sys.stdout.write("".join(f"{p}\n" for p in installed))
+      elif args[:2] == ["-y", "install"]:
+        new = [p for p in args[2:] if p not in installed]
+        status.write_text("".join(f"{p}\n" for p in installed + new))
+      return 0
+
+    case "brew":
+      cellar = pathlib.Path(root, "homebrew", "Cellar")
+      caskroom = pathlib.Path(root, "homebrew", "Caskroom")
+      if args[:1] == ["list"]:
+        where = caskroom if "--cask" in args else cellar
+        sys.stdout.write("".join(f"{p.name}\n" for p in where.iterdir()))
+      elif args[:1] == ["install"]:
+        for package in args[1:]:
+          (cellar / package).mkdir(exist_ok=True)
+      return 0
+
+    case "stow":
+      if "-V" in args or "--version" in args:
+        print("stow (GNU Stow) version 2.3.1")
+      return 0
+
+    case "git":
+      # Clone github repositories from the local remotes instead. Since this
+      # isn't stored in the clone's config its origin is left unchanged.
+      if args[:1] == ["clone"]:
+        rewrite = f"url.{config['remotes']}/.insteadOf=https://github.com/"
+        args = ["-c", rewrite, *args]
+      return subprocess.run([config["git"], *args], check=False).returncode
+
+    case "curl":
+      url = next(arg for arg in reversed(args) if not arg.startswith("-"))
+      with urllib.request.urlopen(url) as response:
+        shutil.copyfileobj(response, sys.stdout.buffer)
+      return 0
+
+    case _:
+      return 0
@@ -0,0 +1,216 @@
+"""A deterministic fake system for benchmarking full recipe runs.
+
+A `FakeSystem` puts stand-in executables for apt-get, dpkg-query, brew, stow,
+git, curl and sudo on the PATH of the commands setuppy runs. Each stand-in waits
+for a configurable latency, writes a configurable volume of output and fails if
+any of its arguments is listed in its `fail_on`. The package managers keep their
+state in files under the fake system's root so that installs are remembered
+between runs, and update the files setuppy stamps to detect installs.
+
+It also serves files over HTTP from a local server, for the curl command, and
+creates local git remotes which stand in for github repositories, e.g.
+
+  with FakeSystem(root, tools={"apt-get": ToolConfig(latency=0.5)}) as fake:
+    fake.add_tarball("foo.tar.xz", {"foo/bar": "bar"})
+    fake.add_remote("foo/bar", {"README": "bar"})
+    set_executor(fake.executor())
+    ...
+
+Note that each stand-in is a python process, so every call also pays the cost
+of starting an interpreter. This is the same for every run and so doesn't
+affect comparisons between them.
+"""
+
+import contextlib
+import dataclasses
+import functools
+import http.server
+import io
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+from typing import Any
+from unittest import mock
+
+from setuppy.commands import apt
+from setuppy.commands.utils import Executor
+
+
+# The tools which are replaced by stand-ins.
+TOOLS = ["apt-get", "dpkg-query", "brew", "stow", "git", "curl", "sudo"]
+
+
+@dataclasses.dataclass
+class ToolConfig:
+  """How a stand-in tool behaves.
+
+  Properties:
+    latency: seconds to wait before doing anything.
+    output_lines: number of lines of output to write. These are written to
+      stderr so that they don't interfere with any output which is parsed.
+    fail_on: if any argument is in this list the tool fails.
+  """
+  latency: float = 0.0
+  output_lines: int = 0
+  fail_on: list[str] = dataclasses.field(default_factory=list)
+
+
+class FakeSystem:
+  """A fake system rooted at a directory; see the module documentation."""
+
+  def __init__(
+    self,
+    root: str | os.PathLike[str],
+    *,
+    tools: dict[str, ToolConfig] | None = None,
+    apt_packages: list[str] | None = None,
+    brew_packages: list[str] | None = None,
+  ):
+    """Initialize the fake system.
+
+    Args:
+      root: directory in which to keep the fake system's state.
+      tools: how each stand-in tool behaves; tools which aren't given have no
+        latency, no output and never fail.
+      apt_packages: packages which are initially installed by apt.
+      brew_packages: packages which are initially installed by brew.
+    """
+    self.root = pathlib.Path(root).absolute()
+    self.bindir = self.root / "bin"
+    self.wwwdir = self.root / "www"
+    self.remotedir = self.root / "remotes"
+    self.brewdir = self.root / "homebrew"
+    self.dpkg_status = self.root / "dpkg" / "status"
+    self.tools = tools or dict()
+    self._apt_packages = apt_packages or []
+    self._brew_packages = brew_packages or []
+    self._server: http.server.ThreadingHTTPServer | None = None
+    self._patches = contextlib.ExitStack()
+
+  def __enter__(self) -> "FakeSystem":
+    """Create the fake system and start its HTTP server."""
+    for path in [self.bindir, self.wwwdir, self.remotedir]:
+      path.mkdir(parents=True, exist_ok=True)
+    for subdir in ["Cellar", "Caskroom"]:
+      (self.brewdir / subdir).mkdir(parents=True, exist_ok=True)
+
+    # Record the initially installed packages.
+    self.dpkg_status.parent.mkdir(parents=True, exist_ok=True)
+    self.dpkg_status.write_text("".join(f"{p}\n" for p in self._apt_packages))
+    for package in self._brew_packages:
+      (self.brewdir / "Cellar" / package).mkdir(exist_ok=True)
+
+    # Write the configuration of every tool and a stand-in which runs it.
+    config = {
+      "root": str(self.root),
+      "git": shutil.which("git"),
+      "remotes": self.remotedir.as_uri(),
+      "tools": {
+        tool: dataclasses.asdict(self.tools.get(tool, ToolConfig()))
+        for tool in TOOLS
+      },
+    }
+    (self.root / "config.json").write_text(json.dumps(config))
+    for tool in TOOLS:
+      _write_stand_in(self.bindir / tool, self.root, tool)
+
+    # Point setuppy's own checks for installed packages at the fake system.
+    self._patches.enter_context(
+      mock.patch.object(apt, "DPKG_STATUS", str(self.dpkg_status))
+    )
+    self._patches.enter_context(
+      mock.patch.dict(os.environ, {"HOMEBREW_PREFIX": str(self.brewdir)})
+    )
+
+    # Serve files from wwwdir on a free port.
+    handler = functools.partial(
+      _QuietHandler, directory=str(self.wwwdir)
+    )
+    self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    return self
+
+  def __exit__(self, *exc_info: Any):
+    """Stop the HTTP server and undo any patches."""
+    if self._server is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
+    self._patches.close()
+
+  @property
+  def url(self) -> str:
+    """The base url of the HTTP server."""
+    if self._server is None:
+      raise RuntimeError("the fake system has not been started.")
+    host, port = self._server.server_address[:2]
+    return f"http://{host!s}:{port}"
+
+  @property
+  def env(self) -> dict[str, str]:
+    """Environment overrides under which commands use the fake system."""
+    return {"PATH": f"{self.bindir}{os.pathsep}{os.environ.get('PATH', '')}"}
+
+  def executor(self, **kwargs: Any) -> Executor:
+    """Return an executor which runs commands on the fake system."""
+    return Executor(env=self.env, sudo=str(self.bindir / "sudo"), **kwargs)
+
+  def add_tarball(self, name: str, files: dict[str, str]) -> str:
+    """Serve a tarball of the given files, returning its url.
+
+    The tarball is compressed with xz, which is what the curl command expects,
+    so name should end with ".tar.xz".
+    """
+    with tarfile.open(self.wwwdir / name, "w:xz") as tar:
+      for path, contents in files.items():
+        data = contents.encode("utf-8")
+        info = tarfile.TarInfo(path)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return f"{self.url}/{name}"
+
+  def add_remote(self, source: str, files: dict[str, str]):
+    """Create a local remote for the github repository source, e.g. "a/b"."""
+    workdir = self.root / "work" / source
+    for path, contents in files.items():
+      (workdir / path).parent.mkdir(parents=True, exist_ok=True)
+      (workdir / path).write_text(contents)
+
+    git = ["git", "-C", str(workdir), "-c", "user.name=fake"]
+    git += ["-c", "user.email=fake@localhost"]
+    subprocess.run([*git, "init", "-q"], check=True)
+    subprocess.run([*git, "add", "-A"], check=True)
+    subprocess.run([*git, "commit", "-q", "-m", "init"], check=True)
+    subprocess.run(
+      [
+        "git", "clone", "-q", "--bare", str(workdir),
+        str(self.remotedir / source),
+      ],
+      check=True,
+    )
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+  """A request handler which doesn't log every request."""
+
+  def log_message(self, format: str, *args: Any):
+    """Don't log anything."""
+
+
+def _write_stand_in(path: pathlib.Path, root: pathlib.Path, tool: str):
+  """Write an executable which runs the stand-in for tool."""
+  repo = pathlib.Path(__file__).parent.parent
+  path.write_text(
+    f"#!{sys.executable} -S\n"
+    "import sys\n"
+    f"sys.path.insert(0, {str(repo)!r})\n"
+    "from benchmarks.fake_tool import run_tool\n"
+    f"sys.exit(run_tool({str(root)!r}, {tool!r}, sys.argv[1:]))\n"
+  )
+  path.chmod(0o755)
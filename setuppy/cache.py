@@ -0,0 +1,225 @@
+"""Persistent cache for values that are expensive to recompute between runs."""
+
+import dataclasses
+import logging
+import os
+import pathlib
+import pickle
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Hashable
+from collections.abc import Iterable
+from typing import Any
+
+
+# Returned by `Cache.get` for missing values when no default is wanted, so that
+# they can be told apart from stored values of None.
+_MISSING = object()
+
+# A stamp is a cheap summary of a file which should change whenever the file
+# does. It is None if the file does not exist.
+Stamp = tuple[int, int, int] | None
+
+
+def stamp(path: str | os.PathLike[str]) -> Stamp:
+  """Return the stamp (mtime, inode, size) of the given path."""
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def default_cache_dir() -> pathlib.Path:
+  """Return the default cache directory, following the XDG conventions."""
+  cachehome = os.getenv("XDG_CACHE_HOME")
+  if not cachehome:
+    cachehome = os.path.join(os.path.expanduser("~"), ".cache")
+  return pathlib.Path(cachehome) / "setuppy"
+
+
+@dataclasses.dataclass
+class _Entry:
+  """A single cached value along with the data used to invalidate it."""
+  value: Any
+  stamps: tuple[Hashable, ...]
+  expires: float | None
+
+
+class Cache:
+  """A namespaced key-value cache which can be persisted to disk.
+
+  Each value is stored along with a tuple of stamps (see `stamp`) and an
+  optional expiry time. A lookup only succeeds if the stamps it is given match
+  those stored with the value and the value has not expired. Each namespace is
+  stored in its own pickle file under `cachedir`, which is loaded lazily on
+  first use and written back by `save`. If `cachedir` is None the cache is only
+  held in memory.
+  """
+
+  def __init__(self, cachedir: str | os.PathLike[str] | None = None):
+    """Initialize the cache.
+
+    Args:
+      cachedir: directory in which to persist the cache, or None.
+    """
+    self.cachedir = pathlib.Path(cachedir) if cachedir is not None else None
+    self._stores: dict[str, dict[Hashable, _Entry]] = dict()
+    self._dirty: set[str] = set()
+    self._lock = threading.RLock()
+
+  def get(
+    self,
+    namespace: str,
+    key: Hashable,
+    default: Any = None,
+    *,
+    stamps: Iterable[Hashable] = (),
+  ) -> Any:
+    """Return the value stored under key, or default if it's missing or stale.
+
+    Stale values are evicted, since they can never be returned again.
+    """
+    with self._lock:
+      store = self._store(namespace)
+      entry = store.get(key)
+      if entry is None:
+        return default
+
+      if entry.stamps != tuple(stamps) or _expired(entry, time.time()):
+        del store[key]
+        self._dirty.add(namespace)
+        return default
+
+    return entry.value
+
+  def set(
+    self,
+    namespace: str,
+    key: Hashable,
+    value: Any,
+    *,
+    stamps: Iterable[Hashable] = (),
+    ttl: float | None = None,
+  ):
+    """Store the value under key until its stamps change or its ttl expires."""
+    expires = time.time() + ttl if ttl is not None else None
+    with self._lock:
+      self._store(namespace)[key] = _Entry(value, tuple(stamps), expires)
+      self._dirty.add(namespace)
+
+  def delete(self, namespace: str, key: Hashable):
+    """Remove the value stored under key if it exists."""
+    with self._lock:
+      if self._store(namespace).pop(key, None) is not None:
+        self._dirty.add(namespace)
+
+  def get_or_compute(
+    self,
+    namespace: str,
+    key: Hashable,
+    compute: Callable[[], Any],
+    *,
+    stamps: Iterable[Hashable] = (),
+    ttl: float | None = None,
+  ) -> Any:
+    """Return the value stored under key, computing it first if necessary."""
+    stamps = tuple(stamps)
+    value = self.get(namespace, key, _MISSING, stamps=stamps)
+    if value is _MISSING:
+      value = compute()
+      self.set(namespace, key, value, stamps=stamps, ttl=ttl)
+    return value
+
+  def save(self):
+    """Write any modified namespaces to disk, evicting expired values first."""
+    if self.cachedir is None:
+      return
+
+    with self._lock:
+      # Values which have expired are dropped from every loaded namespace, so
+      # that they don't accumulate in the cache if they are never looked up.
+      now = time.time()
+      for namespace, store in self._stores.items():
+        expired = [key for key, entry in store.items() if _expired(entry, now)]
+        for key in expired:
+          del store[key]
+        if expired:
+          self._dirty.add(namespace)
+
+      for namespace in sorted(self._dirty):
+        try:
+          self.cachedir.mkdir(parents=True, exist_ok=True)
+          write_atomic(
+            self.cachedir / f"{namespace}.pickle",
+            pickle.dumps(self._stores[namespace], pickle.HIGHEST_PROTOCOL),
+          )
+        except OSError as e:
+          logging.warning('Could not write cache "%s": %s', namespace, e)
+      self._dirty.clear()
+
+  def _store(self, namespace: str) -> dict[Hashable, _Entry]:
+    """Return the store for the namespace, loading it if necessary."""
+    store = self._stores.get(namespace)
+    if store is None:
+      store = self._stores[namespace] = self._load(namespace)
+    return store
+
+  def _load(self, namespace: str) -> dict[Hashable, _Entry]:
+    """Load the namespace from disk; an unreadable cache is treated as empty."""
+    if self.cachedir is None:
+      return dict()
+
+    try:
+      with (self.cachedir / f"{namespace}.pickle").open("rb") as f:
+        store = pickle.load(f)
+    except FileNotFoundError:
+      return dict()
+    except Exception as e:
+      logging.warning('Ignoring unreadable cache "%s": %s', namespace, e)
+      return dict()
+
+    return store if isinstance(store, dict) else dict()
+
+
+def _expired(entry: _Entry, now: float) -> bool:
+  """Return whether the entry's ttl has expired."""
+  return entry.expires is not None and entry.expires < now
+
+
+def write_atomic(path: pathlib.Path, data: bytes, *, mode: int | None = None):
+  """Write data to path atomically by writing and renaming a temporary file.
+
+  Args:
+    path: the file to write.
+    data: the contents of the file.
+    mode: the permissions of the file; by default only its owner can read it.
+  """
+  fd, tmpname = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+    if mode is not None:
+      os.chmod(tmpname, mode)
+    os.replace(tmpname, path)
+  except BaseException:
+    os.unlink(tmpname)
+    raise
+
+
+# The cache used by commands and the controller. By default this is only held
+# in memory; the command line interface replaces it with a persistent cache.
+_cache = Cache()
+
+
+def get_cache() -> Cache:
+  """Return the global cache."""
+  return _cache
+
+
+def set_cache(cache: Cache):
+  """Replace the global cache."""
+  global _cache
+  _cache = cache
@@ -4,15 +4,32 @@ import logging
 import os
 import pathlib
 import sys
+import time
 
 import click
 import dataclass_binder
 import tomllib
 
+from setuppy.cache import Cache
+from setuppy.cache import default_cache_dir
+from setuppy.cache import get_cache
+from setuppy.cache import set_cache
+from setuppy.commands.utils import Executor
+from setuppy.commands.utils import get_executor
+from setuppy.commands.utils import set_executor
 from setuppy.controller import Controller
+from setuppy.events import EventBus
+from setuppy.events import RunFinished
+from setuppy.events import Sink
+from setuppy.metrics import MetricsSink
+from setuppy.output import EventLog
+from setuppy.recipes import index_recipes
+from setuppy.trace import Tracer
+from setuppy.trace import get_tracer
+from setuppy.trace import set_tracer
 from setuppy.types import Config
-from setuppy.types import Recipe
 from setuppy.types import SetuppyError
+from setuppy.usage import save_report
 
 
 """Setup command line wrapper."""
@@ -54,6 +71,48 @@ from setuppy.types import SetuppyError
   is_flag=True,
   help="Verbosely log to stdout; ignores -v.",
 )
+@click.option(
+  "--cache-dir",
+  "cachedir",
+  metavar="DIR",
+  help="Cache data between runs in DIR; defaults to ~/.cache/setuppy.",
+)
+@click.option(
+  "--no-cache",
+  "no_cache",
+  is_flag=True,
+  help="Do not read or write the cache; ignores --cache-dir.",
+)
+@click.option(
+  "--log-dir",
+  "logdir",
+  metavar="DIR",
+  help="Write the full output of long-running commands to files in DIR.",
+)
+@click.option(
+  "--profile",
+  "profile",
+  metavar="FILE",
+  help="Write a Chrome trace of where the run's time goes to FILE.",
+)
+@click.option(
+  "--usage-report",
+  "usage_report",
+  metavar="FILE",
+  help="Write the resources used by each action to FILE as JSON.",
+)
+@click.option(
+  "--events",
+  "events",
+  metavar="FILE",
+  help="Write the events of the run to FILE as JSON Lines.",
+)
+@click.option(
+  "--metrics",
+  "metrics",
+  metavar="FILE",
+  help="Write metrics of the run to FILE in the Prometheus text format.",
+)
 def main(
   *,
   tags: tuple[str],
@@ -62,6 +121,13 @@ def main(
   simulate: bool,
   verbosity: int,
   log_to_stdout: bool,
+  cachedir: str | None,
+  no_cache: bool,
+  logdir: str | None,
+  profile: str | None,
+  usage_report: str | None,
+  events: str | None,
+  metrics: str | None,
 ) -> int:
   """Search for setup recipes and run them.
 
@@ -98,6 +164,25 @@ def main(
     click.secho(f"Error: {msg}", fg="red")
     return -1
 
+  # Set up the cache. This must be resolved before we change directory so that
+  # a relative cache directory is relative to where we were called from.
+  if not no_cache:
+    cachepath = pathlib.Path(cachedir) if cachedir else default_cache_dir()
+    set_cache(Cache(cachepath.absolute()))
+
+  # Likewise resolve the log directory and the output files.
+  if logdir:
+    logdir = str(pathlib.Path(logdir).absolute())
+  if profile:
+    profile = str(pathlib.Path(profile).absolute())
+    set_tracer(Tracer())
+  if usage_report:
+    usage_report = str(pathlib.Path(usage_report).absolute())
+  if events:
+    events = str(pathlib.Path(events).absolute())
+  if metrics:
+    metrics = str(pathlib.Path(metrics).absolute())
+
   # Change directory so that from now on everything is relative to basedir.
   os.chdir(basepath)
 
@@ -123,15 +208,41 @@ def main(
   else:
     config = Config()
 
-  # TODO: catch Binder errors.
-  recipes = [
-    dataclass_binder.Binder(Recipe).parse_toml(filename)
-    for filename in list(recipepath.glob("*.toml"))
-  ]
+  # Configure how commands are run.
+  set_executor(Executor(
+    timeout=config.command_timeout,
+    env=config.command_env,
+    max_procs=config.max_processes,
+    logdir=logdir,
+    shell_worker=config.shell_worker,
+  ))
+
+  controller = None
+  error = None
+  start = time.perf_counter()
+  eventfile = None
+  sinks: list[Sink] = []
+  if metrics:
+    sinks.append(MetricsSink(metrics))
 
   try:
+    # Open the event log, reporting a path which can't be written to like any
+    # other bad option.
+    if events:
+      try:
+        eventfile = open(events, "w", encoding="utf-8")
+      except OSError as e:
+        error = f'could not open "{events}": {e.strerror}'
+        raise click.FileError(events, hint=e.strerror) from None
+      sinks.insert(0, EventLog(eventfile))
+
+    # Index the recipes, only parsing those which changed since the last run.
+    # The controller will only load those recipes which it runs.
+    with get_tracer().span("parse", "parse"):
+      recipes = index_recipes(sorted(recipepath.glob("*.toml")))
+
     # Instantiate and run the controller.
-    Controller(
+    controller = Controller(
       recipes=recipes,
       tags=list(tags),
       variables=variables,
@@ -139,12 +250,35 @@ def main(
       force_all_tags=force_all_tags,
       simulate=simulate,
       verbosity=verbosity,
-    ).run()
+      sinks=sinks,
+    )
+    controller.run()
 
   except SetuppyError as e:
+    error = str(e)
     click.secho(f"Error: {e}", fg="red")
     return -1
 
+  finally:
+    # The controller reports the end of the run to the sinks, so if it failed
+    # before the controller could run (e.g. a recipe couldn't be parsed) report
+    # that it failed ourselves.
+    if controller is None:
+      bus = EventBus(sinks)
+      bus.emit(RunFinished(
+        duration=time.perf_counter() - start,
+        error=error or "the run did not start",
+      ))
+      bus.close()
+    get_cache().save()
+    get_executor().close()
+    if eventfile:
+      eventfile.close()
+    if profile:
+      get_tracer().save(profile)
+    if usage_report and controller is not None:
+      save_report(usage_report, controller.usage)
+
   return 0
 
 
@@ -1,30 +1,120 @@
 """Registry for commands."""
 
+import importlib
+import importlib.metadata
+from collections.abc import Iterator
+from collections.abc import Mapping
 from typing import Type
 
-from setuppy.commands import apt
-from setuppy.commands import brew
-from setuppy.commands import command
-from setuppy.commands import curl
-from setuppy.commands import github
-from setuppy.commands import stow
-from setuppy.commands import template
 from setuppy.commands.base import BaseCommand
+from setuppy.types import SetuppyError
 
 
-CommandRegistry: dict[str, Type[BaseCommand]] = dict()
+# The built-in commands, given as "module:class" so they're imported lazily.
+BUILTIN_COMMANDS = {
+  "apt": "setuppy.commands.apt:Apt",
+  "brew": "setuppy.commands.brew:Brew",
+  "command": "setuppy.commands.command:Command",
+  "curl": "setuppy.commands.curl:Curl",
+  "github": "setuppy.commands.github:Github",
+  "stow": "setuppy.commands.stow:Stow",
+  "template": "setuppy.commands.template:Template",
+}
+
+# Entry point group under which other packages can provide commands, e.g. in
+# their pyproject.toml:
+#
+#   [project.entry-points."setuppy.commands"]
+#   mykind = "mypackage.commands:MyCommand"
+ENTRY_POINT_GROUP = "setuppy.commands"
+
+
+class Registry(Mapping[str, Type[BaseCommand]]):
+  """A mapping from kinds to command types which imports them lazily.
+
+  Commands can be registered directly, via `register`, or by name as a string
+  "module:class" in which case the module is only imported when the kind is
+  first looked up. The registry initially contains the built-in commands. Any
+  commands provided by the `ENTRY_POINT_GROUP` entry points of installed
+  packages are only searched for if a kind isn't otherwise registered, and
+  never replace a command registered some other way.
+  """
+
+  def __init__(self, specs: Mapping[str, str] = BUILTIN_COMMANDS):
+    """Initialize the registry.
+
+    Args:
+      specs: mapping from kinds to commands given as "module:class".
+    """
+    self._specs = dict(specs)
+    self._types: dict[str, Type[BaseCommand]] = dict()
+    self._loaded_entry_points = False
+
+  def register(self, kind: str, command: Type[BaseCommand] | str):
+    """Register the command, either a type or "module:class", as kind."""
+    if isinstance(command, str):
+      self._types.pop(kind, None)
+      self._specs[kind] = command
+    else:
+      self._types[kind] = command
+
+  def __getitem__(self, kind: str) -> Type[BaseCommand]:
+    """Return the command type for kind, importing it if necessary."""
+    command = self._types.get(kind)
+    if command is None:
+      if kind not in self._specs:
+        self._load_entry_points()
+      command = self._types[kind] = _import_command(kind, self._specs[kind])
+    return command
+
+  def __contains__(self, kind: object) -> bool:
+    """Return whether kind is registered, without importing it."""
+    if kind in self._types or kind in self._specs:
+      return True
+    self._load_entry_points()
+    return kind in self._specs
+
+  def __iter__(self) -> Iterator[str]:
+    """Iterate over every kind, including those provided by entry points."""
+    self._load_entry_points()
+    return iter(self._specs.keys() | self._types.keys())
+
+  def __len__(self) -> int:
+    """Return the number of kinds."""
+    return sum(1 for _ in self)
+
+  def _load_entry_points(self):
+    """Add the commands provided by entry points, the first time only."""
+    if self._loaded_entry_points:
+      return
+    self._loaded_entry_points = True
+    for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+      if entry_point.name not in self._specs | self._types:
+        self._specs[entry_point.name] = entry_point.value
+
+
+def _import_command(kind: str, spec: str) -> Type[BaseCommand]:
+  """Import the command given as "module:class"."""
+  modname, _, qualname = spec.partition(":")
+  try:
+    command = importlib.import_module(modname)
+    for attr in qualname.split("."):
+      command = getattr(command, attr)
+  except (ImportError, AttributeError) as e:
+    msg = f'could not load command "{kind}" from "{spec}": {e}'
+    raise SetuppyError(msg) from None
+
+  if not isinstance(command, type) or not issubclass(command, BaseCommand):
+    msg = f'command "{kind}" from "{spec}" is not a command.'
+    raise SetuppyError(msg)
+
+  return command
+
+
+CommandRegistry = Registry()
 
 
 def register(cls: Type[BaseCommand]) -> Type[BaseCommand]:
   """Register the command type."""
-  CommandRegistry[cls.__name__.lower()] = cls
+  CommandRegistry.register(cls.__name__.lower(), cls)
   return cls
-
-
-register(apt.Apt)
-register(brew.Brew)
-register(command.Command)
-register(curl.Curl)
-register(github.Github)
-register(stow.Stow)
-register(template.Template)
@@ -4,19 +4,27 @@ import dataclasses
 import logging
 from typing import Any
 
+from setuppy.cache import get_cache
+from setuppy.cache import stamp
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
 from setuppy.commands.utils import run_command
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
+# The dpkg database, which changes whenever packages are installed or removed.
+DPKG_STATUS = "/var/lib/dpkg/status"
+
+
 @dataclasses.dataclass
 class Apt(BaseCommand):
   """Run apt-get to install a collection of packages.
 
   This command uses apt-get to install the given collection of packages. It will
   first check what packages are installed, skipping this step if
-  `facts["apt_packages"]` exists containing a cached list of installed packages.
+  `facts["apt_packages"]` exists containing a cached list of installed packages
+  or if the list was cached by an earlier run and dpkg's database is unchanged.
   It will then attempt to install those requested packages that are missing.
 
   The returned `CommandResult` will have `result.changed` set to `True` if any
@@ -25,6 +33,15 @@ class Apt(BaseCommand):
   """
   packages: list[str]
 
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether any of the packages aren't installed."""
+    packages = [interpolate(p, facts) for p in self.packages]
+    return not set(packages).issubset(_get_cached_packages(facts))
+
+  def provides(self) -> set[str]:
+    """Return the facts set by the command."""
+    return {"apt_packages"}
+
   def __call__(
     self,
     *,
@@ -33,19 +50,14 @@ class Apt(BaseCommand):
   ) -> CommandResult:
     """Run the command or do nothing if simulate is True."""
     # Try and get a cached list of packages.
-    installed = facts.get("apt_packages")
+    installed = _get_cached_packages(facts)
     changed = False
 
-    # Get the installed packages if they're not cached.
-    if installed is None:
-      cmd = ["dpkg-query", "-f", r"${binary:Package}\n", "-W"]
-      rc, stderr, _ = run_command(cmd)
-      if rc != 0:
-        raise SetuppyError("Error determining installed packages.")
-      installed = stderr.strip().split()
+    # Copy the installed packages so we don't modify the cached version.
+    installed = list(installed)
 
     # Find the packages that are not installed.
-    packages = [p.format(**facts) for p in self.packages]
+    packages = [interpolate(p, facts) for p in self.packages]
     packages = list(set(packages).difference(set(installed)))
 
     # Add uninstalled packages in so that we can cache installed packages with
@@ -61,9 +73,34 @@ class Apt(BaseCommand):
       logging.info('Running command "%s"', " ".join(cmd))
 
       if not simulate:
-        rc, _, _ = run_command(cmd, sudo=True)
+        rc, _, _ = run_command(cmd, sudo=True, stream=True)
         if rc != 0:
           msg = f'Error running command "{cmd}".'
           raise SetuppyError(msg)
 
     return CommandResult(changed=changed, facts=facts)
+
+
+def _get_cached_packages(facts: dict[str, Any]) -> list[str]:
+  """Get the installed packages, from the facts or the cache if possible.
+
+  The list cached across runs is invalidated whenever dpkg's database changes.
+  """
+  installed = facts.get("apt_packages")
+  if installed is None:
+    installed = get_cache().get_or_compute(
+      "facts",
+      "apt_packages",
+      _get_installed_packages,
+      stamps=[stamp(DPKG_STATUS)],
+    )
+  return installed
+
+
+def _get_installed_packages() -> list[str]:
+  """Get the list of installed packages."""
+  cmd = ["dpkg-query", "-f", r"${binary:Package}\n", "-W"]
+  rc, stderr, _ = run_command(cmd)
+  if rc != 0:
+    raise SetuppyError("Error determining installed packages.")
+  return stderr.strip().split()
@@ -2,7 +2,10 @@
 
 import abc
 import dataclasses
+from collections.abc import Hashable
+from collections.abc import Sequence
 from typing import Any
+from typing import Self
 
 
 @dataclasses.dataclass
@@ -40,3 +43,81 @@ class BaseCommand(metaclass=abc.ABCMeta):
       system facts which can be used by the caller to update the global
       collection of facts.
     """
+
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether running the command would change anything.
+
+    Checks must not have side effects, since the controller runs the checks of
+    many commands concurrently before running any of them. A command which the
+    check says wouldn't change anything isn't run. By default a command's check
+    is inconclusive.
+
+    Args:
+      facts: a dictionary containing system facts.
+
+    Returns:
+      True if the command would make changes, False if it wouldn't, or None if
+      this can't be determined without running it.
+    """
+    del facts
+    return None
+
+  def templates(self) -> list[str]:
+    """Return the strings of the command which are interpolated with facts.
+
+    These are compiled before any command is run, so that references to facts
+    which don't exist are reported up front. By default these are the values
+    of every string field and the items of every list of strings.
+    """
+    templates = []
+    for field in dataclasses.fields(self):
+      value = getattr(self, field.name)
+      if isinstance(value, str):
+        templates.append(value)
+      elif isinstance(value, list):
+        templates += [item for item in value if isinstance(item, str)]
+    return templates
+
+  def provides(self) -> set[str]:
+    """Return the names of the facts which the command may set.
+
+    By default commands don't set any facts.
+    """
+    return set()
+
+  def batch_key(self, facts: dict[str, Any]) -> Hashable | None:
+    """Return a key identifying which commands this can be batched with.
+
+    Consecutive commands of the same type with equal, non-None, batch keys may
+    be run together by a single call to `run_batch`. By default commands are
+    never batched.
+
+    Args:
+      facts: a dictionary containing system facts.
+    """
+    del facts
+    return None
+
+  @classmethod
+  def run_batch(
+    cls,
+    commands: Sequence[Self],
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> list[CommandResult]:
+    """Run a batch of commands which share a batch key.
+
+    If this raises an error the controller runs each command on its own, so
+    that only the commands which cause the error fail. A batch must therefore
+    be safe to run again after it fails.
+
+    Args:
+      commands: the commands to run.
+      facts: a dictionary containing system facts.
+      simulate: whether to simulate the commands or not.
+
+    Returns:
+      A list containing a `CommandResult` for each command.
+    """
+    return [command(facts=facts, simulate=simulate) for command in commands]
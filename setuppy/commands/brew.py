@@ -2,14 +2,27 @@
 
 import dataclasses
 import logging
+import os
 from typing import Any
 
+from setuppy.cache import get_cache
+from setuppy.cache import stamp
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
 from setuppy.commands.utils import run_command
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
+# Default locations in which brew may be installed.
+BREW_PREFIXES = ["/opt/homebrew", "/usr/local", "/home/linuxbrew/.linuxbrew"]
+
+# How long to cache the installed packages between runs, in seconds. Installing
+# a formula or cask changes the Cellar or Caskroom, but as an extra safeguard
+# the cache also expires after a day.
+BREW_FACT_TTL = 24 * 60 * 60
+
+
 @dataclasses.dataclass
 class Brew(BaseCommand):
   """Run brew to install a collection of packages.
@@ -17,8 +30,9 @@ class Brew(BaseCommand):
   This command uses brew to install the given collection of packages. It will
   first check what packages are installed, skipping this step if
   `facts["brew_packages"]` exists containing a cached list of installed
-  packages. It will then attempt to install those requested packages that are
-  missing.
+  packages or if the list was cached by a recent run and brew's Cellar and
+  Caskroom are unchanged. It will then attempt to install those requested
+  packages that are missing.
 
   The returned `CommandResult` will have `result.changed` set to `True` if any
   packages were installed, and `result.facts["brew_packages"]` will correspond
@@ -26,6 +40,15 @@ class Brew(BaseCommand):
   """
   packages: list[str]
 
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether any of the packages aren't installed."""
+    packages = [interpolate(p, facts) for p in self.packages]
+    return not set(packages).issubset(_get_cached_packages(facts))
+
+  def provides(self) -> set[str]:
+    """Return the facts set by the command."""
+    return {"brew_packages"}
+
   def __call__(
     self,
     *,
@@ -34,25 +57,14 @@ class Brew(BaseCommand):
   ) -> CommandResult:
     """Run a brew action."""
     # Try and get a cached list of packages.
-    installed = facts.get("brew_packages")
+    installed = _get_cached_packages(facts)
     changed = False
 
-    # Get the installed packages if they're not cached.
-    if installed is None:
-      # Find formula.
-      rc, stderr, _ = run_command(["brew", "list", "--formula", "-1"])
-      if rc != 0:
-        raise SetuppyError("Error determining installed packages.")
-      installed = stderr.strip().split()
-
-      # Find casks.
-      rc, stderr, _ = run_command(["brew", "list", "--cask", "-1"])
-      if rc != 0:
-        raise SetuppyError("Error determining installed packages.")
-      installed.extend(stderr.strip().split())
+    # Copy the installed packages so we don't modify the cached version.
+    installed = list(installed)
 
     # Find the packages that are not installed.
-    packages = [p.format(**facts) for p in self.packages]
+    packages = [interpolate(p, facts) for p in self.packages]
     packages = list(set(packages).difference(set(installed)))
 
     # Add uninstalled packages in so that we can cache installed packages with
@@ -69,9 +81,54 @@ class Brew(BaseCommand):
 
       # Run the command if we're not simulating.
       if not simulate:
-        rc, _, _ = run_command(cmd)
+        rc, _, _ = run_command(cmd, stream=True)
         if rc != 0:
           msg = f'Error running command "{" ".join(cmd)}".'
           raise SetuppyError(msg)
 
     return CommandResult(changed=changed, facts=facts)
+
+
+def _get_cached_packages(facts: dict[str, Any]) -> list[str]:
+  """Get the installed packages, from the facts or the cache if possible.
+
+  The list cached across runs is invalidated whenever the Cellar or Caskroom
+  changes, or after BREW_FACT_TTL seconds.
+  """
+  installed = facts.get("brew_packages")
+  if installed is None:
+    installed = get_cache().get_or_compute(
+      "facts",
+      "brew_packages",
+      _get_installed_packages,
+      stamps=[stamp(path) for path in _get_brew_dirs()],
+      ttl=BREW_FACT_TTL,
+    )
+  return installed
+
+
+def _get_installed_packages() -> list[str]:
+  """Get the list of installed formula and casks."""
+  # Find formula.
+  rc, stderr, _ = run_command(["brew", "list", "--formula", "-1"])
+  if rc != 0:
+    raise SetuppyError("Error determining installed packages.")
+  installed = stderr.strip().split()
+
+  # Find casks.
+  rc, stderr, _ = run_command(["brew", "list", "--cask", "-1"])
+  if rc != 0:
+    raise SetuppyError("Error determining installed packages.")
+  installed.extend(stderr.strip().split())
+
+  return installed
+
+
+def _get_brew_dirs() -> list[str]:
+  """Get the directories which change whenever brew installs a package."""
+  prefixes = [os.getenv("HOMEBREW_PREFIX"), *BREW_PREFIXES]
+  return [
+    os.path.join(prefix, subdir)
+    for prefix in dict.fromkeys(p for p in prefixes if p)
+    for subdir in ["Cellar", "Caskroom"]
+  ]
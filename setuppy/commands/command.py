@@ -1,12 +1,19 @@
 """Implementation of a basic shell command."""
 
 import dataclasses
+import hashlib
+import json
 import logging
+import os
+import tomllib
 from typing import Any
 
+from setuppy.cache import get_cache
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
+from setuppy.commands.utils import get_executor
 from setuppy.commands.utils import run_command
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
@@ -14,11 +21,48 @@ from setuppy.types import SetuppyError
 class Command(BaseCommand):
   """Run a basic shell command.
 
-  This command runs a basic shell command passed as a string. Because we don't
-  know anything else about the command this will always return
-  `CommandResult.changed` set to True.
+  This command runs a basic shell command passed as a list of arguments. The
+  command can be guarded so that it only runs when needed:
+
+    - `creates`: skip the command if this path exists.
+    - `removes`: skip the command if this path does not exist.
+    - `unless`: skip the command if this probe command succeeds.
+    - `onlyif`: skip the command if this probe command fails.
+
+  Probe commands are run even when simulating, since they shouldn't modify the
+  system. A skipped command returns `CommandResult.changed` set to False.
+
+  Because we don't know anything else about the command it will otherwise
+  return `CommandResult.changed` set to True. Alternatively, if `detect_changes`
+  is set or any `watch` files are given, the command's output and the contents
+  of the watched files are hashed after it runs and `CommandResult.changed` is
+  only True if the hash differs from the one recorded by the previous run.
+
+  If `fact` is given the command's output is parsed and returned as the named
+  fact. The output is parsed according to `parse`, which is one of "raw",
+  "strip" (the default), "json" or "toml". Like any other command, a command
+  which sets a fact isn't run when simulating unless it's marked `safe`, i.e.
+  it doesn't modify the system; otherwise the fact is left unset and actions
+  which depend on it can't be simulated. If `fact_ttl` is given the fact is
+  cached for that many seconds, across runs if the cache is persistent, during
+  which the command isn't run again and the cached result is returned.
+
+  If the executor has a shell worker (see the `shell_worker` config option) the
+  command is run by it rather than spawned directly, which avoids the cost of
+  starting a new process from python for every command. Its output is then
+  only logged once it has finished, rather than as it's written.
   """
   command: list[str]
+  creates: str | None = None
+  removes: str | None = None
+  unless: list[str] = dataclasses.field(default_factory=list)
+  onlyif: list[str] = dataclasses.field(default_factory=list)
+  detect_changes: bool = False
+  watch: list[str] = dataclasses.field(default_factory=list)
+  fact: str | None = None
+  parse: str = "strip"
+  fact_ttl: int | None = None
+  safe: bool = False
 
   def __call__(
     self,
@@ -27,13 +71,139 @@ class Command(BaseCommand):
     simulate: bool,
   ) -> CommandResult:
     """Run a raw command."""
-    cmd = [c.format(**facts) for c in self.command]
+    cmd = [interpolate(c, facts) for c in self.command]
+
+    # Skip the command if any of its guards say it isn't needed.
+    if reason := self._get_skip_reason(facts):
+      logging.info('Skipping command "%s": %s', " ".join(cmd), reason)
+      return CommandResult(changed=False)
+
+    # Use the result cached by an earlier run if it hasn't expired. Results are
+    # cached as a (fact, changed) pair so that a fact which is None is cached
+    # too, and so the cached result is the same as running the command again.
+    fact_key = (tuple(cmd), self.parse)
+    if self.fact and self.fact_ttl is not None:
+      cached = get_cache().get("facts", fact_key)
+      if cached is not None:
+        logging.info('Using cached fact "%s"', self.fact)
+        value, changed = cached
+        return CommandResult(changed=changed, facts={self.fact: value})
+
     logging.info('Running command "%s"', " ".join(cmd))
+    detect_changes = self.detect_changes or bool(self.watch)
+
+    # Only commands which are safe to run are run when simulating, since later
+    # actions may depend on the fact they set.
+    if simulate and not (self.fact and self.safe):
+      return CommandResult(changed=True)
+
+    # The full output is needed to detect changes or set a fact, so only stream
+    # it otherwise. Streamed commands can't be run by the shell worker, so if
+    # there is one we don't stream at all.
+    stream = not (detect_changes or self.fact or get_executor().shell_worker)
+    rc, stdout, _ = run_command(cmd, stream=stream, worker=True)
+    if rc != 0:
+      msg = f'Error running command "{" ".join(cmd)}".'
+      raise SetuppyError(msg)
+
+    new_facts = dict()
+    if self.fact:
+      new_facts[self.fact] = _parse_output(stdout, self.parse, cmd)
+
+    # Compare the hash of the output and watched files to that of the last run.
+    changed = True
+    if detect_changes and not simulate:
+      watch = [interpolate(w, facts) for w in self.watch]
+      digest = _get_digest(stdout, watch)
+      key = (tuple(cmd), tuple(watch))
+      changed = get_cache().get("commands", key) != digest
+      get_cache().set("commands", key, digest)
+
+    if self.fact and self.fact_ttl is not None:
+      cached = (new_facts[self.fact], changed)
+      get_cache().set("facts", fact_key, cached, ttl=self.fact_ttl)
+
+    return CommandResult(changed=changed, facts=new_facts)
+
+  def templates(self) -> list[str]:
+    """Return the strings which are interpolated, i.e. all but the fact's."""
+    guards = [path for path in (self.creates, self.removes) if path]
+    return [*self.command, *guards, *self.unless, *self.onlyif, *self.watch]
 
-    if not simulate:
-      rc, _, _ = run_command(cmd)
-      if rc != 0:
-        msg = f'Error running command "{" ".join(cmd)}".'
+  def provides(self) -> set[str]:
+    """Return the fact set by the command, if any."""
+    return {self.fact} if self.fact else set()
+
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether the command would be skipped because it `creates` a file.
+
+    The other guards are left to be evaluated when the command is run, since
+    they're more likely to depend on what earlier actions have done.
+    """
+    if self.creates and os.path.lexists(interpolate(self.creates, facts)):
+      return False
+
+    # Commands which have other guards, set a fact or detect changes must be
+    # run to know.
+    if self.removes or self.unless or self.onlyif:
+      return None
+    if self.fact or self.detect_changes or self.watch:
+      return None
+
+    return True
+
+  def _get_skip_reason(self, facts: dict[str, Any]) -> str | None:
+    """Return why the command should be skipped, or None if it should run."""
+    if self.creates and os.path.lexists(interpolate(self.creates, facts)):
+      return f'"{interpolate(self.creates, facts)}" exists'
+
+    if self.removes and not os.path.lexists(interpolate(self.removes, facts)):
+      return f'"{interpolate(self.removes, facts)}" does not exist'
+
+    if self.unless and _probe(self.unless, facts):
+      return "unless probe succeeded"
+
+    if self.onlyif and not _probe(self.onlyif, facts):
+      return "onlyif probe failed"
+
+    return None
+
+
+def _probe(probe: list[str], facts: dict[str, Any]) -> bool:
+  """Run the probe command, returning whether it succeeded."""
+  cmd = [interpolate(c, facts) for c in probe]
+  rc, _, _ = run_command(cmd, worker=True)
+  return rc == 0
+
+
+def _parse_output(stdout: str, parse: str, cmd: list[str]) -> Any:
+  """Parse the output of the command in order to set a fact."""
+  try:
+    match parse:
+      case "raw":
+        return stdout
+      case "strip":
+        return stdout.strip()
+      case "json":
+        return json.loads(stdout)
+      case "toml":
+        return tomllib.loads(stdout)
+      case _:
+        msg = f'unknown parse mode "{parse}".'
         raise SetuppyError(msg)
+  except (ValueError, tomllib.TOMLDecodeError) as e:
+    msg = f'Could not parse the output of "{" ".join(cmd)}" as {parse}: {e}'
+    raise SetuppyError(msg) from None
+
 
-    return CommandResult(changed=True)
+def _get_digest(stdout: str, watch: list[str]) -> str:
+  """Return a hash of the command's output and the watched files' contents."""
+  digest = hashlib.sha1(stdout.encode("utf-8"))
+  for path in watch:
+    digest.update(b"\0" + path.encode("utf-8") + b"\0")
+    try:
+      with open(path, "rb") as f:
+        digest.update(hashlib.file_digest(f, "sha1").digest())
+    except FileNotFoundError:
+      digest.update(b"missing")
+  return digest.hexdigest()
@@ -9,6 +9,7 @@ from typing import Any
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
 from setuppy.commands.utils import run_pipe
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
@@ -29,6 +30,25 @@ class Curl(BaseCommand):
   sources: list[str]
   dest: str
 
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether any of the targets don't exist."""
+    dest = pathlib.Path(interpolate(self.dest, facts))
+
+    for s in self.sources:
+      target = dest / os.path.basename(interpolate(s, facts))
+
+      # Leave unknown suffixes and invalid targets to be reported when run.
+      if "".join(target.suffixes) != ".tar.xz":
+        return None
+      target = target.with_suffix("").with_suffix("")
+      if target.is_file():
+        return None
+
+      if not target.exists():
+        return True
+
+    return False
+
   def __call__(
     self,
     *,
@@ -36,11 +56,11 @@ class Curl(BaseCommand):
     simulate: bool,
   ) -> CommandResult:
     """Run the curl command."""
-    dest = pathlib.Path(self.dest.format(**facts))
+    dest = pathlib.Path(interpolate(self.dest, facts))
     changed = False
 
     for s in self.sources:
-      source = s.format(**facts)
+      source = interpolate(s, facts)
       target = dest / os.path.basename(source)
       suffix = "".join(target.suffixes)
 
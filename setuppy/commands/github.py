@@ -9,6 +9,7 @@ from typing import Any
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
 from setuppy.commands.utils import run_command
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
@@ -26,6 +27,29 @@ class Github(BaseCommand):
   sources: list[str]
   dest: str
 
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether any of the repositories haven't been cloned."""
+    dest = pathlib.Path(interpolate(self.dest, facts))
+
+    for s in self.sources:
+      source = interpolate(s, facts)
+      target = dest / os.path.basename(source)
+      gitdir = target / ".git"
+
+      if not target.exists():
+        return True
+
+      # Leave targets which aren't clones of the repository to be reported when
+      # run.
+      if not gitdir.is_dir():
+        return None
+      cmd = ["git", "--git-dir", str(gitdir), "remote", "get-url", "origin"]
+      rc, stdout, _ = run_command(cmd)
+      if rc != 0 or stdout.strip() != f"https://github.com/{source}":
+        return None
+
+    return False
+
   def __call__(
     self,
     *,
@@ -33,11 +57,11 @@ class Github(BaseCommand):
     simulate: bool,
   ) -> CommandResult:
     """Run the github action."""
-    dest = pathlib.Path(self.dest.format(**facts))
+    dest = pathlib.Path(interpolate(self.dest, facts))
     changed = False
 
     for s in self.sources:
-      source = s.format(**facts)
+      source = interpolate(s, facts)
       target = dest / os.path.basename(source)
       gitdir = target / ".git"
       url = f"https://github.com/{source}"
@@ -75,7 +99,7 @@ class Github(BaseCommand):
 
       # Run the git command if we're not simulating.
       if not simulate:
-        rc, stderr, _ = run_command(cmd)
+        rc, _, _ = run_command(cmd, stream=True)
         if rc != 0:
           msg = f'Error cloning target "{target}".'
           raise SetuppyError(msg)
@@ -6,14 +6,23 @@
 # code.
 
 import dataclasses
+import hashlib
 import logging
+import os
 import pathlib
 import re
+from collections.abc import Hashable
+from collections.abc import Iterator
+from collections.abc import Sequence
 from typing import Any
 
+from setuppy.cache import get_cache
+from setuppy.cache import stamp
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
+from setuppy.commands.utils import get_executor
 from setuppy.commands.utils import run_command
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
@@ -34,12 +43,57 @@ STOW_CONFLICT_RE = {
 STOW_CONFLICT_RE["2.4.1"] = STOW_CONFLICT_RE["2.4.0"]
 
 
+# Files which stow ignores by default, i.e. if neither a package's
+# .stow-local-ignore nor ~/.stow-global-ignore exist.
+STOW_DEFAULT_IGNORE = [
+  r"RCS",
+  r".+,v",
+  r"CVS",
+  r"\.\#.+",
+  r"\.cvsignore",
+  r"\.svn",
+  r"_darcs",
+  r"\.hg",
+  r"\.git",
+  r"\.gitignore",
+  r"\.gitmodules",
+  r".+~",
+  r"\#.*\#",
+  r"^/README.*",
+  r"^/LICENSE.*",
+  r"^/COPYING",
+]
+
+
 @dataclasses.dataclass
 class Stow(BaseCommand):
-  """Implementation of the stow command."""
-  package: str
+  """Implementation of the stow command.
+
+  This restows the given `package`, or list of `packages`, from `stowdir` into
+  `targetdir` with the semantics of `stow --no-folding -R`, i.e. every file in
+  the package is symlinked into the corresponding directory under `targetdir`,
+  creating directories as necessary, and any links to files no longer in the
+  package are removed. An error is raised if any target exists and isn't a link
+  owned by the package.
+
+  The fingerprint of each package (i.e. of the paths in its tree) is cached
+  between runs, and any package whose fingerprint is unchanged and whose links
+  are all still in place is skipped entirely.
+
+  By default GNU stow itself is run, in which case all packages (including
+  those from consecutive stow actions sharing the same `stowdir` and
+  `targetdir`) are stowed by a single call to stow. If `native` is true this is
+  instead done natively, in-process; this is opt-in since it doesn't yet
+  implement everything stow does, e.g. unfolding directories.
+
+  The returned `CommandResult` will have `result.changed` set to `True` if any
+  links were created or removed.
+  """
+  package: str | None = None
   stowdir: str = "dotfiles"
   targetdir: str = "{home}"
+  native: bool = False
+  packages: list[str] = dataclasses.field(default_factory=list)
 
   def __call__(
     self,
@@ -48,57 +102,398 @@ class Stow(BaseCommand):
     simulate: bool,
   ) -> CommandResult:
     """Run the command."""
-    # Get the version of stow.
-    version = facts.get("stow_version")
-
-    if not version:
-      version = _get_stow_version()
-
+    return self.run_batch([self], facts=facts, simulate=simulate)[0]
+
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether every package is stowed and unchanged.
+
+    Packages which aren't known to be stowed may still have all of their links
+    in place, so the check is inconclusive unless every package is.
+    """
+    stowdir = pathlib.Path(interpolate(self.stowdir, facts))
+    targetdir = pathlib.Path(interpolate(self.targetdir, facts))
+    packages = self._get_packages(facts)
+
+    # Leave any errors to be raised when the command is run.
+    if not all((stowdir / package).is_dir() for package in packages):
+      return None
+
+    stowed = all(
+      _is_stowed(
+        stowdir,
+        targetdir,
+        package,
+        *_get_fingerprint(stowdir, targetdir, package),
+      )
+      for package in packages
+    )
+    return False if stowed else None
+
+  def batch_key(self, facts: dict[str, Any]) -> Hashable | None:
+    """Return a key so that stows into the same targetdir are batched."""
+    stowdir = interpolate(self.stowdir, facts)
+    targetdir = interpolate(self.targetdir, facts)
+    return (stowdir, targetdir, self.native)
+
+  @classmethod
+  def run_batch(
+    cls,
+    commands: Sequence["Stow"],
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> list[CommandResult]:
+    """Run a batch of stow commands sharing the same stowdir and targetdir."""
     # Format the input options.
-    package = self.package.format(**facts)
-    stowdir = pathlib.Path(self.stowdir.format(**facts))
-    targetdir = pathlib.Path(self.targetdir.format(**facts))
+    stowdir = pathlib.Path(interpolate(commands[0].stowdir, facts))
+    targetdir = pathlib.Path(interpolate(commands[0].targetdir, facts))
+    packages = [command._get_packages(facts) for command in commands]
 
     if not stowdir.is_dir():
       msg = f'stowdir "{stowdir}" does not exist or is not a directory.'
       raise SetuppyError(msg)
 
-    if not (stowdir / package).is_dir():
-      msg = f'package directory "{stowdir/package}" does not exist '
-      msg += "or is not a directory."
-      raise SetuppyError(msg)
+    # Collect the packages, in order and without duplicates.
+    allpackages = list(dict.fromkeys(p for ps in packages for p in ps))
+
+    for package in allpackages:
+      if not (stowdir / package).is_dir():
+        msg = f'package directory "{stowdir/package}" does not exist '
+        msg += "or is not a directory."
+        raise SetuppyError(msg)
+
+    # Skip any package which is unchanged since it was last stowed and whose
+    # links are all still in place.
+    fingerprints = {
+      package: _get_fingerprint(stowdir, targetdir, package)
+      for package in allpackages
+    }
+    stale = [
+      package
+      for package in allpackages
+      if not _is_stowed(stowdir, targetdir, package, *fingerprints[package])
+    ]
+    changes = {package: (set(), set()) for package in allpackages}
+    newfacts = {}
+
+    if not stale:
+      logging.info("Packages %s are unchanged", ", ".join(allpackages))
+
+    elif commands[0].native:
+      for package in stale:
+        changes[package] = _restow(stowdir, targetdir, package, simulate)
+
+    else:
+      # Get the version of stow, which is also cached across runs until the
+      # stow executable that's run changes.
+      version = facts.get("stow_version")
+
+      if not version:
+        path = get_executor().which("stow")
+        version = get_cache().get_or_compute(
+          "facts",
+          "stow_version",
+          _get_stow_version,
+          stamps=[path, stamp(path)],
+        )
+
+      newfacts = {"stow_version": version}
+      changes.update(_run_stow(stowdir, targetdir, stale, simulate, version))
+
+    # Record the fingerprints of the packages we've now stowed.
+    if not simulate:
+      for package in stale:
+        get_cache().set(
+          "stow",
+          _get_fingerprint_key(stowdir, targetdir, package),
+          True,
+          stamps=[fingerprints[package][0]],
+        )
+
+    for package, (unlinked, linked) in changes.items():
+      if unlinked:
+        files = [f'"{targetdir/file}"' for file in unlinked]
+        logging.info("Unlinking files %s", ", ".join(files))
+
+      if linked:
+        files = [f'"{targetdir/file}"' for file in linked]
+        logging.info("Linking files %s", ", ".join(files))
+
+    return [
+      CommandResult(
+        changed=any(changes[p][0] or changes[p][1] for p in ps),
+        facts=newfacts,
+      )
+      for ps in packages
+    ]
+
+  def _get_packages(self, facts: dict[str, Any]) -> list[str]:
+    """Return the formatted list of packages to stow."""
+    packages = [self.package] if self.package is not None else []
+    packages += self.packages
+    if not packages:
+      raise SetuppyError("stow requires a package or packages.")
+    return [interpolate(package, facts) for package in packages]
+
+
+def _run_stow(
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  packages: list[str],
+  simulate: bool,
+  version: str,
+) -> dict[str, tuple[set[str], set[str]]]:
+  """Restow the packages with a single call to GNU stow.
 
-    # Format the command itself.
-    cmd = ["stow", "-v", "--no-folding"]
-    cmd += ["-d", str(stowdir)]
-    cmd += ["-t", str(targetdir)]
-    cmd += ["-R", str(package)]
-    cmd += ["-n"] if simulate else []
-
-    # Run the command. If rc is nonzero there should be conflicts which we can
-    # identify and mark as a failure.
-    rc, _, stderr = run_command(cmd)
-    if rc != 0:
-      conflicts = _get_conflicts_from_stderr(stderr, version)
-      conflicts = [f'"{targetdir/conflict}"' for conflict in conflicts]
-      msg = f"target files already exist: {', '.join(conflicts)}"
-      raise SetuppyError(msg)
+  Returns:
+    A dictionary mapping each package to the sets of files unlinked and linked
+    for that package, relative to targetdir.
+  """
+  # Format the command itself.
+  cmd = ["stow", "-v", "--no-folding"]
+  cmd += ["-d", str(stowdir)]
+  cmd += ["-t", str(targetdir)]
+  cmd += ["-R", *packages]
+  cmd += ["-n"] if simulate else []
+
+  # Run the command. If rc is nonzero there should be conflicts which we can
+  # identify and mark as a failure.
+  rc, _, stderr = run_command(cmd)
+  if rc != 0:
+    conflicts = _get_conflicts_from_stderr(stderr, version)
+    conflicts = [f'"{targetdir/conflict}"' for conflict in conflicts]
+    msg = f"target files already exist: {', '.join(conflicts)}"
+    raise SetuppyError(msg)
+
+  # Otherwise we can find the links that were either removed or added.
+  return _get_changes_from_stderr(stderr, stowdir, targetdir, packages)
+
+
+def _restow(
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  package: str,
+  simulate: bool,
+) -> tuple[set[str], set[str]]:
+  """Restow the package natively, following `stow --no-folding -R`.
 
-    # Otherwise we can find the links that were either removed or added.
-    unlinked, linked = _get_changes_from_stderr(stderr)
+  Links which are already correct are left alone, so restowing an unchanged
+  package only requires reading the links in the target directories.
 
-    if unlinked:
-      files = [f'"{targetdir/file}"' for file in unlinked]
-      logging.info("Unlinking files %s", ", ".join(files))
+  Returns:
+    The sets of files unlinked and linked, relative to targetdir.
+  """
+  stowabs = os.path.abspath(stowdir)
+  pkgabs = os.path.join(stowabs, package)
+  ignore = _get_ignore_re(pathlib.Path(pkgabs))
+
+  mkdirs = []
+  unlinks = []
+  links = []
+  conflicts = []
+
+  for reldir, files, dirs in _walk_package(pkgabs, ignore):
+    target = os.path.normpath(os.path.join(targetdir, reldir))
+    targetabs = os.path.abspath(target)
+
+    # Every directory in the package must be a real directory in the target.
+    # Note that with --no-folding we never link a directory.
+    if not os.path.lexists(target):
+      mkdirs.append(target)
+      existing = dict()
+    elif os.path.islink(target) or not os.path.isdir(target):
+      conflicts.append(target)
+      continue
+    else:
+      existing = _read_links(target)
+
+    for name, dest in existing.items():
+      # Remove any link into this package whose source is no longer part of it;
+      # links anywhere else are not ours to touch.
+      source = os.path.normpath(os.path.join(targetabs, dest))
+      if _is_under(source, pkgabs) and name not in files and name not in dirs:
+        unlinks.append(os.path.join(target, name))
+
+    for name in files:
+      source = os.path.join(pkgabs, reldir, name)
+      path = os.path.join(target, name)
+      dest = existing.get(name)
+
+      if dest is None:
+        if os.path.lexists(path):
+          # The target exists and isn't a link.
+          conflicts.append(path)
+        else:
+          links.append((path, os.path.relpath(source, targetabs)))
+        continue
+
+      current = os.path.normpath(os.path.join(targetabs, dest))
+      if current == os.path.normpath(source):
+        # The link is already correct.
+        continue
+      if not _is_under(current, pkgabs):
+        # The link belongs to something else, possibly another package.
+        conflicts.append(path)
+        continue
+
+      # Otherwise it's a stale link into this package; replace it.
+      unlinks.append(path)
+      links.append((path, os.path.relpath(source, targetabs)))
+
+  if conflicts:
+    conflicts = [f'"{conflict}"' for conflict in conflicts]
+    msg = f"target files already exist: {', '.join(conflicts)}"
+    raise SetuppyError(msg)
+
+  if not simulate:
+    for path in unlinks:
+      os.unlink(path)
+    for path in mkdirs:
+      os.mkdir(path)
+    for path, dest in links:
+      os.symlink(dest, path)
+
+  unlinked = {os.path.relpath(path, targetdir) for path in unlinks}
+  linked = {os.path.relpath(path, targetdir) for path, _ in links}
+  return unlinked - linked, linked
+
+
+def _get_fingerprint_key(
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  package: str,
+) -> tuple[str, str, str]:
+  """Return the key under which a package's fingerprint is cached."""
+  return (os.path.abspath(stowdir), os.path.abspath(targetdir), package)
+
+
+def _get_fingerprint(
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  package: str,
+) -> tuple[str, list[tuple[str, str]]]:
+  """Compute the fingerprint of a package.
+
+  The fingerprint is a hash of the relative paths and types of everything in
+  the package, i.e. it changes whenever the set of links stowing the package
+  would change.
 
-    if linked:
-      files = [f'"{targetdir/file}"' for file in linked]
-      logging.info("Linking files %s", ", ".join(files))
+  Returns:
+    A tuple (fingerprint, links) where links is a list of (path, dest) pairs of
+    the links which stowing the package should create.
+  """
+  pkgabs = os.path.join(os.path.abspath(stowdir), package)
+  ignore = _get_ignore_re(pathlib.Path(pkgabs))
+  digest = hashlib.sha1()
+  links = []
+
+  for reldir, files, dirs in _walk_package(pkgabs, ignore):
+    target = os.path.normpath(os.path.join(targetdir, reldir))
+    targetabs = os.path.abspath(target)
+    for name in sorted(dirs):
+      digest.update(f"d {os.path.join(reldir, name)}\0".encode())
+    for name in sorted(files):
+      digest.update(f"f {os.path.join(reldir, name)}\0".encode())
+      source = os.path.relpath(os.path.join(pkgabs, reldir, name), targetabs)
+      links.append((os.path.join(target, name), source))
+
+  return digest.hexdigest(), links
+
+
+def _is_stowed(
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  package: str,
+  fingerprint: str,
+  links: list[tuple[str, str]],
+) -> bool:
+  """Return whether the package is stowed and unchanged since it was stowed."""
+  key = _get_fingerprint_key(stowdir, targetdir, package)
+  if not get_cache().get("stow", key, stamps=[fingerprint]):
+    return False
+
+  try:
+    return all(os.readlink(path) == dest for path, dest in links)
+  except OSError:
+    return False
+
+
+def _walk_package(
+  pkgdir: str,
+  ignore: tuple[re.Pattern, re.Pattern],
+) -> Iterator[tuple[str, set[str], set[str]]]:
+  """Walk the package top-down, skipping any ignored files.
+
+  Yields:
+    Tuples (reldir, files, dirs) where reldir is relative to the package, files
+    are the names of everything to link (including symlinks), and dirs are the
+    names of the subdirectories to recurse into.
+  """
+  name_re, path_re = ignore
+  stack = [""]
+  while stack:
+    reldir = stack.pop()
+    files = set()
+    dirs = set()
+    with os.scandir(os.path.join(pkgdir, reldir)) as entries:
+      for entry in entries:
+        relpath = "/" + os.path.join(reldir, entry.name)
+        if name_re.fullmatch(entry.name) or path_re.fullmatch(relpath):
+          continue
+        if entry.is_dir(follow_symlinks=False):
+          dirs.add(entry.name)
+        else:
+          files.add(entry.name)
+    yield reldir, files, dirs
+    stack.extend(os.path.join(reldir, d) for d in sorted(dirs, reverse=True))
+
+
+def _get_ignore_re(pkgdir: pathlib.Path) -> tuple[re.Pattern, re.Pattern]:
+  """Get the regexes matching files which stow should ignore for a package.
+
+  As with stow, patterns containing a "/" are matched against the path of a file
+  relative to the package (with a leading "/") and all other patterns are
+  matched against its name.
 
-    return CommandResult(
-        changed=bool(linked | unlinked),
-        facts={"stow_version": version},
+  Returns:
+    A tuple (name_re, path_re) of the regexes.
+  """
+  for path in [
+    pkgdir / ".stow-local-ignore",
+    pathlib.Path(os.path.expanduser("~/.stow-global-ignore")),
+  ]:
+    if path.is_file():
+      lines = [line.strip() for line in path.read_text().splitlines()]
+      patterns = [line for line in lines if line and not line.startswith("#")]
+      break
+  else:
+    patterns = STOW_DEFAULT_IGNORE
+
+  # Stow always ignores its own ignore file. Note that "(?!)" never matches.
+  names = [r"\.stow-local-ignore"] + [p for p in patterns if "/" not in p]
+  paths = [p for p in patterns if "/" in p] or ["(?!)"]
+  try:
+    return (
+      re.compile("|".join(f"(?:{pattern})" for pattern in names)),
+      re.compile("|".join(f"(?:{pattern})" for pattern in paths)),
     )
+  except re.error as e:
+    raise SetuppyError(f"could not parse stow ignore patterns: {e}") from e
+
+
+def _read_links(path: str) -> dict[str, str]:
+  """Return a dictionary mapping the name of each link in path to its value."""
+  with os.scandir(path) as entries:
+    return {
+      entry.name: os.readlink(entry.path)
+      for entry in entries
+      if entry.is_symlink()
+    }
+
+
+def _is_under(path: str, directory: str) -> bool:
+  """Return whether path is under the given (normalized) directory."""
+  return path.startswith(directory + os.sep)
 
 
 def _get_stow_version() -> str:
@@ -141,33 +536,67 @@ def _get_conflicts_from_stderr(stderr: str, version: str) -> set[str]:
   return conflicts
 
 
-def _get_changes_from_stderr(stderr: str) -> tuple[set[str], set[str]]:
-  """Return the set of unlinked and linked changes.
+def _get_changes_from_stderr(
+  stderr: str,
+  stowdir: pathlib.Path,
+  targetdir: pathlib.Path,
+  packages: list[str],
+) -> dict[str, tuple[set[str], set[str]]]:
+  """Return the set of unlinked and linked changes for each package.
+
+  Links are attributed to a package by where they point. Unlinked files are
+  attributed to the package containing a file of the same name; any which can't
+  be attributed (e.g. a link to a file since removed from its package) are
+  conservatively attributed to every package.
 
   Args:
     stderr: the stderr (str) returned by running stow.
+    stowdir: the stow directory.
+    targetdir: the target directory.
+    packages: the packages which were stowed.
 
   Returns:
-    Two sets of strings the first of which are the set of files that have been
-    removed by stow and the second is the set of files that have been added by
-    stow.
+    A dictionary mapping each package to two sets of strings the first of which
+    are the set of files that have been removed by stow and the second is the
+    set of files that have been added by stow.
   """
   # Each line should contain info for a single file that was linked/unlinked. So
   # we will grab that using the following regexes.
   unlinked_re = re.compile(r"^UNLINK: (?P<target>.+)$")
-  linked_re = re.compile(r"^LINK: (?P<target>.+) =>")
+  linked_re = re.compile(
+    r"^LINK: (?P<target>.+) => (?P<source>.+?)"
+    r"(?: \(reverts previous action\))?$"
+  )
+
+  stowabs = os.path.abspath(stowdir)
+  targetabs = os.path.abspath(targetdir)
 
-  # Build up these two sets.
-  unlinked = set()
-  linked = set()
+  # Build up these two sets for each package.
+  unlinked = {package: set() for package in packages}
+  linked = {package: set() for package in packages}
 
   for line in stderr.split("\n"):
     match = unlinked_re.match(line.strip())
     if match:
-      unlinked.add(match.group("target"))
+      target = match.group("target")
+      owners = [p for p in packages if os.path.lexists(stowdir / p / target)]
+      for package in owners or packages:
+        unlinked[package].add(target)
       continue
     match = linked_re.match(line.strip())
     if match:
-      linked.add(match.group("target"))
-
-  return unlinked-linked, linked-unlinked
+      target = match.group("target")
+      source = os.path.normpath(os.path.join(
+        targetabs, os.path.dirname(target), match.group("source")
+      ))
+      package = os.path.relpath(source, stowabs).split(os.sep)[0]
+      for package in [package] if package in linked else packages:
+        linked[package].add(target)
+
+  return {
+    package: (
+      unlinked[package] - linked[package],
+      linked[package] - unlinked[package],
+    )
+    for package in packages
+  }
@@ -1,16 +1,45 @@
 """Implementation of the template command."""
 
+import concurrent.futures
 import dataclasses
 import logging
 import os
 import pathlib
+import shutil
+from collections.abc import Iterator
 from typing import Any
 
+from setuppy.cache import get_cache
+from setuppy.cache import stamp
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
+from setuppy.interpolate import CompiledTemplate
+from setuppy.interpolate import interpolate
 from setuppy.types import SetuppyError
 
 
+def compile_template(file: pathlib.Path) -> CompiledTemplate:
+  """Compile the given template file, caching the result.
+
+  Compiled templates are cached (both in memory and, if the cache is
+  persistent, on disk) keyed on the file's path and stamp, so that a file is
+  only re-parsed when it is modified.
+  """
+  def compile() -> CompiledTemplate:
+    try:
+      return CompiledTemplate.compile(file.read_text())
+    except UnicodeDecodeError:
+      msg = f'"{file}" is not a text file; it should be marked as raw.'
+      raise SetuppyError(msg) from None
+
+  return get_cache().get_or_compute(
+    "templates",
+    str(file.absolute()),
+    compile,
+    stamps=[stamp(file)],
+  )
+
+
 @dataclasses.dataclass
 class Template(BaseCommand):
   """Recursively format and write template files from `source` to `dest`.
@@ -18,13 +47,58 @@ class Template(BaseCommand):
   This command takes a `source` directory, recursively finds all files under
   this directory, and copies them to the directory `dest`. The contents of each
   source file is formatted using `str.format` with substitutions given by the
-  global facts dictionary.
+  global facts dictionary. Before any file is written every template is checked
+  for references to facts which don't exist, and all such references are
+  reported together.
+
+  Files matching any of the glob patterns in `raw` (e.g. "*.ttf") are copied
+  verbatim rather than formatted, along with their permissions. Raw files are
+  copied by `shutil.copy`, whose data copy uses the OS's in-kernel copy
+  (`sendfile` on Linux, `fcopyfile` on macOS) so that they're never read into
+  memory, and which then copies their permission bits.
+
+  Templates are read and written concurrently by a pool of at most `jobs`
+  threads, which helps when `dest` is on a high-latency (e.g. network) file
+  system.
 
   The returned `CommandResult` will have `result.changed` set to `True` if a
   change is made, i.e. if any file under `source` is created under the `dest`.
   """
   source: str
   dest: str = "{home}"
+  raw: list[str] = dataclasses.field(default_factory=list)
+  jobs: int = 8
+
+  def __post_init__(self):
+    """Make sure there's at least one thread to write the templates."""
+    if self.jobs < 1:
+      msg = f"template jobs must be at least 1, not {self.jobs}."
+      raise SetuppyError(msg)
+
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Check whether any of the targets don't exist."""
+    source = pathlib.Path(interpolate(self.source, facts))
+    dest = pathlib.Path(interpolate(self.dest, facts))
+
+    # Leave any errors to be raised when the command is run.
+    if not source.is_dir():
+      return None
+
+    try:
+      for reldir, files in _walk(source):
+        existing = _list_dir(dest / reldir) or {}
+        if any(existing.get(f) for f in files):
+          return None
+        if any(f not in existing for f in files):
+          return True
+    except SetuppyError:
+      return None
+
+    return False
+
+  def templates(self) -> list[str]:
+    """Return the strings which are interpolated, i.e. all but the raw globs."""
+    return [self.source, self.dest]
 
   def __call__(
     self,
@@ -33,27 +107,31 @@ class Template(BaseCommand):
     simulate: bool,
   ) -> CommandResult:
     """Run the template command."""
-    source = pathlib.Path(self.source.format(**facts))
-    dest = pathlib.Path(self.dest.format(**facts))
-    changed = False
+    source = pathlib.Path(interpolate(self.source, facts))
+    dest = pathlib.Path(interpolate(self.dest, facts))
 
     # Raise an exception if source exists and is not a directory.
     if not source.is_dir():
       msg = f'"{source.absolute()}" does not exist or is not a directory.'
       raise SetuppyError(msg)
 
-    # NOTE: In order to support py3.11 we can't use source.walk() which was only
-    # introduced in py3.12.
+    # Walk the source tree one directory at a time. Each destination directory
+    # is listed once, rather than checking every target individually.
+    pending = []
+    copies = []
+    newdirs = []
+    for reldir, files in _walk(source):
+      existing = _list_dir(dest / reldir)
+      if existing is None and files:
+        newdirs.append(dest / reldir)
 
-    # Walk the path.
-    for path, _, files in os.walk(source):
       for f in files:
-        file = pathlib.Path(path) / f
-        target = dest / file.relative_to(source)
+        file = source / reldir / f
+        target = dest / reldir / f
 
-        if target.exists():
+        if existing is not None and f in existing:
           # Raise an exception if the target exists and is not a file.
-          if target.is_dir():
+          if existing[f]:
             msg = f'"{target.absolute()}" exists and is not a file.'
             raise SetuppyError(msg)
 
@@ -64,14 +142,89 @@ class Template(BaseCommand):
           # TODO: Should we try and evaluate whether the file's contents would
           # be changed and only skip if they WOULDN'T be changed.
 
-        # Target doesn't exist so we'll create it.
-        changed = True
+        if any((reldir / f).match(pattern) for pattern in self.raw):
+          copies.append((file, target))
+        else:
+          pending.append((file, target))
+
+    with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool:
+      # Compile the templates concurrently, since reading them is I/O bound.
+      templates = list(pool.map(compile_template, [f for f, _ in pending]))
+
+      # Report every undefined fact before we write anything.
+      missing = []
+      for (file, _), template in zip(pending, templates):
+        if fields := template.fields - facts.keys():
+          names = ", ".join(f'"{field}"' for field in sorted(fields))
+          missing.append(f'"{file}" ({names})')
+      if missing:
+        msg = f"undefined facts in templates: {', '.join(missing)}"
+        raise SetuppyError(msg)
+
+      for _, target in pending + copies:
         logging.info('Creating "%s"', target)
 
-        # Ensure the target's parent dirs exist and run the command, but only if
-        # we're not simulating.
-        if not simulate:
-          target.parent.mkdir(parents=True, exist_ok=True)
-          target.write_text(file.read_text().format(**facts))
+      # Create any missing directories and write the targets, but only if we're
+      # not simulating. Parents are created before their children since the
+      # walk is top-down.
+      if not simulate:
+        for newdir in newdirs:
+          newdir.mkdir(parents=True, exist_ok=True)
+
+        def write(target: pathlib.Path, template: CompiledTemplate):
+          target.write_text(template.render(facts))
+
+        # Consume the results so that any exception is re-raised here.
+        list(pool.map(write, [t for _, t in pending], templates))
+        sources, targets = [f for f, _ in copies], [t for _, t in copies]
+        list(pool.map(shutil.copy, sources, targets))
+
+    return CommandResult(changed=bool(pending or copies))
 
-    return CommandResult(changed=changed)
+
+def _walk(source: pathlib.Path) -> Iterator[tuple[pathlib.Path, list[str]]]:
+  """Walk the tree under source, top-down, using `os.scandir`.
+
+  NOTE: In order to support py3.11 we can't use source.walk() which was only
+  introduced in py3.12. As with `os.walk` symlinks to directories are neither
+  followed nor returned.
+
+  Yields:
+    Tuples (reldir, files) of each directory relative to source and the names
+    of the files it contains.
+  """
+  stack = [pathlib.Path()]
+  while stack:
+    reldir = stack.pop()
+    files = []
+    subdirs = []
+    with os.scandir(source / reldir) as entries:
+      for entry in entries:
+        if not entry.is_dir():
+          files.append(entry.name)
+        elif not entry.is_symlink():
+          subdirs.append(reldir / entry.name)
+    yield reldir, files
+    stack.extend(reversed(subdirs))
+
+
+def _list_dir(path: pathlib.Path) -> dict[str, bool] | None:
+  """List the existing entries of a directory.
+
+  Returns:
+    A dictionary mapping the name of each existing entry to whether it is a
+    directory, or None if the directory doesn't exist.
+  """
+  try:
+    with os.scandir(path) as entries:
+      # Broken symlinks don't count as existing (matching `Path.exists`).
+      return {
+        entry.name: entry.is_dir()
+        for entry in entries
+        if not entry.is_symlink() or os.path.exists(entry.path)
+      }
+  except FileNotFoundError:
+    return None
+  except NotADirectoryError:
+    msg = f'"{path.absolute()}" exists and is not a directory.'
+    raise SetuppyError(msg) from None
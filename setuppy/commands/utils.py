@@ -1,74 +1,584 @@
 """Utility functions for running commands."""
 
+import collections
+import contextlib
+import dataclasses
 import logging
+import os
+import pathlib
+import re
+import shlex
 import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable
 from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Sequence
+from typing import IO
+from typing import Any
+from typing import cast
 
+from setuppy.events import SubprocessFinished
+from setuppy.events import SubprocessStarted
+from setuppy.events import get_bus
+from setuppy.trace import get_tracer
 from setuppy.types import SetuppyError
 
 
+# The number of lines of each output stream kept in memory when streaming.
+STREAM_BUFFER_LINES = 1000
+
+# How often (in seconds) to check if a pipeline has timed out or been cancelled.
+PIPELINE_POLL_INTERVAL = 0.1
+
+
+@dataclasses.dataclass
+class SpawnStats:
+  """Accounting for the processes spawned on behalf of a single label.
+
+  Properties:
+    spawns: the number of processes spawned.
+    wall_time: the total wall-clock time (in seconds) spent waiting on them.
+  """
+  spawns: int = 0
+  wall_time: float = 0.0
+
+
+class Executor:
+  """Runs processes on behalf of commands.
+
+  All processes started by setuppy go through a single executor, which resolves
+  commands on the PATH (memoizing the result until the PATH changes), applies
+  any timeout and environment overrides, limits the number of processes which
+  run concurrently, and accounts for the number of processes spawned and the
+  time spent waiting on them. Accounting is attributed to the label set by
+  `label`, e.g. the name of the action being run.
+
+  Processes can also be run in streaming mode, for long-running commands whose
+  output may be large. Their output is logged line by line as it arrives and
+  optionally written in full to a log file per label under `logdir`, while only
+  a bounded tail of it is kept in memory.
+
+  Commands run under sudo may prompt for a password on the terminal, so any
+  live output is suspended by `suspend_output` while they run.
+  """
+
+  def __init__(
+    self,
+    *,
+    timeout: float | None = None,
+    env: dict[str, str] | None = None,
+    max_procs: int | None = None,
+    sudo: str = "/usr/bin/sudo",
+    logdir: str | os.PathLike[str] | None = None,
+    shell_worker: bool = False,
+  ):
+    """Initialize the executor.
+
+    Args:
+      timeout: default timeout (in seconds) for each process, or None.
+      env: environment variables to override for each process.
+      max_procs: maximum number of processes to run concurrently, or None.
+      sudo: the path to sudo.
+      logdir: directory to which the full output of streamed processes is
+        written, one file per label, or None.
+      shell_worker: if true, run commands which allow it in a `ShellWorker`.
+    """
+    self.timeout = timeout
+    self.env = dict(env or {})
+    self.sudo = sudo
+    self.logdir = pathlib.Path(logdir) if logdir is not None else None
+    self.stats: dict[str, SpawnStats] = collections.defaultdict(SpawnStats)
+    self._paths: dict[str, str] = dict()
+    self._pathenv: str | None = None
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._slots = threading.BoundedSemaphore(max_procs) if max_procs else None
+    self.shell_worker = shell_worker
+    self._worker: ShellWorker | None = None
+    self.suspend_output: Callable[
+      [], contextlib.AbstractContextManager[None]
+    ] = contextlib.nullcontext
+
+  def close(self):
+    """Release any resources held by the executor, i.e. its shell worker."""
+    with self._lock:
+      if self._worker is not None:
+        self._worker.close()
+        self._worker = None
+
+  def which(self, name: str) -> str:
+    """Return the full path of the named command, raising if it's missing."""
+    pathenv = self.env.get("PATH", os.environ.get("PATH"))
+    with self._lock:
+      # Forget everything we've found if the PATH changes.
+      if pathenv != self._pathenv:
+        self._paths.clear()
+        self._pathenv = pathenv
+
+      fullpath = self._paths.get(name)
+      if fullpath is None:
+        if "PATH" in self.env:
+          fullpath = shutil.which(name, path=pathenv)
+        else:
+          fullpath = shutil.which(name)
+        if fullpath is None:
+          raise SetuppyError(f"Could not find command: {name}")
+        self._paths[name] = fullpath
+
+    return fullpath
+
+  @contextlib.contextmanager
+  def label(self, label: str) -> Iterator[None]:
+    """Attribute any processes spawned by this thread to the given label."""
+    old_label = getattr(self._local, "label", "")
+    self._local.label = label
+    try:
+      yield
+    finally:
+      self._local.label = old_label
+
+  @contextlib.contextmanager
+  def _spawn(self, desc: str, count: int = 1) -> Iterator[None]:
+    """Account for spawning count processes, waiting for a free slot first.
+
+    Args:
+      desc: description of the processes, used to trace them.
+      count: the number of processes.
+    """
+    if self._slots is not None:
+      self._slots.acquire()
+    start = time.monotonic()
+    label = getattr(self._local, "label", "")
+    get_bus().emit(SubprocessStarted(label=label, command=desc))
+    try:
+      with get_tracer().span(desc, "subprocess", label=label):
+        yield
+    finally:
+      elapsed = time.monotonic() - start
+      if self._slots is not None:
+        self._slots.release()
+      get_bus().emit(
+        SubprocessFinished(label=label, command=desc, duration=elapsed)
+      )
+      with self._lock:
+        stats = self.stats[label]
+        stats.spawns += count
+        stats.wall_time += elapsed
+
+  def _popen_kwargs(self, env: dict[str, str] | None) -> dict[str, Any]:
+    """Return extra keyword arguments for `subprocess` given env overrides."""
+    env = {**self.env, **(env or {})}
+    return {"env": {**os.environ, **env}} if env else {}
+
+  def run(
+    self,
+    cmd: Iterable[str],
+    *,
+    sudo: bool = False,
+    timeout: float | None = None,
+    env: dict[str, str] | None = None,
+    stream: bool = False,
+    worker: bool = False,
+  ) -> tuple[int, str, str]:
+    """Run the given command; see `run_command`."""
+    cmd = list(cmd)
+    cmd[0] = self.which(cmd[0])
+
+    if sudo:
+      cmd = [self.sudo, *cmd]
+
+    kwargs = self._popen_kwargs(env)
+    timeout = timeout if timeout is not None else self.timeout
+    if timeout is not None:
+      kwargs["timeout"] = timeout
+
+    suspend = self.suspend_output() if sudo else contextlib.nullcontext()
+    with self._spawn(" ".join(cmd)), suspend:
+      try:
+        # The worker only returns a command's output once it has finished, so
+        # commands whose output is streamed are spawned.
+        if worker and self.shell_worker and not (sudo or env or stream):
+          return self._get_worker().run(cmd, timeout=timeout)
+        if stream:
+          return self._run_streaming(cmd, **kwargs)
+        proc = subprocess.run(
+          cmd, capture_output=True, encoding="utf-8", check=False, **kwargs
+        )
+      except subprocess.TimeoutExpired:
+        msg = f'Command "{" ".join(cmd)}" timed out after {timeout} seconds.'
+        raise SetuppyError(msg) from None
+
+    return proc.returncode, proc.stdout, proc.stderr
+
+  def _get_worker(self) -> "ShellWorker":
+    """Return the shell worker, starting it if necessary."""
+    with self._lock:
+      if self._worker is not None and not self._worker.alive:
+        self._worker.close()
+        self._worker = None
+      if self._worker is None:
+        self._worker = ShellWorker(env=self._popen_kwargs(None).get("env"))
+      return self._worker
+
+  def _run_streaming(
+    self,
+    cmd: list[str],
+    *,
+    timeout: float | None = None,
+    **kwargs: Any,
+  ) -> tuple[int, str, str]:
+    """Run the command, streaming its output rather than capturing all of it.
+
+    Each line of output is logged as it arrives and, if there is a log
+    directory, appended to the log file for the current label. Only the last
+    `STREAM_BUFFER_LINES` lines of each stream are kept in memory and returned.
+    """
+    label = getattr(self._local, "label", "")
+    logfile = None
+    if self.logdir is not None:
+      self.logdir.mkdir(parents=True, exist_ok=True)
+      name = re.sub(r"[^\w.-]+", "_", label) or "setuppy"
+      logfile = (self.logdir / f"{name}.log").open("a", encoding="utf-8")
+      logfile.write(f"$ {' '.join(cmd)}\n")
+
+    # Unlike the output, stdin is inherited so that the command can still
+    # prompt the user.
+    proc = subprocess.Popen(
+      cmd,
+      stdin=None,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.PIPE,
+      encoding="utf-8",
+      errors="replace",
+      **kwargs,
+    )
+    lock = threading.Lock()
+    buffers = []
+    readers = []
+    pipes = [("stdout", proc.stdout), ("stderr", proc.stderr)]
+    for name, pipe in cast(list[tuple[str, IO[str]]], pipes):
+      buffer = collections.deque(maxlen=STREAM_BUFFER_LINES)
+      reader = threading.Thread(
+        target=_read_lines,
+        args=(pipe, buffer, f"[{label or cmd[0]}:{name}]", logfile, lock),
+        daemon=True,
+      )
+      reader.start()
+      buffers.append(buffer)
+      readers.append(reader)
+
+    try:
+      rc = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+      proc.kill()
+      proc.wait()
+      raise
+    finally:
+      for reader in readers:
+        reader.join()
+      if logfile is not None:
+        logfile.close()
+
+    stdout, stderr = ("".join(buffer) for buffer in buffers)
+    return rc, stdout, stderr
+
+  def pipeline(
+    self,
+    cmds: Sequence[Iterable[str]],
+    *,
+    timeout: float | None = None,
+    cancel: threading.Event | None = None,
+  ) -> "PipelineResult":
+    """Run a pipeline of commands, each piped into the next.
+
+    The stages are connected directly by OS pipes, so data flows between them
+    without passing through python. Each stage's stderr is collected separately
+    and the exit codes of every stage are reported. If the pipeline times out
+    or is cancelled every stage is killed.
+
+    Args:
+      cmds: the commands (and their arguments) making up the pipeline.
+      timeout: timeout (in seconds) for the whole pipeline, or None to use the
+        executor's default.
+      cancel: an event which, if set, cancels the pipeline.
+
+    Returns:
+      A `PipelineResult`.
+    """
+    cmds = [list(cmd) for cmd in cmds]
+    for cmd in cmds:
+      cmd[0] = self.which(cmd[0])
+
+    desc = " | ".join(" ".join(cmd) for cmd in cmds)
+    logging.info('Running command "%s"', desc)
+
+    kwargs = self._popen_kwargs(None)
+    timeout = timeout if timeout is not None else self.timeout
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    with self._spawn(desc, len(cmds)), contextlib.ExitStack() as stack:
+      stderrs = [stack.enter_context(tempfile.TemporaryFile()) for _ in cmds]
+      procs: list[subprocess.Popen] = []
+      stdout = []
+
+      try:
+        stdin = subprocess.DEVNULL
+        for cmd, stderr in zip(cmds, stderrs):
+          proc = subprocess.Popen(
+            cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr, **kwargs
+          )
+          # Close our copy of the previous stage's output, so that it only
+          # belongs to this stage and sees SIGPIPE if this stage exits.
+          if procs:
+            cast(IO[bytes], procs[-1].stdout).close()
+          procs.append(proc)
+          stdin = proc.stdout
+
+        # Drain the output of the last stage in the background so that we can
+        # wait on every stage, with a timeout, without deadlocking.
+        last = cast(IO[bytes], procs[-1].stdout)
+        reader = threading.Thread(
+          target=lambda: stdout.append(last.read()), daemon=True
+        )
+        reader.start()
+
+        for proc in procs:
+          while proc.poll() is None:
+            if cancel is not None and cancel.is_set():
+              raise SetuppyError(f'Command "{desc}" was cancelled.')
+            if deadline is not None and time.monotonic() > deadline:
+              msg = f'Command "{desc}" timed out after {timeout} seconds.'
+              raise SetuppyError(msg)
+            with contextlib.suppress(subprocess.TimeoutExpired):
+              proc.wait(timeout=PIPELINE_POLL_INTERVAL)
+        reader.join()
+
+      finally:
+        for proc in procs:
+          if proc.poll() is None:
+            proc.kill()
+          proc.wait()
+          if proc.stdout is not None:
+            proc.stdout.close()
+
+      for stderr in stderrs:
+        stderr.seek(0)
+
+      return PipelineResult(
+        returncodes=[proc.returncode for proc in procs],
+        stdout=b"".join(stdout).decode("utf-8", errors="replace"),
+        stderrs=[
+          stderr.read().decode("utf-8", errors="replace") for stderr in stderrs
+        ],
+      )
+
+
+class ShellWorker:
+  """A long-lived shell which runs commands one at a time.
+
+  Rather than spawning each command from python, commands are written to the
+  stdin of a single shell co-process, which runs them in turn. Each command's
+  stdout and stderr are redirected to files, and once it has finished the shell
+  writes a frame marker containing its exit code to its own stdout. Note that
+  commands run in the same shell, so their output is only available once they
+  have finished.
+  """
+
+  def __init__(self, *, shell: str = "/bin/sh", env: dict[str, str] | None):
+    """Start the shell.
+
+    Args:
+      shell: the path to the shell to run.
+      env: the environment to run the shell in, or None to inherit ours.
+    """
+    self._tmpdir = tempfile.TemporaryDirectory(prefix="setuppy-")
+    self._stdout = os.path.join(self._tmpdir.name, "stdout")
+    self._stderr = os.path.join(self._tmpdir.name, "stderr")
+    self._lock = threading.Lock()
+    self._proc = subprocess.Popen(
+      [shell],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.DEVNULL,
+      encoding="utf-8",
+      env=env,
+      start_new_session=True,
+    )
+
+  def run(
+    self,
+    cmd: list[str],
+    *,
+    timeout: float | None = None,
+  ) -> tuple[int, str, str]:
+    """Run the command in the shell.
+
+    Returns:
+      A tuple (rc, stdout, stderr) as for `run_command`.
+    """
+    marker = f"__setuppy_{uuid.uuid4().hex}__"
+    script = (
+      f"{shlex.join(cmd)} </dev/null"
+      f" >{shlex.quote(self._stdout)} 2>{shlex.quote(self._stderr)};"
+      f' echo "{marker} $?"\n'
+    )
+    stdin = cast(IO[str], self._proc.stdin)
+    stdout = cast(IO[str], self._proc.stdout)
+
+    with self._lock:
+      # The shell can only be interrupted by killing it, after which the worker
+      # is no longer alive and must be replaced.
+      killed = threading.Event()
+      timer = None
+      if timeout is not None:
+        timer = threading.Timer(timeout, self._kill, [killed])
+        timer.start()
+      try:
+        stdin.write(script)
+        stdin.flush()
+        line = stdout.readline()
+        while line and not line.startswith(marker):
+          line = stdout.readline()
+      except OSError:
+        line = ""
+      finally:
+        if timer is not None:
+          timer.cancel()
+
+      # The timer may have fired after the command finished but before it was
+      # cancelled, in which case the command's result still stands.
+      if killed.is_set():
+        self._proc.wait()
+        if not line:
+          raise subprocess.TimeoutExpired(cmd, cast(float, timeout))
+      if not line:
+        msg = f'Shell worker exited while running "{" ".join(cmd)}".'
+        raise SetuppyError(msg)
+
+      with open(self._stdout, encoding="utf-8", errors="replace") as f:
+        out = f.read()
+      with open(self._stderr, encoding="utf-8", errors="replace") as f:
+        err = f.read()
+
+    return int(line.split()[1]), out, err
+
+  @property
+  def alive(self) -> bool:
+    """Whether the shell is still running."""
+    return self._proc.poll() is None
+
+  def _kill(self, killed: threading.Event):
+    """Kill the shell and the command it's running, e.g. on a timeout."""
+    killed.set()
+    with contextlib.suppress(OSError):
+      os.killpg(self._proc.pid, signal.SIGKILL)
+
+  def close(self):
+    """Stop the shell."""
+    with contextlib.suppress(OSError):
+      cast(IO[str], self._proc.stdin).close()
+    self._proc.wait()
+    cast(IO[str], self._proc.stdout).close()
+    self._tmpdir.cleanup()
+
+
+@dataclasses.dataclass
+class PipelineResult:
+  """Result of running a pipeline.
+
+  Properties:
+    returncodes: the return code of each stage.
+    stdout: the output of the final stage.
+    stderrs: the stderr of each stage.
+  """
+  returncodes: list[int]
+  stdout: str
+  stderrs: list[str]
+
+  @property
+  def returncode(self) -> int:
+    """The return code of the last stage to fail, or 0 if all succeeded.
+
+    This follows the semantics of bash's `pipefail` option.
+    """
+    return next((rc for rc in reversed(self.returncodes) if rc != 0), 0)
+
+
+# The executor used by all commands. The command line interface replaces this
+# with one configured from the config file.
+_executor = Executor()
+
+
+def get_executor() -> Executor:
+  """Return the global executor."""
+  return _executor
+
+
+def set_executor(executor: Executor):
+  """Replace the global executor."""
+  global _executor
+  _executor = executor
+
+
 def run_command(
   cmd: Iterable[str],
   *,
   sudo: bool = False,
+  stream: bool = False,
+  worker: bool = False,
 ) -> tuple[int, str, str]:
   """Run the given command.
 
   Args:
     cmd: the command and its arguments to run.
     sudo: if true run the command under sudo.
+    stream: if true log the command's output as it runs, rather than capturing
+      it, and only return the tail of its output; see `Executor`.
+    worker: if true the command may be run by the executor's shell worker, if
+      it has one, rather than being spawned directly; see `ShellWorker`. This
+      is ignored if the command is run under sudo or its output is streamed.
 
   Returns:
     A tuple (rc, stdout, stderr) containing the return code of the command and
     stdout and stderr as strings.
   """
-  cmd = list(cmd)
-  fullpath = shutil.which(cmd[0])
+  return get_executor().run(cmd, sudo=sudo, stream=stream, worker=worker)
 
-  if fullpath is None:
-    raise SetuppyError(f"Could not find command: {cmd[0]}")
 
-  cmd[0] = fullpath
-
-  if sudo:
-    cmd = ["/usr/bin/sudo", *cmd]
-
-  proc = subprocess.run(cmd, capture_output=True, encoding="utf-8", check=False)
-  return proc.returncode, proc.stdout, proc.stderr
-
-
-def run_pipe(
-  cmd1: Iterable[str],
-  cmd2: Iterable[str],
-) -> tuple[int, str, str]:
-  """Run the given command.
+def run_pipe(*cmds: Iterable[str]) -> tuple[int, str, str]:
+  """Run the given commands as a pipeline.
 
   Args:
-    cmd1: the command and its arguments to run.
-    cmd2: optional command to pipe the first into.
+    cmds: the commands and their arguments to run, each of which is piped into
+      the next.
 
   Returns:
-    A tuple (rc, stdout, stderr) containing the return code of the command and
-    stdout and stderr as strings.
+    A tuple (rc, stdout, stderr) containing the return code of the pipeline
+    (i.e. that of the last stage to fail), the stdout of its last stage and the
+    stderr of every stage, as strings.
   """
-  cmd1 = list(cmd1)
-  fullpath1 = shutil.which(cmd1[0])
-  if fullpath1 is None:
-    raise SetuppyError(f"Could not find command: {cmd1[0]}")
-  cmd1[0] = fullpath1
-
-  cmd2 = list(cmd2)
-  fullpath2 = shutil.which(cmd2[0])
-  if fullpath2 is None:
-    raise SetuppyError(f"Could not find command: {cmd2[0]}")
-  cmd2[0] = fullpath2
-
-  logging.info('Running command "%s | %s"', " ".join(cmd1), " ".join(cmd2))
-
-  proc1 = subprocess.Popen(cmd1, stdout=subprocess.PIPE)
-  proc2 = subprocess.Popen(
-    cmd2, stdin=proc1.stdout, stdout=subprocess.PIPE, encoding="utf-8"
-  )
-  stdout, stderr = proc2.communicate()
-  return proc2.returncode, stdout, stderr
+  result = get_executor().pipeline(cmds)
+  return result.returncode, result.stdout, "".join(result.stderrs)
+
+
+def _read_lines(
+  pipe: IO[str],
+  buffer: collections.deque[str],
+  prefix: str,
+  logfile: IO[str] | None,
+  lock: threading.Lock,
+):
+  """Read lines from pipe into the ring buffer, logging each of them."""
+  for line in pipe:
+    buffer.append(line)
+    logging.info("%s %s", prefix, line.rstrip("\n"))
+    if logfile is not None:
+      with lock:
+        logfile.write(line)
+  pipe.close()
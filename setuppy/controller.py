@@ -1,8 +1,13 @@
 """Setup controller."""
 
+import collections
+import concurrent.futures
+import contextlib
 import logging
 import os
+import time
 from collections.abc import Iterable
+from collections.abc import Sequence
 from typing import Any
 from typing import cast
 
@@ -10,16 +15,41 @@ import click
 import dataclass_binder
 
 from setuppy.commands import CommandRegistry
+from setuppy.commands.base import BaseCommand
+from setuppy.commands.base import CommandResult
+from setuppy.commands.utils import get_executor
+from setuppy.events import ActionFailed
+from setuppy.events import ActionFinished
+from setuppy.events import ActionSkipped
+from setuppy.events import ActionStarted
+from setuppy.events import EventBus
+from setuppy.events import RecipeFinished
+from setuppy.events import RecipeSkipped
+from setuppy.events import RecipeStarted
+from setuppy.events import RunFinished
+from setuppy.events import RunStarted
+from setuppy.events import Sink
+from setuppy.events import get_bus
+from setuppy.events import load_sink
+from setuppy.events import set_bus
+from setuppy.interpolate import parse
+from setuppy.output import ConsoleSink
+from setuppy.recipes import RecipeStub
+from setuppy.trace import get_tracer
 from setuppy.types import Action
 from setuppy.types import Config
 from setuppy.types import Recipe
 from setuppy.types import SetuppyError
+from setuppy.usage import Usage
+from setuppy.usage import format_summary
+from setuppy.usage import measure
 
 
-MAX_MSG_LEN = 30
-MAX_TAGMSG_LEN = 30
 SYSTEM_TAGS = {"macos", "linux"}
 
+# The number of actions whose checks are run concurrently.
+CHECK_JOBS = 8
+
 
 class Controller:
   """A controller for running setup tasks."""
@@ -27,31 +57,35 @@ class Controller:
   def __init__(
     self,
     *,
-    recipes: list[Recipe],
+    recipes: Sequence[Recipe | RecipeStub],
     tags: list[str],
     variables: dict[str, Any],
     config: Config,
     force_all_tags: bool,
     simulate: bool,
     verbosity: int,
+    sinks: Sequence[Sink] = (),
   ):
     """Initialize the controller.
 
     Args:
-      recipes: collection of recipes to run.
+      recipes: collection of recipes to run; any stubs are only loaded if the
+        recipe is run.
       tags: a set of tags to enable.
       variables: additional facts specified as variables.
       config: configuration options.
       force_all_tags: force all tags that exist in the given recipes.
       simulate: if true, simulate all commands.
       verbosity: how verbose to be.
+      sinks: sinks to receive the run's events, in addition to those given
+        by config and the console output.
     """
     # Find all tags specified in the recipes.
     all_tags = set()
     for recipe in recipes:
       all_tags |= set(recipe.tags)
-      for action in recipe.actions:
-        all_tags |= set(action.tags)
+      for action_tags in _get_action_tags(recipe):
+        all_tags |= set(action_tags)
 
     # Remove any system tags.
     all_tags -= SYSTEM_TAGS
@@ -69,10 +103,24 @@ class Controller:
 
     self.simulate = simulate
     self.verbosity = verbosity
-    self.facts, system_tags = _get_facts()
+    self.console = ConsoleSink(verbosity)
+    self.bus = EventBus(sinks)
+    self.bus.sinks += [load_sink(spec) for spec in config.event_sinks]
+    # Only output to the console if there is anything to output, so quiet runs
+    # needn't dispatch any events.
+    if verbosity >= 1:
+      self.bus.subscribe(self.console)
+    with get_tracer().span("facts", "facts"):
+      self.facts, system_tags = _get_facts()
     self.recipes = recipes
     self.tags = set(tags + system_tags)
     self.registry: dict[str, bool] = dict()
+    self.usage: dict[str, Usage] = collections.defaultdict(Usage)
+    self.commands: dict[int, BaseCommand] = dict()
+    self.checks: dict[int, tuple[bool | None, int]] = dict()
+    self.changes = 0
+    self._started: dict[int, float] = dict()
+    self._recipe = ""
 
     missing_variables = set(config.required_variables) - set(variables.keys())
     if missing_variables:
@@ -89,8 +137,53 @@ class Controller:
     """Run the given recipes."""
     # Sort the recipes based on priority; lowest comes first so negate it so
     # highest priority items come first.
-    for recipe in sorted(self.recipes, key=lambda recipe: -recipe.priority):
-      self._run_recipe(recipe)
+    recipes = sorted(self.recipes, key=lambda recipe: -recipe.priority)
+
+    # Make our bus the global one, so that the processes spawned by commands
+    # are reported to our sinks.
+    previous_bus = get_bus()
+    set_bus(self.bus)
+    # Likewise stop the console from drawing over commands which prompt on the
+    # terminal.
+    executor = get_executor()
+    previous_suspend = executor.suspend_output
+    executor.suspend_output = self.console.renderer.suspend
+    self.bus.emit(RunStarted(tags=sorted(self.tags), simulate=self.simulate))
+    start = time.perf_counter()
+    error = None
+    try:
+      # Load every recipe which will be run, and check all of their actions
+      # before running any of them.
+      recipes = [self._load_recipe(recipe) for recipe in recipes]
+      actions = self._bind_recipes(recipes)
+      self._check_facts(actions)
+      with get_tracer().span("check", "check"):
+        self._check_actions(actions)
+
+      for recipe in recipes:
+        self._run_recipe(recipe)
+
+    except Exception as e:
+      error = str(e)
+      raise
+
+    finally:
+      duration = time.perf_counter() - start
+      self.bus.emit(RunFinished(duration=duration, error=error))
+      self.bus.close()
+      set_bus(previous_bus)
+      executor.suspend_output = previous_suspend
+
+    # Log how many processes were spawned on behalf of each action.
+    for label, stats in get_executor().stats.items():
+      logging.info(
+        'Action "%s" spawned %d processes in %.3fs',
+        label, stats.spawns, stats.wall_time,
+      )
+
+    # Show which actions were heaviest if we're being very verbose.
+    if self.verbosity >= 3 and self.usage:
+      click.echo(format_summary(self.usage))
 
   def _should_skip(self, tags: list[str], parents: list[str]) -> bool:
     """Evaluate whether an action should be skipped.
@@ -112,85 +205,353 @@ class Controller:
     # a parent has not been registered it is assumed to have not changed.
     return not any(self.registry.get(parent, False) for parent in parents)
 
-  def _run_recipe(self, recipe: Recipe):
+  def _run_recipe(self, recipe: Recipe | RecipeStub):
     """Run the given recipe."""
-    # Output message for the recipe.
-    msg = f"Running recipe: {recipe.name}"
-    msg += "." * (MAX_MSG_LEN - len(msg))
-
-    if self.verbosity >= 3:
-      tagmsg = " [" + ", ".join(recipe.tags) + "]"
-      tagmsg += "." * (MAX_TAGMSG_LEN - len(tagmsg))
-      msg += tagmsg
-
     if self._should_skip(recipe.tags, []):
       logging.info('Skipping recipe "%s"', recipe.name)
-      if self.verbosity >= 2:
-        click.echo(msg + click.style(" [skipped]", fg="cyan"))
+      self.bus.emit(RecipeSkipped(recipe=recipe.name, tags=recipe.tags))
       return
 
     logging.info('Running recipe "%s"', recipe.name)
-    if self.verbosity >= 1:
-      click.echo(msg)
+    self._recipe = recipe.name
+    self.bus.emit(RecipeStarted(recipe=recipe.name, tags=recipe.tags))
+    start = time.perf_counter()
+
+    # Stubs which weren't loaded are those whose actions are all skipped.
+    if isinstance(recipe, RecipeStub):
+      logging.info('Skipping all actions of recipe "%s"', recipe.name)
+    else:
+      with get_tracer().span(recipe.name, "recipe"):
+        self._run_actions(recipe)
+
+    duration = time.perf_counter() - start
+    self.bus.emit(RecipeFinished(recipe=recipe.name, duration=duration))
+
+  def _load_recipe(self, recipe: Recipe | RecipeStub) -> Recipe | RecipeStub:
+    """Load the recipe if it's a stub which will be run."""
+    if not isinstance(recipe, RecipeStub) or self._should_skip(recipe.tags, []):
+      return recipe
 
+    # Don't bother loading the recipe if every action would be skipped silently.
+    # If we're verbose enough the skipped actions are output, in which case
+    # their names are needed.
+    if self.verbosity < 2 and not any(
+      set(tags).issubset(self.tags) for tags in recipe.action_tags
+    ):
+      return recipe
+
+    return recipe.load()
+
+  def _bind_recipes(self, recipes: list[Recipe | RecipeStub]) -> list[Action]:
+    """Bind the command of every action which may be run.
+
+    Actions are bound whether or not their parents change, since that isn't
+    known until the actions are run. Any errors are left to be raised when the
+    action is run.
+
+    Returns:
+      The actions which may be run, in the order they'd be run.
+    """
+    actions = [
+      action
+      for recipe in recipes
+      if isinstance(recipe, Recipe) and not self._should_skip(recipe.tags, [])
+      for action in recipe.actions
+      if action.kind in CommandRegistry
+      and not self._should_skip(action.tags, [])
+    ]
+
+    for action in actions:
+      with contextlib.suppress(Exception):
+        self.commands[id(action)] = self._bind(action)
+
+    return actions
+
+  def _check_facts(self, actions: list[Action]):
+    """Raise an error if any action references facts which won't exist.
+
+    Every string a command interpolates is compiled, and the facts it references
+    must either exist already or be provided by an earlier action. All such
+    references are reported together, before any action is run.
+    """
+    known = set(self.facts)
+    missing = []
+    for action in actions:
+      command = self.commands.get(id(action))
+      if command is None:
+        continue
+
+      fields = set()
+      for text in command.templates():
+        try:
+          fields |= parse(text).fields
+        except ValueError as e:
+          msg = f'invalid string "{text}" in action "{action.name}": {e}'
+          raise SetuppyError(msg) from None
+      if undefined := fields - known:
+        names = ", ".join(f'"{field}"' for field in sorted(undefined))
+        missing.append(f'"{action.name}" ({names})')
+      known |= command.provides()
+
+    if missing:
+      raise SetuppyError(f"undefined facts in actions: {', '.join(missing)}")
+
+  def _check_actions(self, actions: list[Action]):
+    """Concurrently check every action which may be run.
+
+    Checks see the system and facts as they are before any action is run, so
+    they are only hints: once an action has changed the system the checks of
+    the actions after it are run again before they're used (see `_get_check`).
+    """
+    with concurrent.futures.ThreadPoolExecutor(CHECK_JOBS) as pool:
+      for action, checked in zip(actions, pool.map(self._check, actions)):
+        self.checks[id(action)] = (checked, self.changes)
+
+  def _check(self, action: Action) -> bool | None:
+    """Check whether running the action would change anything."""
+    command = self.commands.get(id(action))
+    if command is None:
+      return None
+    try:
+      with (
+        get_tracer().span(action.name, "check", kind=action.kind),
+        get_executor().label(action.name),
+      ):
+        return command.check(self.facts)
+    except Exception as e:
+      logging.info('Check of action "%s" failed: %s', action.name, e)
+      return None
+
+  def _run_actions(self, recipe: Recipe):
+    """Run the actions of the given recipe."""
+    # Consecutive actions which can be batched together are collected and run
+    # as a single batch. Actions with parents are never batched since their
+    # parents may be registered by an action in the pending batch. Likewise the
+    # facts provided by the pending batch aren't set until it runs, so an action
+    # which uses any of them is only batch keyed once it has.
+    batch: list[tuple[Action, BaseCommand]] = []
+    provided: set[str] = set()
     for action in recipe.actions:
-      self._run_action(action)
+      command = None
+      if (
+        not action.parents
+        and action.kind in CommandRegistry
+        and not self._should_skip(action.tags, [])
+        and self._get_check(action) is None
+      ):
+        command = self.commands.get(id(action)) or self._bind(action)
+
+      if batch and (
+        command is None
+        or _get_fields(command) & provided
+        or not self._can_batch(batch[-1][1], command)
+      ):
+        self._run_batch(batch)
+        batch = []
+        provided = set()
+
+      if command is not None:
+        batch.append((action, command))
+        provided |= command.provides()
+      else:
+        self._run_action(action)
 
-  def _run_action(self, action: Action):
-    """Run the given action."""
-    # Output message for the action.
-    msg = f"  {action.name}"
-    msg = msg + "." * (MAX_MSG_LEN - len(msg))
+    if batch:
+      self._run_batch(batch)
 
-    if self.verbosity >= 3:
-      tagmsg = " [" + ", ".join(action.tags) + "]"
-      tagmsg += "." * (MAX_TAGMSG_LEN - len(tagmsg))
-      msg += tagmsg
+  def _can_batch(self, command: BaseCommand, other: BaseCommand | None) -> bool:
+    """Evaluate whether other can be run in the same batch as command."""
+    if other is None or type(other) is not type(command):
+      return False
+    try:
+      key = command.batch_key(self.facts)
+      return key is not None and key == other.batch_key(self.facts)
+    except KeyError:
+      # Let the commands themselves raise any errors when they're run.
+      return False
 
+  def _run_batch(self, batch: list[tuple[Action, BaseCommand]]):
+    """Run a batch of actions whose commands share the same batch key."""
+    if len(batch) == 1:
+      self._run_action(*batch[0])
+      return
+
+    for action, _ in batch:
+      self._start_action(action)
+
+    commands = [command for _, command in batch]
+    label = ", ".join(action.name for action, _ in batch)
+    try:
+      with (
+        get_tracer().span(label, "action", kind=batch[0][0].kind),
+        get_executor().label(label),
+        measure() as usage,
+      ):
+        results = type(commands[0]).run_batch(
+          commands, facts=self.facts, simulate=self.simulate
+        )
+      self.usage[label] += usage
+    except Exception as e:
+      # Run the actions one at a time, so that only those which caused the
+      # error fail. The rest still run, as they would have in the batch.
+      logging.info('Batch "%s" failed, running it unbatched: %s', label, e)
+      error = None
+      for action, command in batch:
+        try:
+          self._run_command(action, command)
+        except Exception as action_error:
+          if error is None:
+            error = action_error
+      if error is not None:
+        raise error
+      return
+
+    for (action, _), result in zip(batch, results):
+      self._finish_action(action, result)
+
+  def _bind(self, action: Action) -> BaseCommand:
+    """Bind the action's arguments to create its command."""
+    # TODO: Catch an error if raised.
+    binder = dataclass_binder.Binder(CommandRegistry[action.kind])
+    return binder.bind(action.kwargs)
+
+  def _run_action(self, action: Action, command: BaseCommand | None = None):
+    """Run the given action, using the command if it has already been bound."""
     # Skip; output a message if verbosity is high enough (otherwise we're just
     # silent).
     if self._should_skip(action.tags, action.parents):
       logging.info('Skipping action "%s"', action.name)
-      if self.verbosity >= 2:
-        click.echo(msg + click.style(" [skipped]", fg="cyan"))
+      self.bus.emit(ActionSkipped(**self._describe(action)))
       return
 
-    # Echo the message. No newline so we can mark its status later.
-    logging.info('Running action "%s"', action.name)
-    if self.verbosity >= 1:
-      click.echo(msg, nl=False)
+    self._start_action(action)
 
     if action.kind not in CommandRegistry:
-      if self.verbosity >= 1:
-        click.secho(" [error]", fg="red")
-      raise SetuppyError(f'unknown action kind "{action.kind}"')
+      e = SetuppyError(f'unknown action kind "{action.kind}"')
+      self._fail_action(action, e)
+      raise e
+
+    # Use the result of the action's check if it's conclusive.
+    checked = self._get_check(action)
+    if checked is not None:
+      logging.info(
+        'Action "%s" %s', action.name,
+        "would change the system" if checked else "is already done",
+      )
+      self._finish_action(action, CommandResult(changed=checked))
+      return
 
-    # TODO: Catch an error if raised.
-    binder = dataclass_binder.Binder(CommandRegistry[action.kind])
-    command = binder.bind(action.kwargs)
+    if command is None:
+      command = self.commands.get(id(action)) or self._bind(action)
+    self._run_command(action, command)
 
+  def _run_command(self, action: Action, command: BaseCommand):
+    """Run the command of an action which has started, recording its result."""
     try:
-      result = command(facts=self.facts, simulate=self.simulate)
+      with (
+        get_tracer().span(action.name, "action", kind=action.kind),
+        get_executor().label(action.name),
+        measure() as usage,
+      ):
+        result = command(facts=self.facts, simulate=self.simulate)
+      self.usage[action.name] += usage
+
+    except KeyError as e:
+      # When simulating, facts set by commands which aren't safe to run are
+      # missing, so we can't tell what actions which use them would do.
+      if not self.simulate:
+        self._fail_action(action, e)
+        raise
+      logging.info('Action "%s" uses unset fact %s', action.name, e)
+      result = CommandResult(changed=True)
+
+    except Exception as e:
+      # Mark the status before reraising.
+      self._fail_action(action, e)
+      raise
 
-      # Update the controller's facts with any facts set by the action.
-      self.facts.update(**result.facts)
+    self._finish_action(action, result)
 
-      # Register a change for downstream actions.
-      if action.register:
-        self.registry[action.register] = result.changed
+  def _get_check(self, action: Action) -> bool | None:
+    """Return the result of checking the action, if it makes running it moot.
 
-    except Exception:
-      if self.verbosity >= 1:
-        # Mark the status before reraising.
-        click.secho(" [error]", fg="red")
-      raise
+    If the check found that the action wouldn't change anything it needn't be
+    run. If we're simulating then any conclusive check tells us whether it
+    would change anything.
+    """
+    checked, changes = self.checks.get(id(action), (None, self.changes))
+    if checked is None or not (checked is False or self.simulate):
+      return None
+
+    # If an earlier action has changed the system since the action was checked
+    # (e.g. creating a file which a guard looks for) the check may be stale, so
+    # check it again.
+    if changes != self.changes:
+      checked = self._check(action)
+      self.checks[id(action)] = (checked, self.changes)
+
+    if checked is False or self.simulate:
+      return checked
+    return None
+
+  def _describe(self, action: Action) -> dict[str, Any]:
+    """Return the fields identifying the action in an event."""
+    return {
+      "recipe": self._recipe,
+      "action": action.name,
+      "kind": action.kind,
+      "tags": action.tags,
+    }
+
+  def _start_action(self, action: Action):
+    """Record that an action has started running."""
+    logging.info('Running action "%s"', action.name)
+    self._started[id(action)] = time.perf_counter()
+    self.bus.emit(ActionStarted(**self._describe(action)))
+
+  def _fail_action(self, action: Action, error: Exception):
+    """Record that an action raised an error."""
+    duration = time.perf_counter() - self._started.pop(id(action))
+    self.bus.emit(ActionFailed(
+      **self._describe(action),
+      duration=duration,
+      error=str(error),
+    ))
+
+  def _finish_action(self, action: Action, result: CommandResult):
+    """Record and output the result of an action."""
+    # Update the controller's facts with any facts set by the action, noting
+    # which of them changed.
+    new_facts = {
+      key: value for key, value in result.facts.items()
+      if key not in self.facts or self.facts[key] != value
+    }
+    self.facts.update(**result.facts)
+
+    # Register a change for downstream actions.
+    if action.register:
+      self.registry[action.register] = result.changed
+
+    # Count the change, which invalidates the checks of later actions.
+    if result.changed:
+      self.changes += 1
 
     # Mark the status of the command.
-    if self.verbosity >= 1:
-      if result.changed:
-        click.secho(" [changed]", fg="yellow")
-      else:
-        click.secho(" [ok]", fg="green")
+    duration = time.perf_counter() - self._started.pop(id(action))
+    self.bus.emit(ActionFinished(
+      **self._describe(action),
+      duration=duration,
+      changed=result.changed,
+      facts=new_facts,
+    ))
+
+
+def _get_fields(command: BaseCommand) -> set[str]:
+  """Return the names of the facts referenced by the command's strings."""
+  fields = set()
+  for text in command.templates():
+    fields |= parse(text).fields
+  return fields
 
 
 def _error_if_tags(tags: Iterable[str], descriptor: str):
@@ -204,6 +565,13 @@ def _error_if_tags(tags: Iterable[str], descriptor: str):
     raise SetuppyError(msg)
 
 
+def _get_action_tags(recipe: Recipe | RecipeStub) -> list[list[str]]:
+  """Get the tags of each action of a recipe, without loading a stub."""
+  if isinstance(recipe, RecipeStub):
+    return recipe.action_tags
+  return [action.tags for action in recipe.actions]
+
+
 def _get_facts() -> tuple[dict[str, Any], list[str]]:
   """Get basic system facts."""
   facts = dict()
@@ -0,0 +1,284 @@
+"""Typed events describing a run, and a bus which dispatches them to sinks."""
+
+import abc
+import dataclasses
+import importlib
+import logging
+import queue
+import threading
+import time
+from collections.abc import Iterable
+from typing import Any
+from typing import ClassVar
+
+from setuppy.types import SetuppyError
+
+
+@dataclasses.dataclass
+class Event:
+  """Base class of every event.
+
+  Properties:
+    time: when the event happened, in seconds since the epoch.
+  """
+  name: ClassVar[str] = "event"
+  time: float = dataclasses.field(default_factory=time.time, kw_only=True)
+
+  def to_dict(self) -> dict[str, Any]:
+    """Return the event as a (JSON serializable) dictionary."""
+    return {"event": self.name, **dataclasses.asdict(self)}
+
+
+@dataclasses.dataclass
+class RunStarted(Event):
+  """A run has started.
+
+  Properties:
+    tags: the enabled tags.
+    simulate: whether the run only simulates its actions.
+  """
+  name: ClassVar[str] = "run.start"
+  tags: list[str]
+  simulate: bool
+
+
+@dataclasses.dataclass
+class RunFinished(Event):
+  """A run has finished, successfully or not.
+
+  Properties:
+    duration: how long the run took, in seconds.
+    error: the error which stopped the run, if any.
+  """
+  name: ClassVar[str] = "run.finish"
+  duration: float
+  error: str | None = None
+
+
+@dataclasses.dataclass
+class RecipeStarted(Event):
+  """A recipe has started running.
+
+  Properties:
+    recipe: the name of the recipe.
+    tags: the tags of the recipe.
+  """
+  name: ClassVar[str] = "recipe.start"
+  recipe: str
+  tags: list[str]
+
+
+@dataclasses.dataclass
+class RecipeSkipped(RecipeStarted):
+  """A recipe has been skipped since its tags weren't enabled."""
+  name: ClassVar[str] = "recipe.skip"
+
+
+@dataclasses.dataclass
+class RecipeFinished(Event):
+  """A recipe has finished running every one of its actions.
+
+  Properties:
+    recipe: the name of the recipe.
+    duration: how long the recipe took, in seconds.
+  """
+  name: ClassVar[str] = "recipe.finish"
+  recipe: str
+  duration: float
+
+
+@dataclasses.dataclass
+class ActionStarted(Event):
+  """An action has started running.
+
+  Properties:
+    recipe: the name of the action's recipe.
+    action: the name of the action.
+    kind: the kind of the action.
+    tags: the tags of the action.
+  """
+  name: ClassVar[str] = "action.start"
+  recipe: str
+  action: str
+  kind: str
+  tags: list[str]
+
+
+@dataclasses.dataclass
+class ActionSkipped(ActionStarted):
+  """An action has been skipped, due to its tags or its parents."""
+  name: ClassVar[str] = "action.skip"
+
+
+@dataclasses.dataclass
+class ActionFinished(ActionStarted):
+  """An action has finished running.
+
+  Properties:
+    duration: how long the action took, in seconds.
+    changed: whether the action changed the system.
+    facts: any facts set by the action whose values changed.
+  """
+  name: ClassVar[str] = "action.finish"
+  duration: float
+  changed: bool
+  facts: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class ActionFailed(ActionStarted):
+  """An action has raised an error.
+
+  Properties:
+    duration: how long the action ran for, in seconds.
+    error: the error raised by the action.
+  """
+  name: ClassVar[str] = "action.error"
+  duration: float
+  error: str
+
+
+@dataclasses.dataclass
+class SubprocessStarted(Event):
+  """A process has been spawned on behalf of an action.
+
+  Properties:
+    label: the label of the action which spawned the process.
+    command: the command being run.
+  """
+  name: ClassVar[str] = "subprocess.start"
+  label: str
+  command: str
+
+
+@dataclasses.dataclass
+class SubprocessFinished(SubprocessStarted):
+  """A process spawned on behalf of an action has exited.
+
+  Properties:
+    duration: how long the process ran for, in seconds.
+  """
+  name: ClassVar[str] = "subprocess.finish"
+  duration: float
+
+
+class Sink(metaclass=abc.ABCMeta):
+  """Base class for receivers of events.
+
+  Sinks are called from the bus's dispatch thread, one event at a time and in
+  the order the events were emitted.
+  """
+
+  @abc.abstractmethod
+  def handle(self, event: Event):
+    """Handle the event."""
+
+  def close(self):
+    """Handle the end of the events; by default this does nothing."""
+
+
+class EventBus:
+  """Dispatch events to sinks asynchronously.
+
+  Emitting an event only queues it, so that a slow sink never stalls the run;
+  the events are delivered to every sink by a background thread which is
+  started when the first event is emitted. If there are no sinks, or the bus
+  has been closed, emitting an event does nothing. An error raised by a sink is
+  logged and otherwise ignored.
+  """
+
+  def __init__(self, sinks: Iterable[Sink] = ()):
+    """Initialize the bus.
+
+    Args:
+      sinks: the initial sinks.
+    """
+    self.sinks: list[Sink] = list(sinks)
+    self._queue: queue.SimpleQueue[Event | None] = queue.SimpleQueue()
+    self._lock = threading.Lock()
+    self._thread: threading.Thread | None = None
+    self._closed = False
+
+  def subscribe(self, sink: Sink):
+    """Add a sink, which receives every event emitted from now on."""
+    self.sinks.append(sink)
+
+  def emit(self, event: Event):
+    """Queue the event to be dispatched to every sink."""
+    if self._closed or not self.sinks:
+      return
+    if self._thread is None:
+      self._start_thread()
+    self._queue.put(event)
+
+  def close(self):
+    """Deliver every queued event and then close the sinks."""
+    with self._lock:
+      if self._closed:
+        return
+      self._closed = True
+      thread, self._thread = self._thread, None
+    if thread is not None:
+      self._queue.put(None)
+      thread.join()
+
+    for sink in self.sinks:
+      try:
+        sink.close()
+      except Exception:
+        logging.exception("Closing event sink %r failed", sink)
+
+  def _start_thread(self):
+    """Start dispatching events, if that hasn't started already."""
+    with self._lock:
+      if self._thread is None and not self._closed:
+        self._thread = threading.Thread(
+          target=self._dispatch, name="setuppy-events", daemon=True
+        )
+        self._thread.start()
+
+  def _dispatch(self):
+    """Deliver queued events to every sink until the end is queued."""
+    while (event := self._queue.get()) is not None:
+      for sink in self.sinks:
+        try:
+          sink.handle(event)
+        except Exception:
+          logging.exception("Event sink %r failed on %s", sink, event.name)
+
+
+def load_sink(spec: str) -> Sink:
+  """Create a sink given as "module:name".
+
+  The name may be that of a `Sink` subclass or of any other callable which
+  returns a sink, and is called with no arguments.
+  """
+  modname, _, qualname = spec.partition(":")
+  try:
+    factory: Any = importlib.import_module(modname)
+    for attr in qualname.split("."):
+      factory = getattr(factory, attr)
+    sink = factory()
+  except (ImportError, AttributeError, TypeError) as e:
+    raise SetuppyError(f'could not load event sink "{spec}": {e}') from None
+
+  if not isinstance(sink, Sink):
+    raise SetuppyError(f'event sink "{spec}" is not a sink.')
+
+  return sink
+
+
+# The bus to which the commands emit events, e.g. for the processes they spawn.
+# By default this has no sinks; the controller replaces it while it runs.
+_bus = EventBus()
+
+
+def get_bus() -> EventBus:
+  """Return the global event bus."""
+  return _bus
+
+
+def set_bus(bus: EventBus):
+  """Replace the global event bus."""
+  global _bus
+  _bus = bus
@@ -0,0 +1,151 @@
+"""Interpolation of facts into strings, as by `str.format`, but pre-parsed."""
+
+import dataclasses
+import functools
+import operator
+import re
+import string
+from collections.abc import Callable
+from typing import Any
+
+
+# Formatter used to parse templates and to evaluate any non-trivial fields.
+FORMATTER = string.Formatter()
+
+# Match the name of the fact referenced by a field, e.g. "foo" in "foo.bar[0]".
+FIELD_ROOT_RE = re.compile(r"^[^.\[]*")
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledTemplate:
+  """A template which has been pre-parsed by `string.Formatter().parse`.
+
+  The last rendering of the template is memoized, and reused for as long as
+  the facts it references are unchanged. Each fact is compared by identity,
+  or else by type and equality, since equal values of different types (e.g. 1,
+  1.0 and True) may render differently. A fact which is modified in place
+  (rather than replaced) is not seen to change.
+
+  Properties:
+    parts: tuple of (literal, field) pairs where field is either None or a
+      tuple (field_name, conversion, format_spec).
+    fields: the names of all facts referenced by the template.
+  """
+  parts: tuple[tuple[str, tuple[str, str | None, str] | None], ...]
+  fields: frozenset[str]
+  _memo: list[tuple[Any, str] | None] = dataclasses.field(
+    default_factory=lambda: [None], init=False, repr=False, compare=False
+  )
+  _key: Callable[[dict[str, Any]], Any] | None = dataclasses.field(
+    init=False, repr=False, compare=False
+  )
+
+  def __post_init__(self):
+    """Prepare to look up the referenced facts, which are the memo's key."""
+    key = operator.itemgetter(*sorted(self.fields)) if self.fields else None
+    object.__setattr__(self, "_key", key)
+
+  @classmethod
+  def compile(cls, text: str) -> "CompiledTemplate":
+    """Compile the given template text."""
+    parts = []
+    fields = set()
+    for literal, name, spec, conversion in FORMATTER.parse(text):
+      if name is None:
+        parts.append((literal, None))
+        continue
+      parts.append((literal, (name, conversion, spec or "")))
+      fields.add(_field_root(name))
+      # Format specs may themselves contain nested fields.
+      if spec and "{" in spec:
+        fields |= cls.compile(spec).fields
+    return cls(tuple(parts), frozenset(fields))
+
+  def render(self, facts: dict[str, Any]) -> str:
+    """Render the template with substitutions given by facts."""
+    # Reuse the last rendering if none of the facts it used have changed. This
+    # raises a KeyError if any of them don't exist, as formatting would.
+    key: Any = self._key(facts) if self._key is not None else None
+    memo = self._memo[0]
+    if memo is not None:
+      # The key is a tuple of the facts' values if there are several fields, or
+      # else the single fact's value (or None).
+      if len(self.fields) > 1:
+        unchanged = all(map(_same, memo[0], key))
+      else:
+        unchanged = _same(memo[0], key)
+      if unchanged:
+        return memo[1]
+
+    chunks = []
+    for literal, field in self.parts:
+      chunks.append(literal)
+      if field is not None:
+        chunks.append(_format_field(field, facts))
+    text = "".join(chunks)
+
+    self._memo[0] = (key, text)
+    return text
+
+  def __getstate__(self) -> dict[str, Any]:
+    """Return the state to pickle, which is only the compiled template."""
+    return {"parts": self.parts, "fields": self.fields}
+
+  def __setstate__(self, state: dict[str, Any]):
+    """Restore the pickled state, with an empty memo."""
+    self.__dict__.update(state, _memo=[None])
+    self.__post_init__()
+
+
+@functools.cache
+def parse(text: str) -> CompiledTemplate:
+  """Return the compiled template of the given text.
+
+  Templates are compiled once per process for each distinct text, so this is
+  cheap to call repeatedly with the same strings, e.g. those of a recipe.
+  """
+  return CompiledTemplate.compile(text)
+
+
+def interpolate(text: str, facts: dict[str, Any]) -> str:
+  """Format text with substitutions given by facts, as `text.format(**facts)`.
+
+  Raises:
+    KeyError: if text references a fact which doesn't exist.
+  """
+  # Strings without any fields, which are most of them, are returned as is.
+  if "{" not in text and "}" not in text:
+    return text
+  return parse(text).render(facts)
+
+
+def _field_root(name: str) -> str:
+  """Return the name of the fact referenced by a format field."""
+  match = FIELD_ROOT_RE.match(name)
+  return match.group(0) if match else name
+
+
+def _same(a: Any, b: Any) -> bool:
+  """Return whether a and b are the same value, and so render the same."""
+  return a is b or (type(a) is type(b) and a == b)
+
+
+def _format_field(
+  field: tuple[str, str | None, str],
+  facts: dict[str, Any],
+) -> str:
+  """Format a single compiled field using the given facts."""
+  name, conversion, spec = field
+
+  # Most fields are simple names, for which we can avoid the formatter.
+  if name in facts:
+    value = facts[name]
+  else:
+    value, _ = FORMATTER.get_field(name, (), facts)
+
+  if conversion:
+    value = FORMATTER.convert_field(value, conversion)
+  if "{" in spec:
+    spec = FORMATTER.vformat(spec, (), facts)
+
+  return format(value, spec)
@@ -0,0 +1,247 @@
+"""Export of a run's metrics as a Prometheus textfile."""
+
+import dataclasses
+import os
+import pathlib
+from collections.abc import Mapping
+from collections.abc import Sequence
+
+from setuppy.cache import write_atomic
+from setuppy.events import ActionFailed
+from setuppy.events import ActionFinished
+from setuppy.events import ActionStarted
+from setuppy.events import Event
+from setuppy.events import RecipeFinished
+from setuppy.events import RunFinished
+from setuppy.events import Sink
+
+
+# Upper bounds, in seconds, of the buckets of the duration histograms.
+DURATION_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# The label names of the metrics of each action.
+ACTION_LABELS = ("recipe", "action", "kind")
+
+
+@dataclasses.dataclass
+class Histogram:
+  """A histogram of observed values.
+
+  Properties:
+    buckets: the upper bound of each bucket.
+    counts: the number of values in each bucket, not including the values in
+      smaller buckets.
+    sum: the sum of every value.
+    count: the number of values.
+  """
+  buckets: Sequence[float]
+  counts: list[int] = dataclasses.field(init=False)
+  sum: float = 0.0
+  count: int = 0
+
+  def __post_init__(self):
+    """Start with empty buckets."""
+    self.counts = [0] * len(self.buckets)
+
+  def observe(self, value: float):
+    """Add the value to the histogram."""
+    self.sum += value
+    self.count += 1
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        break
+
+
+class MetricsSink(Sink):
+  """Collect metrics of a run and write them to a textfile when it ends.
+
+  The metrics are written in the Prometheus text format, e.g. for the textfile
+  collector of node_exporter, and include the run's duration and whether it
+  succeeded, histograms of the duration of each recipe and action, and counts of
+  the actions which changed the system or failed. The file is replaced
+  atomically so that a collector never reads a partial file.
+  """
+
+  def __init__(
+    self,
+    path: str | os.PathLike[str],
+    *,
+    buckets: Sequence[float] = DURATION_BUCKETS,
+  ):
+    """Initialize the sink.
+
+    Args:
+      path: the file to write.
+      buckets: the upper bounds, in seconds, of the buckets of the histograms.
+    """
+    self.path = pathlib.Path(path)
+    self.buckets = buckets
+    self.run: RunFinished | None = None
+    self.recipes: dict[tuple[str, ...], Histogram] = dict()
+    self.actions: dict[tuple[str, ...], Histogram] = dict()
+    self.changed: dict[tuple[str, ...], int] = dict()
+    self.failed: dict[tuple[str, ...], int] = dict()
+
+  def handle(self, event: Event):
+    """Add the event to the metrics."""
+    match event:
+      case RunFinished():
+        self.run = event
+      case RecipeFinished():
+        self._observe(self.recipes, (event.recipe,), event.duration)
+      case ActionFinished():
+        self._observe_action(event, event.duration)
+        if event.changed:
+          self.changed[_action_labels(event)] += 1
+      case ActionFailed():
+        self._observe_action(event, event.duration)
+        self.failed[_action_labels(event)] += 1
+      case _:
+        pass
+
+  def close(self):
+    """Write the metrics."""
+    # Make the file readable by collectors which run as another user.
+    write_atomic(self.path, self.format().encode("utf-8"), mode=0o644)
+
+  def format(self) -> str:
+    """Return the metrics in the Prometheus text format."""
+    lines = []
+    if self.run is not None:
+      lines += _format_metric(
+        "setuppy_run_duration_seconds",
+        "gauge",
+        "How long the last run took.",
+        {(): self.run.duration},
+      )
+      lines += _format_metric(
+        "setuppy_run_success",
+        "gauge",
+        "Whether the last run succeeded.",
+        {(): int(self.run.error is None)},
+      )
+      lines += _format_metric(
+        "setuppy_run_timestamp_seconds",
+        "gauge",
+        "When the last run finished, in seconds since the epoch.",
+        {(): self.run.time},
+      )
+
+    lines += _format_histogram(
+      "setuppy_recipe_duration_seconds",
+      "How long each recipe took.",
+      ("recipe",),
+      self.recipes,
+    )
+    lines += _format_histogram(
+      "setuppy_action_duration_seconds",
+      "How long each action took.",
+      ACTION_LABELS,
+      self.actions,
+    )
+    lines += _format_metric(
+      "setuppy_actions_changed_total",
+      "counter",
+      "Number of times each action changed the system.",
+      self.changed,
+      ACTION_LABELS,
+    )
+    lines += _format_metric(
+      "setuppy_actions_failed_total",
+      "counter",
+      "Number of times each action failed.",
+      self.failed,
+      ACTION_LABELS,
+    )
+    return "".join(line + "\n" for line in lines)
+
+  def _observe(
+    self,
+    histograms: dict[tuple[str, ...], Histogram],
+    labels: tuple[str, ...],
+    value: float,
+  ):
+    """Add the value to the histogram with the given labels."""
+    histogram = histograms.get(labels)
+    if histogram is None:
+      histogram = histograms[labels] = Histogram(self.buckets)
+    histogram.observe(value)
+
+  def _observe_action(self, event: ActionStarted, duration: float):
+    """Add the duration of an action, making sure it has every counter."""
+    labels = _action_labels(event)
+    self._observe(self.actions, labels, duration)
+    self.changed.setdefault(labels, 0)
+    self.failed.setdefault(labels, 0)
+
+
+def _action_labels(event: ActionStarted) -> tuple[str, ...]:
+  """Return the values of the labels of the action's metrics."""
+  return (event.recipe, event.action, event.kind)
+
+
+def _format_metric(
+  name: str,
+  kind: str,
+  description: str,
+  samples: Mapping[tuple[str, ...], float],
+  labels: Sequence[str] = (),
+) -> list[str]:
+  """Format the metric with a sample for each set of label values."""
+  if not samples:
+    return []
+  lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+  for values, sample in sorted(samples.items()):
+    lines.append(f"{name}{_format_labels(labels, values)} {_format(sample)}")
+  return lines
+
+
+def _format_histogram(
+  name: str,
+  description: str,
+  labels: Sequence[str],
+  histograms: dict[tuple[str, ...], Histogram],
+) -> list[str]:
+  """Format the histogram with a set of samples for each set of label values."""
+  if not histograms:
+    return []
+  lines = [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+  for values, histogram in sorted(histograms.items()):
+    # Buckets are cumulative, ending with one for every value.
+    cumulative = 0
+    bounds = [*histogram.buckets, float("inf")]
+    counts = [*histogram.counts, histogram.count - sum(histogram.counts)]
+    for bound, count in zip(bounds, counts):
+      cumulative += count
+      bucket_labels = _format_labels(
+        [*labels, "le"], [*values, _format(bound)]
+      )
+      lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+
+    label_text = _format_labels(labels, values)
+    lines.append(f"{name}_sum{label_text} {_format(histogram.sum)}")
+    lines.append(f"{name}_count{label_text} {histogram.count}")
+  return lines
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  """Format the labels of a sample, escaping their values."""
+  if not names:
+    return ""
+  pairs = [
+    f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+  ]
+  return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+  """Escape a label value."""
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+  """Format a sample value."""
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
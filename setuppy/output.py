@@ -0,0 +1,286 @@
+"""Sinks which output a run's progress, to the terminal and as JSON Lines."""
+
+import contextlib
+import json
+import shutil
+import sys
+import threading
+import time
+from collections.abc import Hashable
+from collections.abc import Iterator
+from typing import TextIO
+
+import click
+
+from setuppy.events import ActionFailed
+from setuppy.events import ActionFinished
+from setuppy.events import ActionSkipped
+from setuppy.events import ActionStarted
+from setuppy.events import Event
+from setuppy.events import RecipeSkipped
+from setuppy.events import RecipeStarted
+from setuppy.events import Sink
+
+
+MAX_MSG_LEN = 30
+MAX_TAGMSG_LEN = 30
+
+# The colors in which the status of each recipe and action is output.
+STATUS_COLORS = {
+  "ok": "green",
+  "changed": "yellow",
+  "skipped": "cyan",
+  "error": "red",
+}
+
+# How often, in seconds, buffered output is written to the terminal.
+REFRESH_INTERVAL = 0.1
+
+# Control sequence which moves the cursor up some number of lines, to the start
+# of the line, and clears everything below it.
+_CLEAR_LINES = "\x1b[{}F\x1b[J"
+
+
+class Renderer:
+  """Write lines of output in batches, below a live status area.
+
+  Rather than writing each line as soon as it's output, lines are buffered and
+  written together every `interval` seconds by a background thread, so that
+  output costs a single write per interval however many lines there are. If
+  the output is a terminal, the actions in progress are shown below the output
+  along with how long they've been running; this status area is redrawn on
+  every write.
+
+  While another process is using the terminal, e.g. sudo prompting for a
+  password, output can be suspended so that it isn't drawn over.
+  """
+
+  def __init__(
+    self,
+    *,
+    stream: TextIO | None = None,
+    interval: float = REFRESH_INTERVAL,
+    live: bool | None = None,
+  ):
+    """Initialize the renderer.
+
+    Args:
+      stream: where to write; defaults to stdout.
+      interval: seconds between writes.
+      live: whether to show the actions in progress; defaults to whether the
+        stream is a terminal.
+    """
+    self.stream = stream
+    self.interval = interval
+    self.live = live
+    self._lines: list[str] = list()
+    self._running: dict[Hashable, tuple[str, float]] = dict()
+    self._status_lines = 0
+    self._suspended = 0
+    self._lock = threading.Lock()
+    self._write_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread: threading.Thread | None = None
+
+  def echo(self, line: str):
+    """Output a line, which may contain styles."""
+    with self._lock:
+      self._lines.append(line)
+    self._start_thread()
+
+  def start(self, key: Hashable, name: str):
+    """Show that the named task identified by key is in progress."""
+    with self._lock:
+      self._running[key] = (name, time.monotonic())
+    self._start_thread()
+
+  def stop(self, key: Hashable):
+    """Stop showing the task identified by key as in progress."""
+    with self._lock:
+      self._running.pop(key, None)
+
+  def flush(self):
+    """Write any buffered lines and redraw the status area."""
+    with self._write_lock:
+      if not self._suspended:
+        self._write(draw=True)
+
+  @contextlib.contextmanager
+  def suspend(self) -> Iterator[None]:
+    """Write nothing, and clear the status area, until the context exits."""
+    with self._write_lock:
+      self._suspended += 1
+      self._write(draw=False)
+    try:
+      yield
+    finally:
+      with self._write_lock:
+        self._suspended -= 1
+
+  def _write(self, *, draw: bool):
+    """Write any buffered lines and, if draw is true, the status area."""
+    stream = self.stream or sys.stdout
+    live = self.live if self.live is not None else _isatty(stream)
+
+    with self._lock:
+      lines, self._lines = self._lines, list()
+      running = list(self._running.values()) if live and draw else []
+      cleared = self._status_lines
+      self._status_lines = len(running)
+
+    if not (lines or running or cleared):
+      return
+
+    # Clear the old status area, write the output and then draw the new one.
+    text = _CLEAR_LINES.format(cleared) if cleared else ""
+    text += "".join(line + "\n" for line in lines)
+    if running:
+      now = time.monotonic()
+      width = shutil.get_terminal_size().columns - 1
+      for name, start in running:
+        status = f"  {name} [{now - start:.0f}s]"
+        text += click.style(status[:width], dim=True) + "\n"
+
+    # The status area relies on control sequences, so keep them even if the
+    # stream isn't a terminal.
+    click.echo(text, file=stream, nl=False, color=True if live else None)
+    stream.flush()
+
+  def close(self):
+    """Stop the background thread and write everything that's left."""
+    thread = self._thread
+    if thread is not None:
+      self._stop.set()
+      thread.join()
+      self._thread = None
+      self._stop.clear()
+
+    with self._lock:
+      self._running.clear()
+    self.flush()
+
+  def _start_thread(self):
+    """Start writing in the background, if that hasn't started already."""
+    if self._thread is not None:
+      return
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(
+          target=self._write_loop, name="setuppy-output", daemon=True
+        )
+        self._thread.start()
+
+  def _write_loop(self):
+    """Flush every interval until stopped."""
+    while not self._stop.wait(self.interval):
+      self.flush()
+
+
+class ConsoleSink(Sink):
+  """Output the status of every recipe and action to the terminal.
+
+  Recipes and actions which are run are output at verbosity 1 and up, those
+  which are skipped at verbosity 2 and up, and their tags at verbosity 3.
+  """
+
+  def __init__(self, verbosity: int, renderer: Renderer | None = None):
+    """Initialize the sink.
+
+    Args:
+      verbosity: how verbose to be.
+      renderer: where to write the output; defaults to a new `Renderer`.
+    """
+    self.verbosity = verbosity
+    self.renderer = renderer or Renderer()
+
+  def handle(self, event: Event):
+    """Output the event, if we're verbose enough."""
+    # Events are matched before the events they extend.
+    match event:
+      case RecipeSkipped():
+        if self.verbosity >= 2:
+          self.renderer.echo(
+            self._recipe_msg(event) + _style_status("skipped")
+          )
+      case RecipeStarted():
+        if self.verbosity >= 1:
+          self.renderer.echo(self._recipe_msg(event))
+      case ActionSkipped():
+        if self.verbosity >= 2:
+          self.renderer.echo(
+            self._action_msg(event) + _style_status("skipped")
+          )
+      case ActionFailed():
+        self._stop_action(event, "error")
+      case ActionFinished():
+        self._stop_action(event, "changed" if event.changed else "ok")
+      case ActionStarted():
+        if self.verbosity >= 1:
+          self.renderer.start((event.recipe, event.action), event.action)
+      case _:
+        pass
+
+  def close(self):
+    """Write everything that's left."""
+    self.renderer.close()
+
+  def _stop_action(self, event: ActionStarted, status: str):
+    """Output the status of an action which has stopped running."""
+    if self.verbosity >= 1:
+      self.renderer.stop((event.recipe, event.action))
+      self.renderer.echo(self._action_msg(event) + _style_status(status))
+
+  def _recipe_msg(self, event: RecipeStarted) -> str:
+    """Return the message to output for a recipe."""
+    msg = f"Running recipe: {event.recipe}"
+    return msg + "." * (MAX_MSG_LEN - len(msg)) + self._tag_msg(event.tags)
+
+  def _action_msg(self, event: ActionStarted) -> str:
+    """Return the message to output for an action."""
+    msg = f"  {event.action}"
+    return msg + "." * (MAX_MSG_LEN - len(msg)) + self._tag_msg(event.tags)
+
+  def _tag_msg(self, tags: list[str]) -> str:
+    """Return the message to output for tags, if we're verbose enough."""
+    if self.verbosity < 3:
+      return ""
+    tagmsg = " [" + ", ".join(tags) + "]"
+    return tagmsg + "." * (MAX_TAGMSG_LEN - len(tagmsg))
+
+
+class EventLog(Sink):
+  """Write every event as JSON Lines.
+
+  Each record is a JSON object on its own line with the "event" that happened,
+  e.g. "action.finish", the "time" it happened at in seconds since the epoch,
+  and the rest of the event's fields.
+  """
+
+  def __init__(self, stream: TextIO):
+    """Initialize the log.
+
+    Args:
+      stream: where to write the records.
+    """
+    self.stream = stream
+
+  def handle(self, event: Event):
+    """Write a record of the event."""
+    self.stream.write(json.dumps(event.to_dict(), default=str) + "\n")
+
+  def close(self):
+    """Flush any records which are buffered."""
+    self.stream.flush()
+
+
+def _style_status(status: str) -> str:
+  """Return the styled status marker for a recipe or action."""
+  return click.style(f" [{status}]", fg=STATUS_COLORS[status])
+
+
+def _isatty(stream: TextIO) -> bool:
+  """Return whether the stream is a terminal."""
+  try:
+    return stream.isatty()
+  except (AttributeError, ValueError):
+    return False
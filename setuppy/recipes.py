@@ -0,0 +1,140 @@
+"""Loading of recipes, with the parsed recipes cached between runs."""
+
+import concurrent.futures
+import dataclasses
+import os
+import pathlib
+from collections.abc import Sequence
+
+import dataclass_binder
+
+from setuppy.cache import get_cache
+from setuppy.cache import stamp
+from setuppy.types import Recipe
+from setuppy.types import SetuppyError
+
+
+# Only parse recipes in parallel if at least this many have changed, since
+# starting the worker processes has a cost of its own.
+PARALLEL_THRESHOLD = 8
+
+# The version of the format in which recipes and stubs are cached. This must be
+# bumped whenever `Recipe`, `Action` or `RecipeStub` change, so that recipes
+# cached in an older format are parsed again.
+RECIPE_CACHE_VERSION = 1
+
+
+@dataclasses.dataclass
+class RecipeStub:
+  """Summary of a recipe which can be loaded lazily.
+
+  This holds enough of a recipe to decide whether it should be run, without
+  having to load it.
+
+  Properties:
+    path: the recipe file.
+    name: the name of the recipe.
+    priority: the priority of the recipe.
+    tags: the tags of the recipe.
+    action_tags: the tags of each of the recipe's actions.
+  """
+  path: pathlib.Path
+  name: str
+  priority: int
+  tags: list[str]
+  action_tags: list[list[str]]
+
+  @classmethod
+  def from_recipe(cls, path: pathlib.Path, recipe: Recipe) -> "RecipeStub":
+    """Summarize the recipe loaded from path."""
+    return cls(
+      path=path,
+      name=recipe.name,
+      priority=recipe.priority,
+      tags=list(recipe.tags),
+      action_tags=[list(action.tags) for action in recipe.actions],
+    )
+
+  def load(self) -> Recipe:
+    """Load the full recipe."""
+    return load_recipes([self.path])[0]
+
+
+def index_recipes(paths: Sequence[pathlib.Path]) -> list[RecipeStub]:
+  """Return stubs for the recipes in the given TOML files.
+
+  The stubs form an index of the recipes' tags which is cached (both in memory
+  and, if the cache is persistent, on disk) keyed on each file's path and
+  stamp. Only files which have been modified are loaded, using `load_recipes`.
+
+  Returns:
+    The stubs, in the same order as paths.
+  """
+  cache = get_cache()
+  keys = [str(path.absolute()) for path in paths]
+  stamps = [(RECIPE_CACHE_VERSION, stamp(path)) for path in paths]
+
+  stubs: list[RecipeStub | None] = [
+    cache.get("recipe_index", key, stamps=s) for key, s in zip(keys, stamps)
+  ]
+  missing = [i for i, stub in enumerate(stubs) if stub is None]
+
+  # Load any recipes which weren't indexed, and index them.
+  recipes = load_recipes([paths[i] for i in missing])
+  for i, recipe in zip(missing, recipes):
+    stubs[i] = RecipeStub.from_recipe(paths[i], recipe)
+    cache.set("recipe_index", keys[i], stubs[i], stamps=stamps[i])
+
+  return [stub for stub in stubs if stub is not None]
+
+
+def load_recipes(
+  paths: Sequence[pathlib.Path],
+  *,
+  jobs: int | None = None,
+) -> list[Recipe]:
+  """Load the recipes from the given TOML files.
+
+  Parsed recipes are cached (both in memory and, if the cache is persistent, on
+  disk) keyed on each file's path and stamp, so that a file is only re-parsed
+  when it is modified. If enough files have been modified they're parsed in
+  parallel by a pool of at most `jobs` processes.
+
+  Args:
+    paths: the recipe files to load.
+    jobs: the number of processes used to parse recipes, or None to use one per
+      CPU.
+
+  Returns:
+    The recipes, in the same order as paths.
+  """
+  cache = get_cache()
+  keys = [str(path.absolute()) for path in paths]
+  stamps = [(RECIPE_CACHE_VERSION, stamp(path)) for path in paths]
+
+  recipes: list[Recipe | None] = [
+    cache.get("recipes", key, stamps=s) for key, s in zip(keys, stamps)
+  ]
+  missing = [i for i, recipe in enumerate(recipes) if recipe is None]
+
+  # Parse any recipes which weren't cached.
+  jobs = jobs or os.cpu_count() or 1
+  if len(missing) >= PARALLEL_THRESHOLD and jobs > 1:
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+      parsed = list(pool.map(_parse_recipe, [paths[i] for i in missing]))
+  else:
+    parsed = [_parse_recipe(paths[i]) for i in missing]
+
+  for i, recipe in zip(missing, parsed):
+    recipes[i] = recipe
+    cache.set("recipes", keys[i], recipe, stamps=stamps[i])
+
+  return [recipe for recipe in recipes if recipe is not None]
+
+
+def _parse_recipe(path: pathlib.Path) -> Recipe:
+  """Parse and bind a single recipe file."""
+  try:
+    return dataclass_binder.Binder(Recipe).parse_toml(path)
+  except (ValueError, TypeError) as e:
+    raise SetuppyError(f'could not parse recipe "{path}": {e}') from None
@@ -0,0 +1,105 @@
+"""Tracing of where a run's time goes, exported in Chrome trace format."""
+
+import contextlib
+import json
+import os
+import pathlib
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any
+
+
+class Tracer:
+  """Record spans of wall-clock time and export them as trace events.
+
+  Spans are recorded as "complete" events of the Chrome trace event format,
+  which can be loaded by chrome://tracing or https://ui.perfetto.dev. Each
+  thread which records a span gets its own lane, named after the thread. If the
+  tracer is disabled recording a span does nothing.
+  """
+
+  def __init__(self, *, enabled: bool = True):
+    """Initialize the tracer.
+
+    Args:
+      enabled: whether to record any spans.
+    """
+    self.enabled = enabled
+    self._events: list[dict[str, Any]] = list()
+    self._lanes: dict[int, int] = dict()
+    self._lock = threading.Lock()
+    self._start = time.perf_counter()
+
+  @contextlib.contextmanager
+  def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+    """Record the time spent in the context as a span.
+
+    Args:
+      name: name of the span, e.g. the name of an action.
+      category: category of the span, e.g. "action".
+      args: additional (JSON serializable) data to attach to the span.
+    """
+    if not self.enabled:
+      yield
+      return
+
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      end = time.perf_counter()
+      event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": (start - self._start) * 1e6,
+        "dur": (end - start) * 1e6,
+        "pid": os.getpid(),
+        "tid": self._get_lane(),
+      }
+      if args:
+        event["args"] = args
+      with self._lock:
+        self._events.append(event)
+
+  def save(self, path: str | os.PathLike[str]):
+    """Write the recorded spans to path as trace event JSON."""
+    with self._lock:
+      events = list(self._events)
+    pathlib.Path(path).write_text(
+      json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+    )
+
+  def _get_lane(self) -> int:
+    """Return the lane of the current thread, naming it if it's new."""
+    ident = threading.get_ident()
+    with self._lock:
+      lane = self._lanes.get(ident)
+      if lane is None:
+        lane = self._lanes[ident] = len(self._lanes)
+        self._events.append({
+          "name": "thread_name",
+          "ph": "M",
+          "pid": os.getpid(),
+          "tid": lane,
+          "args": {"name": threading.current_thread().name},
+        })
+    return lane
+
+
+# The tracer used by the command line interface, controller and commands. By
+# default this is disabled; the command line interface replaces it if asked to
+# profile a run.
+_tracer = Tracer(enabled=False)
+
+
+def get_tracer() -> Tracer:
+  """Return the global tracer."""
+  return _tracer
+
+
+def set_tracer(tracer: Tracer):
+  """Replace the global tracer."""
+  global _tracer
+  _tracer = tracer
@@ -29,6 +29,11 @@ class Recipe:
 class Config:
   """Recipe data structure."""
   required_variables: list[str] = field(default_factory=list)
+  command_timeout: int | None = None
+  command_env: dict[str, str] = field(default_factory=dict)
+  max_processes: int | None = None
+  shell_worker: bool = False
+  event_sinks: list[str] = field(default_factory=list)
 
 
 class SetuppyError(RuntimeError):
@@ -0,0 +1,119 @@
+"""Accounting of the resources used by actions and the processes they spawn."""
+
+import contextlib
+import dataclasses
+import json
+import os
+import pathlib
+import resource
+import sys
+import time
+from collections.abc import Iterator
+
+
+# The number of actions shown in the summary table.
+SUMMARY_LIMIT = 10
+
+# The units of `ru_maxrss`, which is in bytes on macOS but kilobytes elsewhere.
+MAXRSS_UNITS = 1 if sys.platform == "darwin" else 1024
+
+
+@dataclasses.dataclass
+class Usage:
+  """Resources used while running an action.
+
+  CPU times and block I/O include both this process (e.g. threads reading and
+  writing files) and any child processes which have finished. Note that if
+  actions were to run concurrently their usage would overlap.
+
+  Properties:
+    wall_time: elapsed time in seconds.
+    user_time: user CPU time in seconds.
+    sys_time: system CPU time in seconds.
+    max_rss: peak resident set size in bytes of any child process, if a child
+      reached a new peak during the action, otherwise 0.
+    block_in: number of block input operations.
+    block_out: number of block output operations.
+  """
+  wall_time: float = 0.0
+  user_time: float = 0.0
+  sys_time: float = 0.0
+  max_rss: int = 0
+  block_in: int = 0
+  block_out: int = 0
+
+  @property
+  def cpu_time(self) -> float:
+    """Total CPU time in seconds."""
+    return self.user_time + self.sys_time
+
+  def __iadd__(self, other: "Usage") -> "Usage":
+    """Accumulate the usage of other into this usage."""
+    self.wall_time += other.wall_time
+    self.user_time += other.user_time
+    self.sys_time += other.sys_time
+    self.max_rss = max(self.max_rss, other.max_rss)
+    self.block_in += other.block_in
+    self.block_out += other.block_out
+    return self
+
+
+@contextlib.contextmanager
+def measure() -> Iterator[Usage]:
+  """Measure the resources used within the context.
+
+  Yields:
+    A `Usage` which is filled in when the context exits.
+  """
+  usage = Usage()
+  start = time.monotonic()
+  before_self = resource.getrusage(resource.RUSAGE_SELF)
+  before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+  try:
+    yield usage
+  finally:
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage.wall_time = time.monotonic() - start
+
+    # Sum the deltas of this process and its children.
+    for before, after in [
+      (before_self, after_self),
+      (before_children, after_children),
+    ]:
+      usage.user_time += after.ru_utime - before.ru_utime
+      usage.sys_time += after.ru_stime - before.ru_stime
+      usage.block_in += after.ru_inblock - before.ru_inblock
+      usage.block_out += after.ru_oublock - before.ru_oublock
+
+    # The children's peak is over all children ever, so we only know the peak
+    # of this action's children if it's higher than any before it.
+    if after_children.ru_maxrss > before_children.ru_maxrss:
+      usage.max_rss = after_children.ru_maxrss * MAXRSS_UNITS
+
+
+def format_summary(usage: dict[str, Usage], limit: int = SUMMARY_LIMIT) -> str:
+  """Format a table of the actions which used the most CPU time."""
+  rows = sorted(usage.items(), key=lambda item: -item[1].cpu_time)[:limit]
+  width = max([len("action")] + [len(name) for name, _ in rows])
+
+  lines = [
+    f"{'action':<{width}}  {'wall':>8}  {'user':>8}  {'sys':>8}  "
+    f"{'maxrss':>8}  {'blk in':>8}  {'blk out':>8}"
+  ]
+  for name, u in rows:
+    lines.append(
+      f"{name:<{width}}  {u.wall_time:>7.2f}s  {u.user_time:>7.2f}s  "
+      f"{u.sys_time:>7.2f}s  {u.max_rss // 2**20:>6}MB  "
+      f"{u.block_in:>8}  {u.block_out:>8}"
+    )
+  return "\n".join(lines)
+
+
+def save_report(path: str | os.PathLike[str], usage: dict[str, Usage]):
+  """Write the usage of each action to path as JSON."""
+  report = {
+    name: {**dataclasses.asdict(u), "cpu_time": u.cpu_time}
+    for name, u in usage.items()
+  }
+  pathlib.Path(path).write_text(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,46 @@
+"""Shared test fixtures."""
+
+from collections.abc import Iterable
+
+import pytest
+
+from setuppy import cache
+from setuppy import events
+from setuppy import trace
+from setuppy.commands import utils
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache() -> Iterable[cache.Cache]:
+  # Make sure nothing cached by one test leaks into another.
+  old_cache = cache.get_cache()
+  cache.set_cache(cache.Cache())
+  yield cache.get_cache()
+  cache.set_cache(old_cache)
+
+
+@pytest.fixture(autouse=True)
+def fresh_executor() -> Iterable[utils.Executor]:
+  # Make sure resolved paths and accounting don't leak between tests.
+  old_executor = utils.get_executor()
+  utils.set_executor(utils.Executor())
+  yield utils.get_executor()
+  utils.set_executor(old_executor)
+
+
+@pytest.fixture(autouse=True)
+def fresh_tracer() -> Iterable[trace.Tracer]:
+  # Make sure spans recorded by one test don't leak into another.
+  old_tracer = trace.get_tracer()
+  trace.set_tracer(trace.Tracer(enabled=False))
+  yield trace.get_tracer()
+  trace.set_tracer(old_tracer)
+
+
+@pytest.fixture(autouse=True)
+def fresh_bus() -> Iterable[events.EventBus]:
+  # Make sure sinks added by one test don't receive another's events.
+  old_bus = events.get_bus()
+  events.set_bus(events.EventBus())
+  yield events.get_bus()
+  events.set_bus(old_bus)
@@ -56,7 +56,9 @@ def test_install(run_command: mock.MagicMock):
   apt = Apt(PACKAGES)
   rv = apt(facts={"apt_packages": PACKAGES[:-1]}, simulate=False)
   assert rv.changed
-  run_command.assert_called_once_with([*CMD_INSTALL, PACKAGES[-1]], sudo=True)
+  run_command.assert_called_once_with(
+    [*CMD_INSTALL, PACKAGES[-1]], sudo=True, stream=True
+  )
 
 
 def test_install_error(run_command: mock.MagicMock):
@@ -66,7 +68,9 @@ def test_install_error(run_command: mock.MagicMock):
   apt = Apt(PACKAGES)
   with pytest.raises(SetuppyError):
     apt(facts={"apt_packages": PACKAGES[:-1]}, simulate=False)
-  run_command.assert_called_once_with([*CMD_INSTALL, PACKAGES[-1]], sudo=True)
+  run_command.assert_called_once_with(
+    [*CMD_INSTALL, PACKAGES[-1]], sudo=True, stream=True
+  )
 
 
 def test_install_simulate(run_command: mock.MagicMock):
@@ -75,3 +79,30 @@ def test_install_simulate(run_command: mock.MagicMock):
   rv = apt(facts={"apt_packages": PACKAGES[:-1]}, simulate=True)
   assert rv.changed
   assert not run_command.called
+
+
+@mock.patch("setuppy.commands.apt.stamp")
+def test_all_installed_cached_across_runs(
+  stamp: mock.MagicMock,
+  run_command: mock.MagicMock,
+):
+  # The installed packages should be cached until dpkg's database changes.
+  stamp.return_value = (1, 1, 1)
+  run_command.return_value = (0, "\n".join(PACKAGES), "")
+  apt = Apt(PACKAGES)
+  apt(facts={}, simulate=False)
+  rv = apt(facts={}, simulate=False)
+  assert not rv.changed
+  run_command.assert_called_once_with(CMD_QUERY)
+
+  stamp.return_value = (2, 1, 1)
+  apt(facts={}, simulate=False)
+  assert run_command.call_count == 2
+
+
+def test_check(run_command: mock.MagicMock):
+  # The check only says there's nothing to do if every package is installed.
+  apt = Apt(PACKAGES)
+  assert apt.check({"apt_packages": PACKAGES}) is False
+  assert apt.check({"apt_packages": PACKAGES[:-1]}) is True
+  assert not run_command.called
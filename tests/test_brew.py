@@ -71,7 +71,9 @@ def test_install(run_command: mock.MagicMock):
   brew = Brew(PACKAGES)
   rv = brew(facts={"brew_packages": PACKAGES[:-1]}, simulate=False)
   assert rv.changed
-  run_command.assert_called_once_with([*CMD_INSTALL, PACKAGES[-1]])
+  run_command.assert_called_once_with(
+    [*CMD_INSTALL, PACKAGES[-1]], stream=True
+  )
 
 
 def test_install_error(run_command: mock.MagicMock):
@@ -81,7 +83,9 @@ def test_install_error(run_command: mock.MagicMock):
   brew = Brew(PACKAGES)
   with pytest.raises(SetuppyError):
     brew(facts={"brew_packages": PACKAGES[:-1]}, simulate=False)
-  run_command.assert_called_once_with([*CMD_INSTALL, PACKAGES[-1]])
+  run_command.assert_called_once_with(
+    [*CMD_INSTALL, PACKAGES[-1]], stream=True
+  )
 
 
 def test_install_simulate(run_command: mock.MagicMock):
@@ -90,3 +94,30 @@ def test_install_simulate(run_command: mock.MagicMock):
   rv = brew(facts={"brew_packages": PACKAGES[:-1]}, simulate=True)
   assert rv.changed
   assert not run_command.called
+
+
+@mock.patch("setuppy.commands.brew.stamp")
+def test_all_installed_cached_across_runs(
+  stamp: mock.MagicMock,
+  run_command: mock.MagicMock,
+):
+  # The installed packages should be cached until brew's directories change.
+  stamp.return_value = (1, 1, 1)
+  run_command.return_value = (0, "\n".join(PACKAGES), "")
+  brew = Brew(PACKAGES)
+  brew(facts={}, simulate=False)
+  rv = brew(facts={}, simulate=False)
+  assert not rv.changed
+  assert run_command.call_count == 2
+
+  stamp.return_value = (2, 1, 1)
+  brew(facts={}, simulate=False)
+  assert run_command.call_count == 4
+
+
+def test_check(run_command: mock.MagicMock):
+  # The check only says there's nothing to do if every package is installed.
+  brew = Brew(PACKAGES)
+  assert brew.check({"brew_packages": PACKAGES}) is False
+  assert brew.check({"brew_packages": PACKAGES[:-1]}) is True
+  assert not run_command.called
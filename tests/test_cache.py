@@ -0,0 +1,133 @@
+"""Test for the persistent cache."""
+
+import os
+import pathlib
+from unittest import mock
+
+import pytest
+from pyfakefs.fake_filesystem import FakeFilesystem
+
+from setuppy import cache as cache_lib
+
+
+CACHEDIR = "/cache"
+
+
+def test_stamp(fs: FakeFilesystem):
+  # Missing files have no stamp and the stamp changes if the file changes.
+  assert cache_lib.stamp("/foo") is None
+  fs.create_file("/foo", contents="foo")
+  stamp = cache_lib.stamp("/foo")
+  assert stamp is not None
+  pathlib.Path("/foo").write_text("foobar")
+  assert cache_lib.stamp("/foo") != stamp
+
+
+def test_get_set():
+  cache = cache_lib.Cache()
+
+  # Missing values return None, or the given default.
+  assert cache.get("foo", "bar") is None
+  assert cache.get("foo", "bar", 1) == 1
+
+  # Values are returned only if their stamps match.
+  cache.set("foo", "bar", 1, stamps=[1])
+  assert cache.get("foo", "bar", stamps=[1]) == 1
+  assert cache.get("foo", "bar", stamps=[2]) is None
+  assert cache.get("baz", "bar", stamps=[1]) is None
+
+  # Values can be deleted.
+  cache.delete("foo", "bar")
+  assert cache.get("foo", "bar", stamps=[1]) is None
+
+
+def test_ttl():
+  cache = cache_lib.Cache()
+
+  with mock.patch("time.time") as time:
+    time.return_value = 100.0
+    cache.set("foo", "bar", 1, ttl=10)
+    assert cache.get("foo", "bar") == 1
+
+    # The value expires once its ttl has passed.
+    time.return_value = 111.0
+    assert cache.get("foo", "bar") is None
+
+
+def test_get_or_compute():
+  cache = cache_lib.Cache()
+  compute = mock.MagicMock(return_value=1)
+
+  # The value should only be computed once.
+  assert cache.get_or_compute("foo", "bar", compute) == 1
+  assert cache.get_or_compute("foo", "bar", compute) == 1
+  assert compute.call_count == 1
+
+  # Even if the value is None.
+  compute = mock.MagicMock(return_value=None)
+  assert cache.get_or_compute("foo", "baz", compute) is None
+  assert cache.get_or_compute("foo", "baz", compute) is None
+  assert compute.call_count == 1
+
+
+def test_save_and_load(fs: FakeFilesystem):
+  # An in-memory cache doesn't write anything.
+  cache = cache_lib.Cache()
+  cache.set("foo", "bar", 1)
+  cache.save()
+  assert not pathlib.Path(CACHEDIR).exists()
+
+  # A persistent cache can be reloaded by another instance.
+  cache = cache_lib.Cache(CACHEDIR)
+  cache.set("foo", "bar", 1, stamps=[1])
+  cache.save()
+  assert pathlib.Path(CACHEDIR, "foo.pickle").is_file()
+  assert cache_lib.Cache(CACHEDIR).get("foo", "bar", stamps=[1]) == 1
+
+  # Unreadable caches are treated as empty.
+  fs.create_file(CACHEDIR + "/baz.pickle", contents="garbage")
+  assert cache_lib.Cache(CACHEDIR).get("baz", "bar") is None
+
+
+def test_evict(fs: FakeFilesystem):
+  cache = cache_lib.Cache(CACHEDIR)
+
+  with mock.patch("time.time") as time:
+    time.return_value = 100.0
+    cache.set("foo", "bar", 1, stamps=[1])
+    cache.set("foo", "baz", 2, ttl=10)
+    cache.set("foo", "qux", 3)
+    cache.save()
+
+    # Values whose stamps no longer match are evicted when they're looked up.
+    assert cache.get("foo", "bar", stamps=[2]) is None
+    assert cache.get("foo", "bar", stamps=[1]) is None
+
+    # Expired values are evicted when the cache is saved, even if they weren't
+    # looked up.
+    time.return_value = 111.0
+    cache.save()
+
+  cache = cache_lib.Cache(CACHEDIR)
+  assert cache.get("foo", "baz") is None
+  assert cache.get("foo", "qux") == 3
+  assert cache._store("foo").keys() == {"qux"}
+
+
+def test_write_atomic(tmp_path: pathlib.Path):
+  # The file is only replaced once it has been written in full.
+  path = tmp_path / "foo"
+  path.write_text("old")
+  with mock.patch("os.replace", side_effect=OSError):
+    with pytest.raises(OSError):
+      cache_lib.write_atomic(path, b"new")
+  assert path.read_text() == "old"
+  assert os.listdir(tmp_path) == ["foo"]
+
+  cache_lib.write_atomic(path, b"new")
+  assert path.read_text() == "new"
+  assert path.stat().st_mode & 0o777 == 0o600
+
+  # The file's permissions can be given.
+  cache_lib.write_atomic(path, b"new", mode=0o644)
+  assert path.stat().st_mode & 0o777 == 0o644
@@ -1,10 +1,14 @@
 """Test for the raw "command" command."""
 
+import pathlib
+import subprocess
 from collections.abc import Iterable
 from unittest import mock
 
 import pytest
+from pyfakefs.fake_filesystem import FakeFilesystem
 
+from setuppy.commands import utils
 from setuppy.commands.command import Command
 from setuppy.types import SetuppyError
 
@@ -23,7 +27,7 @@ def test_command(run_command: mock.MagicMock):
   command = Command(["ls"])
   rv = command(facts={}, simulate=False)
   assert rv.changed
-  run_command.assert_called_once_with(["ls"])
+  run_command.assert_called_once_with(["ls"], stream=True, worker=True)
 
 
 def test_command_simulate(run_command: mock.MagicMock):
@@ -40,3 +44,169 @@ def test_command_fails(run_command: mock.MagicMock):
   run_command.return_value = (1, "", "")
   with pytest.raises(SetuppyError):
     command(facts={}, simulate=False)
+
+
+def test_command_shell_worker(tmp_path: pathlib.Path):
+  # Commands are run by the executor's shell worker, if it has one, rather than
+  # each being spawned.
+  executor = utils.Executor(shell_worker=True)
+  utils.set_executor(executor)
+  flag = tmp_path / "flag"
+  with mock.patch("subprocess.Popen", wraps=subprocess.Popen) as popen:
+    assert Command(["touch", str(flag)])(facts={}, simulate=False).changed
+    assert Command(["true"])(facts={}, simulate=False).changed
+    rv = Command(["echo", "foo"], fact="foo")(facts={}, simulate=False)
+  assert rv.facts == {"foo": "foo"}
+  assert flag.exists()
+  assert executor._worker is not None
+  assert popen.call_count == 1
+  executor.close()
+
+
+def test_command_path_guards(run_command: mock.MagicMock, fs: FakeFilesystem):
+  fs.create_file("/foo")
+
+  # The command is skipped if the path it creates exists.
+  rv = Command(["ls"], creates="/foo")(facts={}, simulate=False)
+  assert not rv.changed
+  assert not run_command.called
+
+  # Or if the path it removes doesn't exist.
+  rv = Command(["ls"], removes="/bar")(facts={}, simulate=False)
+  assert not rv.changed
+  assert not run_command.called
+
+  # Otherwise it runs as normal.
+  rv = Command(["ls"], creates="/bar", removes="/foo")(facts={}, simulate=False)
+  assert rv.changed
+  run_command.assert_called_once_with(["ls"], stream=True, worker=True)
+
+
+def test_command_probes(run_command: mock.MagicMock):
+  # The command is skipped if its unless probe succeeds, and the probe is run
+  # even when simulating.
+  rv = Command(["ls"], unless=["true"])(facts={}, simulate=True)
+  assert not rv.changed
+  run_command.assert_called_once_with(["true"], worker=True)
+
+  # The command is skipped if its onlyif probe fails.
+  run_command.reset_mock()
+  run_command.return_value = (1, "", "")
+  rv = Command(["ls"], onlyif=["false"])(facts={}, simulate=False)
+  assert not rv.changed
+  run_command.assert_called_once_with(["false"], worker=True)
+
+
+def test_command_detect_changes(
+  run_command: mock.MagicMock,
+  fs: FakeFilesystem,
+):
+  command = Command(["ls"], detect_changes=True)
+
+  # The first run is always a change, and the full output is captured.
+  run_command.return_value = (0, "foo", "")
+  assert command(facts={}, simulate=False).changed
+  run_command.assert_called_once_with(["ls"], stream=False, worker=True)
+
+  # The command isn't changed unless its output changes.
+  assert not command(facts={}, simulate=False).changed
+  run_command.return_value = (0, "bar", "")
+  assert command(facts={}, simulate=False).changed
+
+  # Watched files are also hashed.
+  fs.create_file("/foo", contents="foo")
+  command = Command(["ls"], watch=["/foo"])
+  assert command(facts={}, simulate=False).changed
+  assert not command(facts={}, simulate=False).changed
+  pathlib.Path("/foo").write_text("bar")
+  assert command(facts={}, simulate=False).changed
+
+
+def test_command_fact(run_command: mock.MagicMock):
+  # The output of the command is parsed and set as a fact.
+  run_command.return_value = (0, " foo\n", "")
+  rv = Command(["ls"], fact="foo")(facts={}, simulate=False)
+  assert rv.facts == {"foo": "foo"}
+  run_command.assert_called_once_with(["ls"], stream=False, worker=True)
+
+  # When simulating the command is only run if it's safe.
+  run_command.reset_mock()
+  rv = Command(["ls"], fact="foo")(facts={}, simulate=True)
+  assert rv.facts == {}
+  run_command.assert_not_called()
+  rv = Command(["ls"], fact="foo", safe=True)(facts={}, simulate=True)
+  assert rv.facts == {"foo": "foo"}
+  run_command.assert_called_once()
+
+  # Output can also be parsed as json or toml.
+  run_command.return_value = (0, '{"a": [1, 2]}', "")
+  rv = Command(["ls"], fact="foo", parse="json")(facts={}, simulate=False)
+  assert rv.facts == {"foo": {"a": [1, 2]}}
+  run_command.return_value = (0, 'a = "b"', "")
+  rv = Command(["ls"], fact="foo", parse="toml")(facts={}, simulate=False)
+  assert rv.facts == {"foo": {"a": "b"}}
+
+  # Unparseable output raises an error.
+  run_command.return_value = (0, "foo", "")
+  with pytest.raises(SetuppyError):
+    Command(["ls"], fact="foo", parse="json")(facts={}, simulate=False)
+
+
+def test_command_fact_ttl(run_command: mock.MagicMock):
+  command = Command(["ls"], fact="foo", fact_ttl=10)
+  run_command.return_value = (0, "foo", "")
+
+  with mock.patch("time.time") as time:
+    # The command is only run once while the fact is cached.
+    time.return_value = 100.0
+    # The cached result is the same as running the command.
+    rv = command(facts={}, simulate=False)
+    assert rv.facts == {"foo": "foo"}
+    assert rv.changed
+    assert command(facts={}, simulate=False) == rv
+    assert run_command.call_count == 1
+
+    # Once the fact expires the command is run again.
+    time.return_value = 111.0
+    command(facts={}, simulate=False)
+    assert run_command.call_count == 2
+
+    # A null fact is cached too.
+    command = Command(["ls"], fact="foo", parse="json", fact_ttl=10)
+    run_command.return_value = (0, "null", "")
+    assert command(facts={}, simulate=False).facts == {"foo": None}
+    assert command(facts={}, simulate=False).facts == {"foo": None}
+    assert run_command.call_count == 3
+
+
+def test_command_check(run_command: mock.MagicMock, fs: FakeFilesystem):
+  # Commands skipped by their guards don't need to run.
+  fs.create_file("/foo")
+  assert Command(["ls"], creates="/foo").check({}) is False
+  assert Command(["ls"], creates="/bar").check({}) is True
+
+  # Commands with other guards must be run to know, since earlier actions may
+  # change what the guards find.
+  assert Command(["ls"], removes="/foo").check({}) is None
+  assert Command(["ls"], onlyif=["true"]).check({}) is None
+  assert Command(["ls"], unless=["true"]).check({}) is None
+  run_command.assert_not_called()
+
+  # Commands which set facts or detect changes must be run to know.
+  assert Command(["ls"], fact="foo").check({}) is None
+  assert Command(["ls"], detect_changes=True).check({}) is None
+  assert not run_command.called
+
+
+def test_templates():
+  # Everything but the fact's name and parser is interpolated.
+  command = Command(
+    ["echo", "{foo}"],
+    creates="{bar}",
+    unless=["{baz}"],
+    watch=["{qux}"],
+    fact="{x}",
+  )
+  assert command.templates() == ["echo", "{foo}", "{bar}", "{baz}", "{qux}"]
+  assert command.provides() == {"{x}"}
+  assert Command(["true"]).provides() == set()
@@ -1,7 +1,11 @@
 """Test for the command running utilities."""
 
 import dataclasses
+import pathlib
+import signal
 import subprocess
+import threading
+from typing import Any
 from unittest import mock
 
 import pytest
@@ -17,10 +21,6 @@ class MockProcessRV:
   stdout: str
   stderr: str
 
-  def communicate(self) -> tuple[str, str]:
-    """Mock communicate function for subprocess.Popen."""
-    return "", ""
-
 
 @mock.patch("subprocess.run")
 @mock.patch("shutil.which")
@@ -57,6 +57,15 @@ def test_run_command(
   utils.run_command(cmd, sudo=True)
   run.assert_called_once_with(["/usr/bin/sudo", fullpath, *args], **run_kwargs)
 
+  # Output is suspended while commands run under sudo, and only then.
+  suspend = mock.MagicMock()
+  utils.get_executor().suspend_output = suspend
+  utils.run_command(cmd)
+  suspend.assert_not_called()
+  utils.run_command(cmd, sudo=True)
+  suspend.assert_called_once_with()
+  suspend.return_value.__enter__.assert_called_once_with()
+
 
 @mock.patch("subprocess.Popen")
 @mock.patch("shutil.which")
@@ -67,7 +76,6 @@ def test_run_pipe(
   cmd1 = ["ls", "foo", "bar", "baz"]
   cmd2 = ["cat"]
   fullcmd1 = ["/bin/ls", *cmd1[1:]]
-  fullcmd2 = ["/usr/bin/cat"]
 
   # Raise an exception if the first cmd can't be found.
   which.return_value = None
@@ -85,13 +93,150 @@ def test_run_pipe(
   which.assert_any_call("ls")
   which.assert_any_call("cat")
 
-  # Run the two piped processes and verify we properly call Popen.
-  which.reset_mock(return_value=True)
-  which.side_effect = [fullcmd1[0], fullcmd2[0]]
-  popen.return_value = MockProcessRV(0, "stdout", "stderr")
-  utils.run_pipe(cmd1, cmd2)
-  assert popen.call_count == 2
-  popen.assert_any_call(fullcmd1, stdout=subprocess.PIPE)
-  popen.assert_any_call(
-    fullcmd2, stdin="stdout", stdout=subprocess.PIPE, encoding="utf-8"
+  # Nothing should have been run.
+  assert not popen.called
+
+
+def test_pipeline():
+  # Run a real pipeline of processes.
+  rc, stdout, _ = utils.run_pipe(["printf", "b\\na\\n"], ["sort"], ["cat"])
+  assert rc == 0
+  assert stdout == "a\nb\n"
+
+  # A failure in an earlier stage is reported even if the last stage succeeds.
+  result = utils.get_executor().pipeline([
+    ["sh", "-c", "echo foo >&2; exit 3"],
+    ["cat"],
+  ])
+  assert result.returncodes == [3, 0]
+  assert result.returncode == 3
+  assert result.stderrs == ["foo\n", ""]
+
+  # Pipelines which time out or are cancelled raise an error.
+  with pytest.raises(SetuppyError, match="timed out"):
+    utils.get_executor().pipeline([["sleep", "10"], ["cat"]], timeout=0.1)
+
+  cancel = threading.Event()
+  cancel.set()
+  with pytest.raises(SetuppyError, match="cancelled"):
+    utils.get_executor().pipeline([["sleep", "10"], ["cat"]], cancel=cancel)
+
+
+def test_pipeline_timeout():
+  # Pipelines run by run_pipe are subject to the executor's timeout, and every
+  # stage is killed when it expires.
+  procs = []
+  popen = subprocess.Popen
+
+  def spawn(*args: Any, **kwargs: Any) -> subprocess.Popen:
+    procs.append(popen(*args, **kwargs))
+    return procs[-1]
+
+  utils.set_executor(utils.Executor(timeout=0.1))
+  with mock.patch("subprocess.Popen", side_effect=spawn):
+    with pytest.raises(SetuppyError, match="timed out"):
+      utils.run_pipe(["sleep", "10"], ["sleep", "10"])
+  assert len(procs) == 2
+  assert all(proc.returncode == -signal.SIGKILL for proc in procs)
+
+
+@mock.patch("subprocess.run")
+@mock.patch("shutil.which")
+def test_executor(
+  which: mock.MagicMock,
+  run: mock.MagicMock,
+):
+  which.return_value = "/bin/ls"
+  run.return_value = MockProcessRV(0, "", "")
+  executor = utils.Executor(timeout=10, env={"FOO": "foo"}, max_procs=1)
+
+  # Paths are memoized and the run is attributed to the current label.
+  with executor.label("foo"):
+    executor.run(["ls"])
+    executor.run(["ls"], env={"BAR": "bar"})
+  which.assert_called_once_with("ls")
+  assert executor.stats["foo"].spawns == 2
+
+  # Timeouts and environment overrides are passed to the process.
+  _, kwargs = run.call_args
+  assert kwargs["timeout"] == 10
+  assert kwargs["env"]["FOO"] == "foo"
+  assert kwargs["env"]["BAR"] == "bar"
+
+  # Paths are resolved again if the PATH changes.
+  with mock.patch.dict("os.environ", {"PATH": "/foo"}):
+    executor.run(["ls"])
+  assert which.call_count == 2
+
+  # An overridden PATH is used to resolve commands.
+  executor = utils.Executor(env={"PATH": "/foo"})
+  executor.run(["ls"])
+  which.assert_called_with("ls", path="/foo")
+
+  # Timeouts raise an error.
+  run.side_effect = subprocess.TimeoutExpired(["ls"], 10)
+  with pytest.raises(SetuppyError):
+    executor.run(["ls"], timeout=10)
+
+
+def test_run_streaming(tmp_path: pathlib.Path):
+  # Stream the output of a real process, keeping only the tail of it.
+  executor = utils.Executor(logdir=tmp_path)
+  script = "for i in $(seq 1 20); do echo $i; echo err$i >&2; done; exit 3"
+  with (
+    mock.patch.object(utils, "STREAM_BUFFER_LINES", 5),
+    executor.label("foo bar"),
+  ):
+    rc, stdout, stderr = executor.run(["sh", "-c", script], stream=True)
+  assert rc == 3
+  assert stdout.split() == ["16", "17", "18", "19", "20"]
+  assert stderr.split() == ["err16", "err17", "err18", "err19", "err20"]
+
+  # The full output should be written to the log file for the label.
+  log = (tmp_path / "foo_bar.log").read_text().split()
+  assert "1" in log and "err1" in log and "20" in log
+
+  # Streamed processes which time out are killed.
+  with pytest.raises(SetuppyError):
+    executor.run(["sleep", "10"], stream=True, timeout=0.1)
+
+
+def test_shell_worker():
+  # Commands which allow it are run by a single shell worker.
+  executor = utils.Executor(shell_worker=True)
+  with mock.patch("subprocess.run") as run:
+    rc, stdout, stderr = executor.run(
+      ["sh", "-c", "echo 'foo bar'; echo baz >&2; exit 3"], worker=True
+    )
+    assert not run.called
+  assert (rc, stdout, stderr) == (3, "foo bar\n", "baz\n")
+
+  # Arguments are quoted and commands don't read the worker's stdin.
+  rc, stdout, _ = executor.run(["echo", "$HOME", "a;b"], worker=True)
+  assert (rc, stdout) == (0, "$HOME a;b\n")
+  rc, stdout, _ = executor.run(["cat"], worker=True)
+  assert (rc, stdout) == (0, "")
+
+  # Commands which time out kill the worker, which is then replaced.
+  with pytest.raises(SetuppyError):
+    executor.run(["sleep", "10"], worker=True, timeout=0.1)
+  rc, stdout, _ = executor.run(["echo", "foo"], worker=True)
+  assert (rc, stdout) == (0, "foo\n")
+
+  # A timeout which fires once the command has finished doesn't fail it.
+  timer = mock.MagicMock()
+  timer.return_value.cancel.side_effect = lambda: timer.call_args.args[1](
+    *timer.call_args.args[2]
   )
+  with mock.patch("threading.Timer", timer):
+    rc, stdout, _ = executor.run(["echo", "foo"], worker=True, timeout=10)
+  assert (rc, stdout) == (0, "foo\n")
+  rc, stdout, _ = executor.run(["echo", "bar"], worker=True)
+  assert (rc, stdout) == (0, "bar\n")
+
+  # Commands whose output is streamed are spawned instead.
+  with mock.patch.object(executor, "_run_streaming") as run_streaming:
+    executor.run(["echo", "foo"], worker=True, stream=True)
+  run_streaming.assert_called_once()
+
+  executor.close()
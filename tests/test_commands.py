@@ -0,0 +1,74 @@
+"""Test for the command registry."""
+
+import importlib.metadata
+from unittest import mock
+
+import pytest
+
+from setuppy import commands
+from setuppy.commands.command import Command
+from setuppy.types import SetuppyError
+
+
+def test_lazy():
+  registry = commands.Registry({"foo": "setuppy.commands.command:Command"})
+
+  # Checking a kind exists doesn't import it.
+  with mock.patch("importlib.import_module") as import_module:
+    assert "foo" in registry
+    assert not import_module.called
+
+  # Looking it up does, but only once.
+  assert registry["foo"] is Command
+  with mock.patch("importlib.import_module") as import_module:
+    assert registry["foo"] is Command
+    assert not import_module.called
+
+
+def test_builtins():
+  # Every built-in command can be loaded.
+  registry = commands.Registry()
+  for kind in commands.BUILTIN_COMMANDS:
+    assert registry[kind].__name__.lower() == kind
+
+
+def test_register():
+  registry = commands.Registry({})
+
+  # Commands can be registered either directly or lazily.
+  registry.register("foo", Command)
+  registry.register("bar", "setuppy.commands.command:Command")
+  assert registry["foo"] is Command
+  assert registry["bar"] is Command
+
+  # Bad commands raise an error when they're looked up.
+  registry.register("baz", "setuppy.commands.command:Missing")
+  registry.register("qux", "setuppy.types:Config")
+  with pytest.raises(SetuppyError):
+    registry["baz"]
+  with pytest.raises(SetuppyError):
+    registry["qux"]
+
+
+@mock.patch("importlib.metadata.entry_points")
+def test_entry_points(entry_points: mock.MagicMock):
+  entry_points.return_value = [
+    importlib.metadata.EntryPoint(
+      name, "setuppy.commands.command:Command", commands.ENTRY_POINT_GROUP
+    )
+    for name in ["foo", "bar"]
+  ]
+  registry = commands.Registry({"bar": "setuppy.commands.apt:Apt"})
+
+  # Entry points aren't searched if the kind is already known.
+  assert "bar" in registry
+  assert not entry_points.called
+
+  # Otherwise entry points are searched, once, but never replace other kinds.
+  assert "foo" in registry
+  assert "baz" not in registry
+  entry_points.assert_called_once_with(group=commands.ENTRY_POINT_GROUP)
+  assert registry["foo"] is Command
+  assert registry["bar"].__name__ == "Apt"
+  assert sorted(registry) == ["bar", "foo"]
+  assert len(registry) == 2
@@ -1,17 +1,25 @@
 """Tests for the controller class."""
 
 import dataclasses
+import io
+import json
+import pathlib
+from collections.abc import Hashable
+from collections.abc import Sequence
 from typing import Any
 from typing import TypedDict
 from unittest import mock
 
 import pytest
 
+from setuppy import events
+from setuppy import output
 from setuppy import types
 from setuppy.commands import register
 from setuppy.commands.base import BaseCommand
 from setuppy.commands.base import CommandResult
 from setuppy.controller import Controller
+from setuppy.recipes import RecipeStub
 
 
 # Register a noop command so we can use it in a recipe.
@@ -36,9 +44,105 @@ class Noop(BaseCommand):
     return CommandResult(changed=self.changed)
 
 
+class Recorder(events.Sink):
+  """Sink which records every event."""
+
+  def __init__(self):
+    """Initialize the sink."""
+    self.events: list[events.Event] = []
+
+  def handle(self, event: events.Event):
+    """Record the event."""
+    self.events.append(event)
+
+
+# Sizes of the batches run by the command below.
+BATCHES: list[int] = []
+
+
+# Register a command which can be batched, recording the batches it is run in.
+@register
+@dataclasses.dataclass
+class Batched(BaseCommand):
+  """Command that does nothing, but can be batched."""
+  key: str = "foo"
+  changed: bool = False
+  raises: bool = False
+  fact: str | None = None
+  compile: bool = False
+
+  def __call__(
+    self,
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> CommandResult:
+    """Run a command that does nothing."""
+    return self.run_batch([self], facts=facts, simulate=simulate)[0]
+
+  def templates(self) -> list[str]:
+    """Only compile the key if asked, so batch_key is left to handle errors."""
+    return [self.key] if self.compile else []
+
+  def provides(self) -> set[str]:
+    """Return the fact which is set to "bar", if any."""
+    return {self.fact} if self.fact else set()
+
+  def batch_key(self, facts: dict[str, Any]) -> Hashable | None:
+    """Batch commands with the same key."""
+    return self.key.format(**facts)
+
+  @classmethod
+  def run_batch(
+    cls,
+    commands: Sequence["Batched"],
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> list[CommandResult]:
+    """Run a batch of commands that do nothing."""
+    BATCHES.append(len(commands))
+    if any(command.raises for command in commands):
+      raise RuntimeError
+    return [
+      CommandResult(
+        changed=command.changed,
+        facts={command.fact: "bar"} if command.fact else {},
+      )
+      for command in commands
+    ]
+
+
+# Results of the checks of the command below, and which of them were run.
+CHECKS: dict[str, bool | None] = {}
+RUNS: list[str] = []
+
+
+# Register a command whose check result is given by the CHECKS.
+@register
+@dataclasses.dataclass
+class Checked(BaseCommand):
+  """Command that does nothing, but has a check."""
+  name: str
+
+  def __call__(
+    self,
+    *,
+    facts: dict[str, Any],
+    simulate: bool,
+  ) -> CommandResult:
+    """Run a command that does nothing."""
+    RUNS.append(self.name)
+    return CommandResult(changed=True)
+
+  def check(self, facts: dict[str, Any]) -> bool | None:
+    """Return the result of the check."""
+    return CHECKS[self.name]
+
+
 class ControllerKwargs(TypedDict):
   """Typed kwargs for a controller."""
-  recipes: list[types.Recipe]
+  recipes: Sequence[types.Recipe | RecipeStub]
   tags: list[str]
   variables: dict[str, Any]
   config: types.Config
@@ -135,6 +239,140 @@ def test_run_controller():
   with pytest.raises(RuntimeError):
     controller._run_action(error_action)
 
+  # The run closed the bus, so the events of these actions are dropped rather
+  # than dispatched by a new thread.
+  assert controller.bus._thread is None
+  controller.bus.close()
+
+
+def test_events():
+  actions = [
+    types.Action(name="noop1", kind="noop", kwargs={"changed": True}),
+    types.Action(name="noop2", kind="noop", tags=["foo"]),
+    types.Action(name="noop3", kind="noop", kwargs={"raises": True}),
+  ]
+
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(
+    recipes=[
+      types.Recipe(name="foo", actions=actions),
+      types.Recipe(name="bar", actions=[], tags=["foo"]),
+    ],
+    verbosity=2,
+  )
+  stream = io.StringIO()
+  controller = Controller(**kwargs_, sinks=[output.EventLog(stream)])
+  renderer = output.Renderer(stream=io.StringIO(), live=False)
+  controller.console.renderer = renderer
+  with pytest.raises(RuntimeError):
+    controller.run()
+
+  # Every event of the run is recorded, and the global bus is restored.
+  records = [json.loads(line) for line in stream.getvalue().splitlines()]
+  assert [(r["event"], r.get("action")) for r in records] == [
+    ("run.start", None),
+    ("recipe.start", None),
+    ("action.start", "noop1"),
+    ("action.finish", "noop1"),
+    ("action.skip", "noop2"),
+    ("action.start", "noop3"),
+    ("action.error", "noop3"),
+    ("run.finish", None),
+  ]
+  assert records[3]["changed"] is True
+  assert records[3]["recipe"] == "foo"
+  assert records[3]["kind"] == "noop"
+  assert records[-1]["error"] is not None
+  assert events.get_bus() is not controller.bus
+
+  # And the status of every action is output.
+  assert isinstance(renderer.stream, io.StringIO)
+  lines = renderer.stream.getvalue().splitlines()
+  assert lines[0].startswith("Running recipe: foo")
+  assert lines[1:] == [
+    "  noop1" + "." * 23 + " [changed]",
+    "  noop2" + "." * 23 + " [skipped]",
+    "  noop3" + "." * 23 + " [error]",
+  ]
+
+  # Sinks can also be given by the config.
+  kwargs_.update(
+    config=types.Config(event_sinks=["tests.test_controller:Recorder"]),
+    recipes=[types.Recipe(name="foo", actions=actions[:1])],
+  )
+  controller = Controller(**kwargs_)
+  controller.run()
+  recorder = controller.bus.sinks[0]
+  assert isinstance(recorder, Recorder)
+  assert [e.name for e in recorder.events] == [
+    "run.start",
+    "recipe.start",
+    "action.start",
+    "action.finish",
+    "recipe.finish",
+    "run.finish",
+  ]
+
+  # Only the facts whose values changed are recorded.
+  fact_actions = [
+    types.Action(
+      name=name,
+      kind="command",
+      kwargs={"command": ["echo", value], "fact": "foo"},
+    )
+    for name, value in [("a", "x"), ("b", "x"), ("c", "y")]
+  ]
+  kwargs_.update(recipes=[types.Recipe(name="foo", actions=fact_actions)])
+  controller = Controller(**kwargs_)
+  controller.run()
+  recorder = controller.bus.sinks[0]
+  assert isinstance(recorder, Recorder)
+  assert [
+    e.facts for e in recorder.events if isinstance(e, events.ActionFinished)
+  ] == [{"foo": "x"}, {}, {"foo": "y"}]
+
+
+def test_undefined_facts():
+  actions = [
+    types.Action(name="a", kind="command", kwargs={"command": ["{foo}"]}),
+    types.Action(
+      name="b",
+      kind="command",
+      kwargs={"command": ["true"], "fact": "bar"},
+    ),
+    types.Action(name="c", kind="command", kwargs={"command": ["{bar}"]}),
+    types.Action(
+      name="d",
+      kind="command",
+      kwargs={"command": ["{baz.x}", "{home}"], "creates": "{foo}"},
+    ),
+    types.Action(
+      name="e",
+      kind="command",
+      kwargs={"command": ["{qux}"]},
+      tags=["foo"],
+    ),
+  ]
+
+  # Raise an error listing every fact which is neither known nor provided by
+  # an earlier action, without running anything.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(recipes=[types.Recipe(name="foo", actions=actions)])
+  controller = Controller(**kwargs_)
+  with mock.patch("setuppy.commands.command.run_command") as run_command:
+    with pytest.raises(types.SetuppyError) as e:
+      controller.run()
+  assert str(e.value) == (
+    'undefined facts in actions: "a" ("foo"), "d" ("baz", "foo")'
+  )
+  run_command.assert_not_called()
+
+  # Raise an error if a string can't be parsed.
+  actions = [types.Action(name="a", kind="command", kwargs={"command": ["}"]})]
+  kwargs_.update(recipes=[types.Recipe(name="foo", actions=actions)])
+  with pytest.raises(types.SetuppyError):
+    Controller(**kwargs_).run()
+
 
 def test_facts():
   with mock.patch("os.uname") as uname:
@@ -152,3 +390,214 @@ def test_facts():
     uname.return_value.sysname = "foobarbaz"
     with pytest.raises(types.SetuppyError):
       Controller(**KWARGS)
+
+
+@pytest.mark.parametrize("verbosity", [0, 1])
+def test_run_batch(verbosity: int):
+  actions = [
+    types.Action(name="b1", kind="batched", register="foo"),
+    types.Action(name="b2", kind="batched", kwargs={"changed": True}),
+    types.Action(name="b3", kind="batched", register="bar"),
+    types.Action(name="b4", kind="batched", kwargs={"key": "bar"}),
+    types.Action(name="b5", kind="batched", parents=["foo"]),
+    types.Action(name="b6", kind="batched", kwargs={"key": "{baz}"}),
+    types.Action(name="b7", kind="batched"),
+  ]
+
+  # Consecutive actions with the same key are batched, but actions with
+  # parents, a different key or a key that can't be formatted are not.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(
+    recipes=[types.Recipe(name="batched", actions=actions)],
+    verbosity=verbosity,
+  )
+  controller = Controller(**kwargs_)
+  BATCHES.clear()
+  controller.run()
+  assert BATCHES == [3, 1, 1, 1]
+  assert controller.registry == {"foo": False, "bar": False}
+
+  # Raise an exception, with an error status, if a batch raises.
+  controller = Controller(**kwargs_)
+  with mock.patch.object(Batched, "run_batch", side_effect=RuntimeError):
+    with pytest.raises(RuntimeError):
+      controller.run()
+
+  # Actions which use a fact provided by the pending batch aren't batched with
+  # it, since their keys depend on its value once the batch has run.
+  actions = [
+    types.Action(name="b1", kind="batched", kwargs={"fact": "baz"}),
+    types.Action(name="b2", kind="batched"),
+    types.Action(
+      name="b3", kind="batched", kwargs={"key": "{baz}", "compile": True}
+    ),
+    types.Action(name="b4", kind="batched", kwargs={"key": "bar"}),
+  ]
+  kwargs_.update(
+    recipes=[types.Recipe(name="batched", actions=actions)],
+    variables={"baz": "foo"},
+  )
+  BATCHES.clear()
+  Controller(**kwargs_).run()
+  assert BATCHES == [2, 2]
+
+
+def test_run_batch_errors():
+  actions = [
+    types.Action(name="b1", kind="batched", register="b1"),
+    types.Action(name="b2", kind="batched", kwargs={"raises": True}),
+    types.Action(name="b3", kind="batched", register="b3"),
+  ]
+
+  # If a batch raises its actions are run one at a time, so that only those
+  # which raise fail.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(recipes=[types.Recipe(name="batched", actions=actions)])
+  controller = Controller(**kwargs_, sinks=[Recorder()])
+  BATCHES.clear()
+  with pytest.raises(RuntimeError):
+    controller.run()
+  assert BATCHES == [3, 1, 1, 1]
+  assert controller.registry == {"b1": False, "b3": False}
+  recorder = controller.bus.sinks[0]
+  assert isinstance(recorder, Recorder)
+  assert [
+    (e.name, e.action)
+    for e in recorder.events
+    if isinstance(e, events.ActionStarted)
+  ] == [
+    ("action.start", "b1"),
+    ("action.start", "b2"),
+    ("action.start", "b3"),
+    ("action.finish", "b1"),
+    ("action.error", "b2"),
+    ("action.finish", "b3"),
+  ]
+
+
+def test_run_stubs():
+  recipes = [
+    types.Recipe(name="foo", actions=[types.Action(name="a", kind="noop")]),
+    types.Recipe(
+      name="bar",
+      actions=[types.Action(name="b", kind="noop", tags=["bar"])],
+    ),
+    types.Recipe(
+      name="baz",
+      actions=[types.Action(name="c", kind="noop")],
+      tags=["baz"],
+    ),
+  ]
+  stubs = [RecipeStub.from_recipe(mock.MagicMock(), r) for r in recipes]
+
+  # Tags are validated from the stubs, and only recipes with an action which
+  # could run are loaded.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(recipes=stubs)
+  with mock.patch.object(RecipeStub, "load", autospec=True) as load:
+    load.side_effect = lambda stub: recipes[stubs.index(stub)]
+    Controller(**kwargs_).run()
+    assert [call.args[0].name for call in load.call_args_list] == ["foo"]
+
+  # If we're verbose enough to output skipped actions the recipe is loaded.
+  kwargs_.update(tags=["baz"], verbosity=2)
+  with mock.patch.object(RecipeStub, "load", autospec=True) as load:
+    load.side_effect = lambda stub: recipes[stubs.index(stub)]
+    Controller(**kwargs_).run()
+    names = [call.args[0].name for call in load.call_args_list]
+    assert sorted(names) == ["bar", "baz", "foo"]
+
+
+@pytest.mark.parametrize("simulate", [False, True])
+def test_run_checks(simulate: bool):
+  CHECKS.update(a=False, b=True, c=None)
+  RUNS.clear()
+  actions = [
+    types.Action(name=n, kind="checked", kwargs={"name": n}) for n in "abc"
+  ]
+
+  # Actions whose checks say there's nothing to do aren't run, and when
+  # simulating neither are actions whose checks are conclusive.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(
+    recipes=[types.Recipe(name="checked", actions=actions)],
+    simulate=simulate,
+  )
+  controller = Controller(**kwargs_)
+  controller.run()
+  assert RUNS == (["c"] if simulate else ["b", "c"])
+  checks = {key: checked for key, (checked, _) in controller.checks.items()}
+  assert checks == {id(a): CHECKS[a.name] for a in actions}
+
+
+def test_run_stale_checks(tmp_path: pathlib.Path):
+  flag = str(tmp_path / "flag")
+  actions = [
+    types.Action(
+      name="touch",
+      kind="command",
+      kwargs={"command": ["touch", flag], "creates": flag},
+    ),
+    types.Action(
+      name="removes",
+      kind="command",
+      kwargs={"command": ["true"], "removes": flag},
+      register="removes",
+    ),
+    types.Action(
+      name="onlyif",
+      kind="command",
+      kwargs={"command": ["true"], "onlyif": ["test", "-e", flag]},
+      register="onlyif",
+    ),
+    types.Action(
+      name="creates",
+      kind="command",
+      kwargs={"command": ["rm", flag], "creates": flag},
+      register="creates",
+    ),
+  ]
+
+  # Guards which an earlier action makes true are evaluated after it runs, and
+  # checks made before it ran are checked again.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(recipes=[types.Recipe(name="foo", actions=actions)])
+  controller = Controller(**kwargs_)
+  controller.run()
+  assert controller.registry == {
+    "removes": True,
+    "onlyif": True,
+    "creates": False,
+  }
+  assert pathlib.Path(flag).exists()
+
+
+@pytest.mark.parametrize("safe", [False, True])
+def test_run_simulated_facts(tmp_path: pathlib.Path, safe: bool):
+  flag = str(tmp_path / "flag")
+  actions = [
+    types.Action(
+      name="fact",
+      kind="command",
+      kwargs={"command": ["echo", flag], "fact": "flag", "safe": safe},
+    ),
+    types.Action(
+      name="touch",
+      kind="command",
+      kwargs={"command": ["touch", "{flag}"]},
+      register="touch",
+    ),
+  ]
+
+  # Facts are only set when simulating if their commands are safe; otherwise
+  # the actions which use them can't be simulated and are assumed to change.
+  kwargs_ = ControllerKwargs(**KWARGS)
+  kwargs_.update(
+    recipes=[types.Recipe(name="foo", actions=actions)],
+    simulate=True,
+  )
+  controller = Controller(**kwargs_)
+  controller.run()
+  assert controller.facts.get("flag") == (flag if safe else None)
+  assert controller.registry == {"touch": True}
+  assert not pathlib.Path(flag).exists()
@@ -91,3 +91,18 @@ def test_command_fails(
   curl = Curl([URL], dest=DEST)
   with pytest.raises(SetuppyError):
     curl(facts={}, simulate=False)
+
+
+def test_check(fs: FakeFilesystem):
+  # The check is inconclusive for invalid suffixes or targets.
+  curl = Curl(sources=["http://foo.com/bar.tar.gz"], dest=DEST)
+  assert curl.check({}) is None
+  curl = Curl(sources=[URL], dest=DEST)
+  fs.create_file(TARGET)
+  assert curl.check({}) is None
+
+  # Otherwise it depends on whether the target exists.
+  fs.remove(TARGET)
+  assert curl.check({}) is True
+  fs.create_dir(TARGET)
+  assert curl.check({}) is False
@@ -0,0 +1,126 @@
+"""Tests for the event bus."""
+
+import threading
+
+import pytest
+
+from setuppy import events
+from setuppy import types
+from setuppy.commands import utils
+
+
+class Recorder(events.Sink):
+  """Sink which records every event, optionally waiting before each one."""
+
+  def __init__(self, wait: threading.Event | None = None):
+    """Initialize the sink."""
+    self.events: list[events.Event] = []
+    self.threads: set[str] = set()
+    self.closed = False
+    self.wait = wait
+
+  def handle(self, event: events.Event):
+    """Record the event."""
+    if self.wait is not None:
+      self.wait.wait()
+    self.events.append(event)
+    self.threads.add(threading.current_thread().name)
+
+  def close(self):
+    """Record that the sink was closed."""
+    self.closed = True
+
+
+class Broken(events.Sink):
+  """Sink which raises on every event."""
+
+  def handle(self, event: events.Event):
+    """Raise an error."""
+    raise RuntimeError
+
+
+def test_bus():
+  # Events are delivered to every sink, in order, by a background thread.
+  recorder = Recorder()
+  bus = events.EventBus([Broken()])
+  bus.subscribe(recorder)
+  bus.emit(events.RunStarted(tags=[], simulate=False))
+  bus.emit(events.RunFinished(duration=1.0))
+  bus.close()
+  assert [e.name for e in recorder.events] == ["run.start", "run.finish"]
+  assert recorder.threads == {"setuppy-events"}
+  assert recorder.closed
+
+
+def test_bus_async():
+  # A slow sink doesn't stall emitting events.
+  wait = threading.Event()
+  recorder = Recorder(wait)
+  bus = events.EventBus([recorder])
+  for _ in range(10):
+    bus.emit(events.RunFinished(duration=0))
+  assert not recorder.events
+
+  # And every event is delivered once the bus is closed.
+  wait.set()
+  bus.close()
+  assert len(recorder.events) == 10
+
+
+def test_bus_closed():
+  # Events emitted after the bus is closed are dropped.
+  recorder = Recorder()
+  bus = events.EventBus([recorder])
+  bus.close()
+  bus.emit(events.RunFinished(duration=0))
+  assert bus._thread is None
+  assert not recorder.events
+
+  # Closing it again does nothing.
+  recorder.closed = False
+  bus.close()
+  assert not recorder.closed
+
+
+def test_bus_without_sinks():
+  # Without any sinks nothing is dispatched.
+  bus = events.EventBus()
+  bus.emit(events.RunFinished(duration=0))
+  assert bus._thread is None
+  bus.close()
+
+
+def test_load_sink():
+  # Sinks are created from "module:name".
+  sink = events.load_sink("tests.test_events:Recorder")
+  assert isinstance(sink, Recorder)
+
+  # Raise an error if it can't be loaded or isn't a sink.
+  with pytest.raises(types.SetuppyError):
+    events.load_sink("tests.test_events:Missing")
+  with pytest.raises(types.SetuppyError):
+    events.load_sink("builtins:dict")
+
+  # Sinks must handle events.
+  with pytest.raises(types.SetuppyError):
+    events.load_sink("setuppy.events:Sink")
+
+
+def test_subprocess_events():
+  # Processes spawned by the executor are reported to the global bus.
+  recorder = Recorder()
+  events.set_bus(events.EventBus([recorder]))
+  executor = utils.Executor()
+  with executor.label("foo"):
+    executor.run(["true"])
+  events.get_bus().close()
+
+  assert [e.name for e in recorder.events] == [
+    "subprocess.start",
+    "subprocess.finish",
+  ]
+  finished = recorder.events[1]
+  assert isinstance(finished, events.SubprocessFinished)
+  assert finished.label == "foo"
+  assert finished.command.endswith("true")
+  assert finished.duration >= 0
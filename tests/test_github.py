@@ -110,7 +110,7 @@ def test_command_runs(
   github = Github(sources=[SOURCE], dest="/")
   rv = github(facts={}, simulate=False)
   assert rv.changed
-  run_command.assert_called_once_with(CMD_CLONE)
+  run_command.assert_called_once_with(CMD_CLONE, stream=True)
 
 
 def test_command_simulate(
@@ -133,4 +133,24 @@ def test_command_fails(
   github = Github(sources=[SOURCE], dest="/")
   with pytest.raises(SetuppyError):
     github(facts={}, simulate=False)
-  run_command.assert_called_once_with(CMD_CLONE)
+  run_command.assert_called_once_with(CMD_CLONE, stream=True)
+
+
+def test_check(
+  run_command: mock.MagicMock,
+  fs: FakeFilesystem,
+):
+  # Missing repositories need to be cloned.
+  github = Github(sources=[SOURCE], dest="/")
+  assert github.check({}) is True
+  assert not run_command.called
+
+  # Existing repositories tracking the right origin are done.
+  fs.create_dir(f"{TARGET}/.git")
+  run_command.return_value = (0, URL, "")
+  assert github.check({}) is False
+  run_command.assert_called_once_with(CMD_QUERY)
+
+  # Otherwise the check is inconclusive.
+  run_command.return_value = (0, "https://foo.com", "")
+  assert github.check({}) is None
@@ -0,0 +1,64 @@
+"""Tests for the interpolation of facts."""
+
+import pickle
+from unittest import mock
+
+import pytest
+
+from setuppy import interpolate
+
+
+def test_compile():
+  # Compiled templates should render exactly as str.format would.
+  text = "{{x}} {foo} {bar[0]} {baz.real:>{width}} {foo!r} end"
+  facts = {"foo": "a", "bar": ["b"], "baz": 1, "width": 3}
+  template = interpolate.CompiledTemplate.compile(text)
+  assert template.fields == {"foo", "bar", "baz", "width"}
+  assert template.render(facts) == text.format(**facts)
+
+
+def test_render_memoized():
+  template = interpolate.CompiledTemplate.compile("{foo}/{bar}")
+
+  # Renders are reused while the facts they reference are unchanged.
+  facts = {"foo": "a", "bar": "b", "baz": "c"}
+  assert template.render(facts) == "a/b"
+  with mock.patch.object(
+    interpolate, "_format_field", wraps=interpolate._format_field
+  ) as format_field:
+    assert template.render({**facts, "baz": "d"}) == "a/b"
+  format_field.assert_not_called()
+
+  # And rendered again when they change.
+  assert template.render({**facts, "bar": "c"}) == "a/c"
+
+  # Facts which are equal but of different types may render differently.
+  template = interpolate.CompiledTemplate.compile("v={v}")
+  assert template.render({"v": 1}) == "v=1"
+  assert template.render({"v": True}) == "v=True"
+  assert template.render({"v": 1.0}) == "v=1.0"
+  template = interpolate.CompiledTemplate.compile("{foo}/{bar}")
+  assert template.render({"foo": 1, "bar": 2}) == "1/2"
+  assert template.render({"foo": 1, "bar": 2.0}) == "1/2.0"
+
+  # Memos aren't pickled.
+  template = pickle.loads(pickle.dumps(template))
+  assert template._memo == [None]
+  assert template.render(facts) == "a/b"
+
+
+def test_interpolate():
+  # Strings are interpolated as str.format would, compiling each text once.
+  interpolate.parse.cache_clear()
+  facts = {"foo": "a"}
+  assert interpolate.interpolate("{foo}/{foo!r}", facts) == "a/'a'"
+  assert interpolate.interpolate("{foo}/{foo!r}", facts) == "a/'a'"
+  assert interpolate.parse.cache_info().misses == 1
+
+  # Strings without fields aren't compiled at all.
+  assert interpolate.interpolate("foo", facts) == "foo"
+  assert interpolate.parse.cache_info().misses == 1
+
+  # Raise an error if a fact doesn't exist.
+  with pytest.raises(KeyError):
+    interpolate.interpolate("{bar}", facts)
@@ -0,0 +1,57 @@
+"""Tests for the metrics exporter."""
+
+import os
+import pathlib
+
+from setuppy import events
+from setuppy import metrics
+
+
+def test_histogram():
+  # Values go in the smallest bucket which holds them, if any.
+  histogram = metrics.Histogram([1.0, 2.0])
+  for value in [0.5, 1.0, 1.5, 3.0]:
+    histogram.observe(value)
+  assert histogram.counts == [2, 1]
+  assert histogram.count == 4
+  assert histogram.sum == 6.0
+
+
+def test_metrics_sink(tmp_path: pathlib.Path):
+  path = tmp_path / "setuppy.prom"
+  sink = metrics.MetricsSink(path, buckets=[1.0])
+  action = {"recipe": "foo", "kind": "noop", "tags": []}
+  sink.handle(events.RecipeFinished(recipe="foo", duration=2.0))
+  sink.handle(
+    events.ActionFinished(**action, action="a", duration=0.5, changed=True)
+  )
+  sink.handle(
+    events.ActionFailed(**action, action='b"', duration=0.5, error="bar")
+  )
+  sink.handle(events.RunFinished(duration=3.0, error="bar", time=10.0))
+  sink.close()
+
+  # Every metric is written, with escaped labels.
+  text = path.read_text()
+  assert "setuppy_run_duration_seconds 3.0\n" in text
+  assert "setuppy_run_success 0\n" in text
+  assert "setuppy_run_timestamp_seconds 10.0\n" in text
+  assert (
+    'setuppy_recipe_duration_seconds_bucket{recipe="foo",le="1.0"} 0\n'
+  ) in text
+  assert (
+    'setuppy_recipe_duration_seconds_bucket{recipe="foo",le="+Inf"} 1\n'
+  ) in text
+  assert 'setuppy_recipe_duration_seconds_count{recipe="foo"} 1\n' in text
+  labels = '{recipe="foo",action="a",kind="noop"}'
+  assert f"setuppy_action_duration_seconds_sum{labels} 0.5\n" in text
+  assert f"setuppy_actions_changed_total{labels} 1\n" in text
+  assert f"setuppy_actions_failed_total{labels} 0\n" in text
+  labels = '{recipe="foo",action="b\\"",kind="noop"}'
+  assert f"setuppy_actions_failed_total{labels} 1\n" in text
+  assert "# TYPE setuppy_action_duration_seconds histogram\n" in text
+
+  # And no temporary files are left behind, while the file can be read by
+  # collectors which run as another user.
+  assert os.listdir(tmp_path) == ["setuppy.prom"]
+  assert path.stat().st_mode & 0o777 == 0o644
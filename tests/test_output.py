@@ -0,0 +1,127 @@
+"""Tests for the output of a run's progress."""
+
+import io
+import json
+
+import click
+
+from setuppy import events
+from setuppy import output
+
+
+def test_renderer():
+  # Lines are buffered until flushed.
+  stream = io.StringIO()
+  renderer = output.Renderer(stream=stream, live=False)
+  renderer.start("foo", "foo")
+  renderer.echo("foo")
+  renderer.echo("bar")
+  assert stream.getvalue() == ""
+  renderer.close()
+  assert stream.getvalue() == "foo\nbar\n"
+
+  # Nothing is written if there is nothing to output.
+  renderer.flush()
+  assert stream.getvalue() == "foo\nbar\n"
+
+
+def test_renderer_thread():
+  # Lines are written by the background thread after the interval.
+  stream = io.StringIO()
+  renderer = output.Renderer(stream=stream, interval=0.01, live=False)
+  renderer.echo("foo")
+  renderer._stop.wait(0.5)
+  assert stream.getvalue() == "foo\n"
+  renderer.close()
+  assert renderer._thread is None
+
+
+def test_renderer_live():
+  stream = io.StringIO()
+  renderer = output.Renderer(stream=stream, live=True)
+
+  # Actions in progress are shown below the output.
+  renderer.start("foo", "foo")
+  renderer.echo("bar")
+  renderer.flush()
+  assert click.unstyle(stream.getvalue()) == "bar\n  foo [0s]\n"
+
+  # Which is cleared when it's redrawn.
+  renderer.stop("foo")
+  renderer.echo("baz")
+  renderer.close()
+  assert stream.getvalue().endswith("\x1b[1F\x1b[Jbaz\n")
+
+
+def test_renderer_suspend():
+  stream = io.StringIO()
+  renderer = output.Renderer(stream=stream, live=True)
+  renderer.start("foo", "foo")
+  renderer.flush()
+
+  # Suspending writes any buffered lines and clears the status area.
+  renderer.echo("bar")
+  with renderer.suspend():
+    assert stream.getvalue().endswith("\x1b[1F\x1b[Jbar\n")
+
+    # After which nothing is written until it's resumed.
+    written = stream.getvalue()
+    renderer.echo("baz")
+    renderer.flush()
+    assert stream.getvalue() == written
+
+  # When the status area is drawn again without clearing anything.
+  renderer.flush()
+  assert click.unstyle(stream.getvalue()[len(written):]) == "baz\n  foo [0s]\n"
+  renderer.close()
+
+
+def test_console_sink():
+  stream = io.StringIO()
+  sink = output.ConsoleSink(2, output.Renderer(stream=stream, live=False))
+  action = {"recipe": "foo", "kind": "noop", "tags": ["baz"]}
+
+  # Recipes and actions are output with their status.
+  sink.handle(events.RecipeStarted(recipe="foo", tags=[]))
+  sink.handle(events.ActionStarted(**action, action="a"))
+  sink.handle(
+    events.ActionFinished(**action, action="a", duration=0, changed=True)
+  )
+  sink.handle(events.ActionSkipped(**action, action="b"))
+  sink.handle(
+    events.ActionFailed(**action, action="c", duration=0, error="bar")
+  )
+
+  # Events which aren't output are ignored.
+  sink.handle(events.RunFinished(duration=0))
+  sink.close()
+
+  assert stream.getvalue().splitlines() == [
+    "Running recipe: foo...........",
+    "  a" + "." * 27 + " [changed]",
+    "  b" + "." * 27 + " [skipped]",
+    "  c" + "." * 27 + " [error]",
+  ]
+
+  # Tags are only output at the highest verbosity.
+  stream = io.StringIO()
+  sink = output.ConsoleSink(3, output.Renderer(stream=stream, live=False))
+  sink.handle(events.ActionSkipped(**action, action="b"))
+  sink.close()
+  assert stream.getvalue() == (
+    "  b" + "." * 27 + " [baz]" + "." * 24 + " [skipped]\n"
+  )
+
+
+def test_event_log():
+  # Each event is written as a line of JSON.
+  stream = io.StringIO()
+  log = output.EventLog(stream)
+  log.handle(events.RecipeStarted(recipe="foo", tags=[]))
+  log.handle(events.RecipeFinished(recipe="foo", duration=1.0))
+  log.close()
+  records = [json.loads(line) for line in stream.getvalue().splitlines()]
+  assert [r["event"] for r in records] == ["recipe.start", "recipe.finish"]
+  assert records[1]["recipe"] == "foo"
+  assert records[1]["duration"] == 1.0
+  assert records[0]["time"] <= records[1]["time"]
@@ -0,0 +1,90 @@
+"""Test for loading recipes."""
+
+import pathlib
+from unittest import mock
+
+import pytest
+
+from setuppy import recipes as recipes_lib
+from setuppy.types import SetuppyError
+
+
+def write_recipe(path: pathlib.Path, name: str):
+  path.write_text(
+    f'name = "{name}"\n'
+    "[[actions]]\n"
+    'name = "foo"\n'
+    'kind = "command"\n'
+    'kwargs = {command = ["ls"]}\n'
+  )
+
+
+def test_load_recipes(tmp_path: pathlib.Path):
+  paths = [tmp_path / f"{i}.toml" for i in range(3)]
+  for i, path in enumerate(paths):
+    write_recipe(path, f"recipe{i}")
+
+  # Recipes are loaded in order.
+  recipes = recipes_lib.load_recipes(paths)
+  assert [r.name for r in recipes] == ["recipe0", "recipe1", "recipe2"]
+  assert recipes[0].actions[0].kwargs == {"command": ["ls"]}
+
+  # Unmodified recipes are loaded from the cache.
+  with mock.patch.object(recipes_lib, "_parse_recipe") as parse:
+    assert recipes_lib.load_recipes(paths) == recipes
+    assert not parse.called
+
+  # Only modified recipes are parsed again.
+  write_recipe(paths[1], "recipe1-modified")
+  with mock.patch.object(
+    recipes_lib, "_parse_recipe", wraps=recipes_lib._parse_recipe
+  ) as parse:
+    recipes = recipes_lib.load_recipes(paths)
+    parse.assert_called_once_with(paths[1])
+  assert [r.name for r in recipes] == ["recipe0", "recipe1-modified", "recipe2"]
+
+  # Every recipe is parsed again if the format of the cache changes.
+  with (
+    mock.patch.object(recipes_lib, "RECIPE_CACHE_VERSION", -1),
+    mock.patch.object(
+      recipes_lib, "_parse_recipe", wraps=recipes_lib._parse_recipe
+    ) as parse,
+  ):
+    assert recipes_lib.load_recipes(paths) == recipes
+    assert parse.call_count == 3
+
+  # Raise an error naming the recipe if it can't be parsed.
+  paths[0].write_text('name = "foo"\nbar = 1\n')
+  with pytest.raises(SetuppyError, match=str(paths[0])):
+    recipes_lib.load_recipes(paths)
+  paths[0].write_text("name = 1\n")
+  with pytest.raises(SetuppyError, match=str(paths[0])):
+    recipes_lib.load_recipes(paths)
+
+
+def test_load_recipes_parallel(tmp_path: pathlib.Path):
+  # Many modified recipes are parsed by a pool of processes.
+  paths = [tmp_path / f"{i}.toml" for i in range(4)]
+  for i, path in enumerate(paths):
+    write_recipe(path, f"recipe{i}")
+  with mock.patch.object(recipes_lib, "PARALLEL_THRESHOLD", 2):
+    recipes = recipes_lib.load_recipes(paths, jobs=2)
+  assert [r.name for r in recipes] == [f"recipe{i}" for i in range(4)]
+
+
+def test_index_recipes(tmp_path: pathlib.Path):
+  paths = [tmp_path / f"{i}.toml" for i in range(2)]
+  for i, path in enumerate(paths):
+    write_recipe(path, f"recipe{i}")
+
+  # Stubs summarize each recipe and can load it.
+  stubs = recipes_lib.index_recipes(paths)
+  assert [s.name for s in stubs] == ["recipe0", "recipe1"]
+  assert stubs[0].action_tags == [[]]
+  assert stubs[0].load().actions[0].name == "foo"
+
+  # Unmodified recipes are indexed from the cache without loading them.
+  with mock.patch.object(recipes_lib, "load_recipes") as load_recipes:
+    load_recipes.return_value = []
+    assert recipes_lib.index_recipes(paths) == stubs
+    load_recipes.assert_called_once_with([])
@@ -1,5 +1,7 @@
 """Test for the github command."""
 
+import os
+import pathlib
 import textwrap
 from collections.abc import Iterable
 from unittest import mock
@@ -7,6 +9,7 @@ from unittest import mock
 import pytest
 from pyfakefs.fake_filesystem import FakeFilesystem
 
+from setuppy import cache
 from setuppy.commands import stow as stow_lib
 from setuppy.types import SetuppyError
 
@@ -26,14 +29,16 @@ def test_stow(
   run_command: mock.MagicMock,
   fs: FakeFilesystem,
 ):
-  # We'll test the version code elsewhere, so just mock it here.
+  # We'll test the version code elsewhere, so just mock it here. The stow
+  # executable still needs to exist for its version to be cached.
   get_stow_version.return_value = "2.3.1"
+  fs.create_file("/usr/bin/stow", st_mode=0o100755)
 
   # Create the command to test.
   package = "foo"
   stowdir = "/stow"
   targetdir = "/home"
-  stow = stow_lib.Stow(package, stowdir, targetdir)
+  stow = stow_lib.Stow(package, stowdir, targetdir, native=False)
 
   # Raise an exception if the stowdir doesn't exist.
   with pytest.raises(SetuppyError):
@@ -54,7 +59,9 @@ def test_stow(
   cmd = f"stow -v --no-folding -d {stowdir} -t {targetdir} -R {package}"
   run_command.assert_called_once_with(cmd.split())
 
-  # Call the simulate command.
+  # Call the simulate command. Forget the package's fingerprint first, since
+  # otherwise stow would be skipped.
+  cache.set_cache(cache.Cache())
   run_command.reset_mock()
   rv = stow(facts={}, simulate=True)
   assert not rv.changed
@@ -73,6 +80,7 @@ def test_stow(
 
   # Raise an exception if there was an error with the command. Note that here
   # there aren't any matching conflicts. We'll check that in another test.
+  cache.set_cache(cache.Cache())
   run_command.return_value = (1, "", "")
   with pytest.raises(SetuppyError):
     stow(facts={}, simulate=False)
@@ -120,3 +128,178 @@ def test_conflicts():
   """.strip()  # noqa: E501
   conflicts = stow_lib._get_conflicts_from_stderr(stderr, "2.4.0")
   assert conflicts == {"foo", "bar"}
+
+
+def test_native(
+  run_command: mock.MagicMock,
+  fs: FakeFilesystem,
+):
+  # Create a package with nested files and some that stow should ignore.
+  fs.create_file("/stow/foo/.bashrc")
+  fs.create_file("/stow/foo/.config/foo/config")
+  fs.create_file("/stow/foo/README.md")
+  fs.create_file("/stow/foo/.config/README.md")
+  fs.create_dir("/home")
+  stow = stow_lib.Stow("foo", "/stow", "/home", native=True)
+
+  # Stow's version is only set when stow is run, so it isn't declared as a
+  # fact whether or not stow is run natively.
+  assert stow.provides() == set()
+  assert stow_lib.Stow("foo").provides() == set()
+
+  # The check is inconclusive until the package is known to be stowed.
+  assert stow.check({}) is None
+
+  # Simulating shouldn't change anything.
+  rv = stow(facts={}, simulate=True)
+  assert rv.changed
+  assert not os.path.lexists("/home/.bashrc")
+
+  # Stowing should create relative links, with real directories.
+  rv = stow(facts={}, simulate=False)
+  assert rv.changed
+  assert os.readlink("/home/.bashrc") == "../stow/foo/.bashrc"
+  assert not os.path.islink("/home/.config")
+  assert os.readlink("/home/.config/foo/config") == (
+    "../../../stow/foo/.config/foo/config"
+  )
+  assert os.readlink("/home/.config/README.md") == (
+    "../../stow/foo/.config/README.md"
+  )
+  assert not os.path.lexists("/home/README.md")
+
+  # Restowing an unchanged package is a no-op, which the check can tell.
+  assert stow.check({}) is False
+  rv = stow(facts={}, simulate=False)
+  assert not rv.changed
+
+  # Links to files removed from the package should be removed, while links to
+  # anything else should be left alone.
+  os.symlink("../elsewhere", "/home/.other")
+  pathlib.Path("/stow/foo/.bashrc").unlink()
+  rv = stow(facts={}, simulate=False)
+  assert rv.changed
+  assert not os.path.lexists("/home/.bashrc")
+  assert os.path.islink("/home/.other")
+
+  # We never run stow itself.
+  assert not run_command.called
+
+
+def test_native_conflicts(fs: FakeFilesystem):
+  # Raise an error, and change nothing, if targets exist and aren't ours.
+  fs.create_file("/stow/foo/.bashrc")
+  fs.create_file("/stow/foo/.vimrc")
+  fs.create_file("/stow/foo/.zshrc")
+  fs.create_file("/stow/bar/.zshrc")
+  fs.create_file("/home/.bashrc")
+  os.symlink("../stow/bar/.zshrc", "/home/.zshrc")
+  stow = stow_lib.Stow("foo", "/stow", "/home", native=True)
+  with pytest.raises(SetuppyError) as excinfo:
+    stow(facts={}, simulate=False)
+  assert '"/home/.bashrc"' in str(excinfo.value)
+  assert '"/home/.zshrc"' in str(excinfo.value)
+  assert not os.path.lexists("/home/.vimrc")
+
+
+def test_native_ignore(fs: FakeFilesystem):
+  # A package's .stow-local-ignore replaces the default ignore list.
+  fs.create_file("/stow/foo/.stow-local-ignore", contents="# foo\n\\.bashrc\n")
+  fs.create_file("/stow/foo/.bashrc")
+  fs.create_file("/stow/foo/README.md")
+  fs.create_dir("/home")
+  stow = stow_lib.Stow("foo", "/stow", "/home", native=True)
+  stow(facts={}, simulate=False)
+  assert sorted(os.listdir("/home")) == ["README.md"]
+
+  # Raise an error if the ignore list can't be parsed.
+  pathlib.Path("/stow/foo/.stow-local-ignore").write_text("(")
+  with pytest.raises(SetuppyError):
+    stow(facts={}, simulate=False)
+
+
+def test_packages(
+  run_command: mock.MagicMock,
+  fs: FakeFilesystem,
+):
+  # Stow a list of packages with a single call to stow.
+  fs.create_dir("/stow/foo")
+  fs.create_dir("/stow/bar")
+  fs.create_file("/stow/bar/.barrc")
+  stow = stow_lib.Stow(
+    packages=["foo", "bar"], stowdir="/stow", targetdir="/home", native=False
+  )
+  run_command.return_value = (0, "", "LINK: .barrc => ../stow/bar/.barrc")
+  rv = stow(facts={"stow_version": "2.3.1"}, simulate=False)
+  assert rv.changed
+  cmd = "stow -v --no-folding -d /stow -t /home -R foo bar"
+  run_command.assert_called_once_with(cmd.split())
+
+  # Batch two stow commands and attribute changes to each of them.
+  cache.set_cache(cache.Cache())
+  stows = [
+    stow_lib.Stow("foo", "/stow", "/home", native=False),
+    stow_lib.Stow("bar", "/stow", "/home", native=False),
+  ]
+  assert stows[0].batch_key({}) == stows[1].batch_key({})
+  run_command.reset_mock()
+  rvs = stow_lib.Stow.run_batch(
+    stows, facts={"stow_version": "2.3.1"}, simulate=False
+  )
+  assert [rv.changed for rv in rvs] == [False, True]
+  run_command.assert_called_once_with(cmd.split())
+
+  # Raise an exception if no package is given.
+  with pytest.raises(SetuppyError):
+    stow_lib.Stow(stowdir="/stow")(facts={"home": "/home"}, simulate=False)
+
+
+def test_changes(fs: FakeFilesystem):
+  fs.create_file("/stow/foo/.foorc")
+  fs.create_file("/stow/bar/.barrc")
+  packages = ["foo", "bar", "baz"]
+  stderr = textwrap.dedent("""
+  UNLINK: .foorc
+  LINK: .foorc => ../stow/foo/.foorc
+  UNLINK: .barrc
+  LINK: .config/bar => ../../stow/bar/.config/bar (reverts previous action)
+  UNLINK: .gone
+  """).strip()
+  changes = stow_lib._get_changes_from_stderr(
+    stderr, pathlib.Path("/stow"), pathlib.Path("/home"), packages
+  )
+  assert changes == {
+    "foo": ({".gone"}, set()),
+    "bar": ({".barrc", ".gone"}, {".config/bar"}),
+    "baz": ({".gone"}, set()),
+  }
+
+
+def test_fingerprint(
+  run_command: mock.MagicMock,
+  fs: FakeFilesystem,
+):
+  fs.create_file("/stow/foo/.foorc")
+  fs.create_dir("/home")
+  stow = stow_lib.Stow("foo", "/stow", "/home", native=False)
+
+  # Stow the package, faking the link that stow would create.
+  stow(facts={"stow_version": "2.3.1"}, simulate=False)
+  os.symlink("../stow/foo/.foorc", "/home/.foorc")
+  assert run_command.call_count == 1
+
+  # Stowing it again should be skipped since nothing has changed.
+  rv = stow(facts={}, simulate=False)
+  assert not rv.changed
+  assert run_command.call_count == 1
+
+  # Stow if the package changes.
+  fs.create_file("/stow/foo/.barrc")
+  stow(facts={"stow_version": "2.3.1"}, simulate=False)
+  assert run_command.call_count == 2
+  os.symlink("../stow/foo/.barrc", "/home/.barrc")
+
+  # Stow if a link has been removed.
+  os.unlink("/home/.foorc")
+  stow(facts={"stow_version": "2.3.1"}, simulate=False)
+  assert run_command.call_count == 3
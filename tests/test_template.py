@@ -5,6 +5,7 @@ import pathlib
 import pytest
 from pyfakefs.fake_filesystem import FakeFilesystem
 
+from setuppy import cache
 from setuppy.commands.template import Template
 from setuppy.types import SetuppyError
 
@@ -71,3 +72,91 @@ def test_simulate(fs: FakeFilesystem):
   rv = template(facts={"foo": "bar"}, simulate=True)
   assert rv.changed
   assert not pathlib.Path(DEST + "/foo/bar").exists()
+
+
+def test_compile_cached(fs: FakeFilesystem, fresh_cache: cache.Cache):
+  # Compiled templates should be cached and recompiled if the file changes.
+  fs.create_file(SOURCE + "/foo", contents="{foo}")
+  Template(SOURCE, DEST)(facts={"foo": "bar"}, simulate=True)
+  key = str(pathlib.Path(SOURCE + "/foo").absolute())
+  stamps = [cache.stamp(SOURCE + "/foo")]
+  assert fresh_cache.get("templates", key, stamps=stamps).fields == {"foo"}
+
+
+def test_templates():
+  # Only the source and dest are interpolated, not the raw globs.
+  template = Template(SOURCE, DEST, raw=["*.{ttf,otf}"])
+  assert template.templates() == [SOURCE, DEST]
+
+
+def test_missing_facts(fs: FakeFilesystem):
+  # Raise an error listing all undefined facts before writing anything.
+  fs.create_file(SOURCE + "/foo", contents="{foo}")
+  fs.create_file(SOURCE + "/bar", contents="{bar} {baz}")
+  fs.create_file(SOURCE + "/baz", contents="{baz}")
+  template = Template(SOURCE, DEST)
+  with pytest.raises(SetuppyError, match='"bar", "baz"'):
+    template(facts={"foo": "foo"}, simulate=False)
+  assert not pathlib.Path(DEST).exists()
+
+
+def test_template_tree(fs: FakeFilesystem):
+  # Create a tree of files, some of which exist, using multiple workers.
+  for i in range(3):
+    for j in range(3):
+      fs.create_file(f"{SOURCE}/{i}/{j}/file{i}{j}", contents="{foo}")
+  fs.create_file(f"{DEST}/0/0/file00", contents="bar")
+  template = Template(SOURCE, DEST, jobs=4)
+  rv = template(facts={"foo": "baz"}, simulate=False)
+  assert rv.changed
+  assert pathlib.Path(f"{DEST}/0/0/file00").read_text() == "bar"
+  assert pathlib.Path(f"{DEST}/2/2/file22").read_text() == "baz"
+
+  # Raise an error if there are no workers.
+  with pytest.raises(SetuppyError):
+    Template(SOURCE, DEST, jobs=0)
+
+
+def test_target_parent_is_file(fs: FakeFilesystem):
+  # Raise an error if the directory a target should be written to is a file.
+  fs.create_file(SOURCE + "/foo/bar", contents="foo")
+  fs.create_file(DEST + "/foo")
+  template = Template(SOURCE, DEST)
+  with pytest.raises(SetuppyError):
+    template(facts={}, simulate=False)
+
+
+def test_raw(fs: FakeFilesystem):
+  # Raw files should be copied verbatim, along with their mode.
+  data = b"\x00\xff{foo}"
+  fs.create_file(SOURCE + "/fonts/foo.ttf", contents=data, st_mode=0o100755)
+  fs.create_file(SOURCE + "/bar", contents="{foo}")
+  template = Template(SOURCE, DEST, raw=["*.ttf"])
+  rv = template(facts={"foo": "baz"}, simulate=False)
+  assert rv.changed
+  assert pathlib.Path(DEST + "/fonts/foo.ttf").read_bytes() == data
+  assert pathlib.Path(DEST + "/fonts/foo.ttf").stat().st_mode & 0o777 == 0o755
+  assert pathlib.Path(DEST + "/bar").read_text() == "baz"
+
+
+def test_binary_not_raw(fs: FakeFilesystem):
+  # Raise an error if a binary file isn't marked as raw.
+  fs.create_file(SOURCE + "/foo.ttf", contents=b"\xff\xfe\x00")
+  template = Template(SOURCE, DEST)
+  with pytest.raises(SetuppyError, match="raw"):
+    template(facts={}, simulate=False)
+
+
+def test_check(fs: FakeFilesystem):
+  # The check is inconclusive if the source or a target is invalid.
+  template = Template(SOURCE, DEST)
+  assert template.check({}) is None
+  fs.create_file(SOURCE + "/foo/bar", contents="bar")
+  fs.create_dir(DEST + "/foo/bar")
+  assert template.check({}) is None
+
+  # Otherwise it depends on whether every target exists.
+  fs.remove_object(DEST + "/foo/bar")
+  assert template.check({}) is True
+  fs.create_file(DEST + "/foo/bar")
+  assert template.check({}) is False
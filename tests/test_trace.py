@@ -0,0 +1,58 @@
+"""Test for the trace exporter."""
+
+import json
+import pathlib
+import threading
+
+from setuppy import trace
+from setuppy.commands import utils
+
+
+def test_span(tmp_path: pathlib.Path):
+  tracer = trace.Tracer()
+
+  # Spans record their name, category and args.
+  with tracer.span("foo", "action", kind="bar"):
+    pass
+
+  # Spans recorded by other threads get their own lane.
+  def record():
+    with tracer.span("baz", "action"):
+      pass
+
+  thread = threading.Thread(target=record)
+  thread.start()
+  thread.join()
+
+  tracer.save(tmp_path / "trace.json")
+  events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+  spans = [e for e in events if e["ph"] == "X"]
+  lanes = [e for e in events if e["ph"] == "M"]
+  assert [s["name"] for s in spans] == ["foo", "baz"]
+  assert spans[0]["cat"] == "action"
+  assert spans[0]["args"] == {"kind": "bar"}
+  assert spans[0]["dur"] >= 0
+  assert [s["tid"] for s in spans] == [0, 1]
+  assert len(lanes) == 2
+
+
+def test_disabled():
+  # A disabled tracer records nothing.
+  tracer = trace.Tracer(enabled=False)
+  with tracer.span("foo", "action"):
+    pass
+  assert not tracer._events
+
+
+def test_subprocess_spans():
+  # Processes spawned by the executor are traced under their label.
+  tracer = trace.Tracer()
+  trace.set_tracer(tracer)
+  executor = utils.Executor()
+  with executor.label("foo"):
+    executor.run(["true"])
+
+  spans = [e for e in tracer._events if e["ph"] == "X"]
+  assert len(spans) == 1
+  assert spans[0]["cat"] == "subprocess"
+  assert spans[0]["args"] == {"label": "foo"}
@@ -0,0 +1,46 @@
+"""Test for the resource usage accounting."""
+
+import json
+import pathlib
+import subprocess
+
+from setuppy import usage as usage_lib
+
+
+def test_measure():
+  # The CPU time of finished child processes is included.
+  with usage_lib.measure() as usage:
+    subprocess.run(
+      ["sh", "-c", "i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done"],
+      check=True,
+    )
+  assert usage.wall_time > 0
+  assert usage.cpu_time > 0
+  assert usage.cpu_time == usage.user_time + usage.sys_time
+
+
+def test_accumulate():
+  # Usage is summed except for the peak, which is the max.
+  usage = usage_lib.Usage(1.0, 1.0, 1.0, 10, 1, 1)
+  usage += usage_lib.Usage(1.0, 1.0, 1.0, 5, 1, 1)
+  assert usage == usage_lib.Usage(2.0, 2.0, 2.0, 10, 2, 2)
+
+
+def test_summary_and_report(tmp_path: pathlib.Path):
+  usage = {
+    "foo": usage_lib.Usage(user_time=1.0),
+    "bar": usage_lib.Usage(user_time=2.0),
+    "baz": usage_lib.Usage(user_time=3.0),
+  }
+
+  # The summary shows the heaviest actions first.
+  lines = usage_lib.format_summary(usage, limit=2).splitlines()
+  assert len(lines) == 3
+  assert lines[1].startswith("baz")
+  assert lines[2].startswith("bar")
+
+  # The report contains every action.
+  usage_lib.save_report(tmp_path / "usage.json", usage)
+  report = json.loads((tmp_path / "usage.json").read_text())
+  assert set(report) == {"foo", "bar", "baz"}
+  assert report["foo"]["cpu_time"] == 1.0